@@ -12,6 +12,39 @@ export const processImages = async (images) => {
   return response.data;
 };
 
+// Streams addresses as they are extracted, onAddress(index, address) is called for every
+// NDJSON line received from the server
+export const processImagesStream = async (images, onAddress) => {
+  const formData = new FormData();
+  images.forEach((image) => formData.append('images', image));
+
+  const response = await fetch('/process-images/stream', {
+    method: 'POST',
+    body: formData,
+  });
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    const lines = buffer.split('\n');
+    buffer = lines.pop();
+    lines
+      .filter((line) => line.trim())
+      .forEach((line) => {
+        const message = JSON.parse(line);
+        if (message.error) {
+          console.error(message.error);
+          return;
+        }
+        onAddress(message.index, message.address);
+      });
+  }
+};
+
 export const refetchCoordinates = async (addresses) => {
   const response = await axios.post('/refetch-coordinates', addresses);
   return response.data;
@@ -1,5 +1,5 @@
 import React, { useState } from 'react';
-import { processImages } from '../api';
+import { processImagesStream } from '../api';
 import { Cat } from 'lucide-react';
 
 const ImageUpload = ({ setAddresses }) => {
@@ -12,8 +12,13 @@ const ImageUpload = ({ setAddresses }) => {
 
   const handleExtractAddresses = async () => {
     setLoading(true);
-    const result = await processImages(images);
-    setAddresses(result);
+    // Show addresses as soon as they come in, in the order of the job list
+    const received = [];
+    await processImagesStream(images, (index, address) => {
+      received[index] = address;
+      setAddresses(received.filter(Boolean));
+    });
+    setAddresses(received.filter(Boolean));
     setLoading(false);
   };
 
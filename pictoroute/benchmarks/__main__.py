@@ -0,0 +1,166 @@
+"""
+Benchmark suite, runs offline against local stubs of the vision API and Nominatim.
+
+Usage:
+    python -m pictoroute.benchmarks                    # run and compare with the baseline
+    python -m pictoroute.benchmarks --quick            # smaller sizes and fewer requests
+    python -m pictoroute.benchmarks --suite extraction # verbose vs fast extraction mode
+    python -m pictoroute.benchmarks --suite startup    # import time of the worker start-up modules
+    python -m pictoroute.benchmarks --save-baseline    # store the results as the new baseline
+    python -m pictoroute.benchmarks --record           # re-record the fixtures from the live APIs
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import tempfile
+from pathlib import Path
+
+BENCHMARK_DIR = Path(__file__).parent
+FIXTURES_DIR = BENCHMARK_DIR / "fixtures"
+BASELINE_PATH = BENCHMARK_DIR / "baseline.json"
+
+# Relative change of a metric that counts as a regression, positive when higher is worse
+REGRESSION_THRESHOLDS = {
+    "seconds": 0.25,
+    "peak_mb": 0.25,
+    "length_km": 0.005,
+    "p50_seconds": 0.25,
+    "p95_seconds": 0.25,
+    "requests_per_second": -0.20,
+    "output_tokens": 0.25,
+    "row_accuracy": -0.01,
+    "field_accuracy": -0.01,
+    "import_seconds": 0.25,
+}
+
+
+def configure_environment(vision_url: str, nominatim_url: str, cache_dir: str):
+    """Point the app at the stubs, before any pictoroute.core module reads its settings."""
+    os.environ.update({
+        "ANTHROPIC_BASE_URL": vision_url,
+        "CLAUDE_API_KEY": "benchmark",
+        "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY", "benchmark"),
+        "NOMINATIM_URL": nominatim_url,
+        # The stub has no usage policy, the rate limiter should not be what is measured
+        "NOMINATIM_RATE_LIMIT": "1000",
+        "NOMINATIM_BURST": "100",
+        "GEOCODE_CACHE_PATH": os.path.join(cache_dir, "geocode_cache.sqlite3"),
+        "EXTRACTION_CACHE_PATH": os.path.join(cache_dir, "extraction_cache.sqlite3"),
+        # Every upload of the sample image has to reach the vision stub
+        "EXTRACTION_CACHE_TTL_DAYS": "0",
+        "LOCAL_OCR_ENABLED": "false",
+        "OFFLINE_GEOCODER_PATH": "",
+        "ROAD_NETWORK_PATH": "",
+        "ROUTE_METRIC": "haversine",
+    })
+
+
+def compare(results: dict, baseline: dict) -> list[tuple]:
+    """Rows of (name, metric, value, baseline value, relative change, regression)."""
+    rows = []
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            if metric not in REGRESSION_THRESHOLDS:
+                continue
+            base = baseline.get(name, {}).get(metric)
+            change = (value - base) / base if base else None
+            threshold = REGRESSION_THRESHOLDS[metric]
+            regression = change is not None and (change > threshold if threshold > 0 else change < threshold)
+            rows.append((name, metric, value, base, change, regression))
+    return rows
+
+
+def print_report(rows: list[tuple]):
+    print(f"\n{'benchmark':<28} {'metric':<20} {'value':>12} {'baseline':>12} {'change':>8}")
+    for name, metric, value, base, change, regression in rows:
+        base_text = f"{base:>12.4f}" if base is not None else f"{'-':>12}"
+        change_text = f"{change:>+8.1%}" if change is not None else f"{'-':>8}"
+        print(f"{name:<28} {metric:<20} {value:>12.4f} {base_text} {change_text}{'  REGRESSION' if regression else ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pictoroute benchmark suite")
+    parser.add_argument("--suite", choices=["all", "route", "api", "extraction", "startup"], default="all")
+    parser.add_argument("--quick", action="store_true", help="Smaller sizes and fewer requests")
+    parser.add_argument("--requests", type=int, default=40, help="Requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight per endpoint")
+    parser.add_argument("--stub-latency-scale", type=float, default=1.0, help="Multiplier of the recorded latencies")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the baseline")
+    parser.add_argument("--output", help="Also write the results and comparison to this JSON file")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with status 1 on a regression")
+    parser.add_argument("--record", action="store_true", help="Forward stub calls to the live APIs and record the fixtures")
+    args = parser.parse_args()
+
+    from pictoroute.benchmarks.stubs import BackgroundServer, nominatim_stub_app, vision_stub_app
+
+    vision_upstream = "https://api.anthropic.com" if args.record else None
+    nominatim_upstream = "https://nominatim.openstreetmap.org" if args.record else None
+    vision_stub = BackgroundServer(vision_stub_app(
+        str(FIXTURES_DIR / "vision_input_png.json"), args.stub_latency_scale, vision_upstream
+    ))
+    nominatim_stub = BackgroundServer(nominatim_stub_app(
+        str(FIXTURES_DIR / "nominatim.json"), args.stub_latency_scale, nominatim_upstream
+    ))
+    cache_dir = tempfile.mkdtemp(prefix="pictoroute-benchmark-")
+    configure_environment(vision_stub.url, nominatim_stub.url, cache_dir)
+    if args.record:
+        # The live APIs need the real key and Nominatim's rate limit
+        os.environ["CLAUDE_API_KEY"] = os.environ["BENCHMARK_CLAUDE_API_KEY"]
+        os.environ["NOMINATIM_RATE_LIMIT"] = "1"
+
+    results = {}
+    if args.suite in ("all", "route"):
+        from pictoroute.benchmarks.route_benchmark import ROUTE_SIZES, run_route_benchmarks
+
+        sizes = [size for size in ROUTE_SIZES if size <= 1000] if args.quick else ROUTE_SIZES
+        results.update(run_route_benchmarks(sizes, repeats=1 if args.quick else 3))
+
+    if args.suite in ("all", "api"):
+        from pictoroute.benchmarks.api_benchmark import run_api_benchmarks
+        from pictoroute.main import app
+
+        requests = min(args.requests, 10) if args.quick else args.requests
+        with vision_stub, nominatim_stub, BackgroundServer(app) as app_server:
+            results.update(asyncio.run(run_api_benchmarks(app_server.url, requests, args.concurrency)))
+
+    if args.suite in ("all", "startup"):
+        from pictoroute.benchmarks.startup_benchmark import run_startup_benchmarks
+
+        results.update(run_startup_benchmarks(repeats=3 if args.quick else 5))
+
+    if args.suite in ("all", "extraction"):
+        from pictoroute.benchmarks.extraction_benchmark import run_extraction_benchmarks
+
+        results.update(run_extraction_benchmarks(args.stub_latency_scale, repeats=1 if args.quick else 3, record=args.record))
+
+    baseline = {}
+    if BASELINE_PATH.exists():
+        with open(BASELINE_PATH, "r") as f:
+            baseline = json.load(f)["results"]
+    rows = compare(results, baseline)
+    print_report(rows)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"results": results, "comparison": rows}, f, indent=2)
+    if args.save_baseline:
+        with open(BASELINE_PATH, "w") as f:
+            json.dump(
+                {
+                    "machine": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+                    "results": {**baseline, **results},
+                },
+                f,
+                indent=2,
+            )
+        print(f"Saved the baseline to {BASELINE_PATH}")
+    if args.fail_on_regression and any(row[-1] for row in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Throughput and latency of the API endpoints under concurrent load, against local stubs."""
+
+import asyncio
+import statistics
+import time
+from pathlib import Path
+
+import httpx
+
+from pictoroute.benchmarks.synthetic import synthetic_addresses
+
+SAMPLE_IMAGE = Path(__file__).parents[2] / "repo-assets" / "input.png"
+
+
+async def load(client: httpx.AsyncClient, send, requests: int, concurrency: int) -> dict:
+    """Send `requests` requests with at most `concurrency` in flight, `send(client, i)` sends one."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def one(i: int):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            response = await send(client, i)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(requests)])
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests_per_second": requests / elapsed,
+        "p50_seconds": statistics.median(latencies),
+        "p95_seconds": latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)],
+        "errors": errors,
+    }
+
+
+def endpoint_scenarios() -> dict:
+    """Request senders per endpoint, every request uses different data to avoid cache hits."""
+    image = SAMPLE_IMAGE.read_bytes()
+
+    async def process_images(client, i):
+        return await client.post(
+            "/process-images", files=[("images", ("input.png", image, "image/png"))]
+        )
+
+    async def refetch_coordinates(client, i):
+        addresses = synthetic_addresses(50, seed=1000 + i, with_coordinates=False)
+        return await client.post(
+            "/refetch-coordinates", json=[address.model_dump() for address in addresses]
+        )
+
+    async def get_shortest_path(client, i):
+        addresses = synthetic_addresses(200, seed=2000 + i)
+        return await client.post(
+            "/get-shortest-path", json=[address.model_dump() for address in addresses]
+        )
+
+    async def get_shortest_path_columnar(client, i):
+        # The same stops as /get-shortest-path, sent as coordinate arrays
+        addresses = synthetic_addresses(200, seed=2000 + i)
+        return await client.post(
+            "/get-shortest-path/columnar",
+            json={
+                "latitudes": [address.coordinates.latitude for address in addresses],
+                "longitudes": [address.coordinates.longitude for address in addresses],
+            },
+        )
+
+    return {
+        "/process-images": process_images,
+        "/refetch-coordinates": refetch_coordinates,
+        "/get-shortest-path": get_shortest_path,
+        "/get-shortest-path/columnar": get_shortest_path_columnar,
+    }
+
+
+async def run_api_benchmarks(app_url: str, requests: int = 40, concurrency: int = 8) -> dict:
+    results = {}
+    async with httpx.AsyncClient(base_url=app_url, timeout=300) as client:
+        for endpoint, send in endpoint_scenarios().items():
+            # One request first, so worker start-up and lazy clients are not measured
+            await send(client, -1)
+            results[endpoint] = await load(client, send, requests, concurrency)
+            print(f"{endpoint}: {results[endpoint]}")
+    return results
@@ -0,0 +1,60 @@
+"""Compare the exact Held-Karp solver with the nearest neighbor + local search heuristic."""
+
+import sys
+import time
+
+import numpy as np
+
+from pictoroute.core.held_karp import estimate_held_karp_seconds, held_karp_fixed_endpoints
+from pictoroute.core.local_search import local_search_fixed_endpoints
+from pictoroute.core.route_planning import (
+    START_ADDRESS,
+    distance_matrix,
+    nearest_neighbor_with_end,
+    total_distance,
+)
+
+# Stops are spread over roughly the city of Amersfoort
+AREA_SIZE = 0.05
+
+
+def random_instance(n_stops: int, rng: np.random.Generator) -> np.ndarray:
+    """Distance matrix of the depot, n_stops random stops around it and the depot again."""
+    depot = (START_ADDRESS.coordinates.latitude, START_ADDRESS.coordinates.longitude)
+    stops = depot + rng.uniform(-AREA_SIZE, AREA_SIZE, size=(n_stops, 2))
+    return distance_matrix(np.vstack([depot, stops, depot]))
+
+
+def run(sizes=range(5, 18), repeats: int = 20, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    print(f"{'stops':>5} {'exact ms':>9} {'estimate ms':>11} {'heuristic ms':>12} {'mean gap %':>10} {'max gap %':>9} {'suboptimal':>10}")
+    for n_stops in sizes:
+        exact_time, heuristic_time, gaps = 0.0, 0.0, []
+        for _ in range(repeats):
+            distances = random_instance(n_stops, rng)
+
+            start = time.perf_counter()
+            exact = held_karp_fixed_endpoints(distances)
+            exact_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            heuristic = local_search_fixed_endpoints(distances, nearest_neighbor_with_end(distances))
+            heuristic_time += time.perf_counter() - start
+
+            optimal = total_distance(exact, distances)
+            gaps.append((total_distance(heuristic, distances) - optimal) / optimal * 100)
+
+        gaps = np.asarray(gaps)
+        print(
+            f"{n_stops:>5} {exact_time / repeats * 1000:>9.2f} "
+            f"{estimate_held_karp_seconds(n_stops + 2) * 1000:>11.2f} "
+            f"{heuristic_time / repeats * 1000:>12.2f} {gaps.mean():>10.2f} {gaps.max():>9.2f} "
+            f"{int((gaps > 1e-9).sum()):>6}/{repeats}"
+        )
+
+
+if __name__ == "__main__":
+    # Usage: python -m pictoroute.benchmarks.exact_vs_heuristic [max_stops] [repeats]
+    max_stops = int(sys.argv[1]) if len(sys.argv) > 1 else 15
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    run(range(5, max_stops + 1), repeats)
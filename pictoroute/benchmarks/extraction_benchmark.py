@@ -0,0 +1,96 @@
+"""Accuracy, latency and output tokens of the verbose and fast extraction modes, against recorded fixtures."""
+
+import asyncio
+import base64
+import json
+import os
+import re
+import statistics
+import time
+from pathlib import Path
+
+from pictoroute.benchmarks.api_benchmark import SAMPLE_IMAGE
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+# Addresses in repo-assets/input.png, the reference for the accuracy
+EXPECTED_ADDRESSES = FIXTURES_DIR / "input_png_addresses.json"
+# Recorded vision responses per extraction mode
+MODE_FIXTURES = {
+    "verbose": FIXTURES_DIR / "vision_input_png.json",
+    "fast": FIXTURES_DIR / "vision_input_png_fast.json",
+}
+
+
+def _normalize(value: str) -> str:
+    return re.sub(r"\s+", "", value).lower()
+
+
+def address_accuracy(addresses, expected: list[dict]) -> dict:
+    """
+    Compare extracted addresses with the expected ones, row by row in order.
+
+    Returns:
+        dict: The fraction of rows with all fields right and the fraction of right
+            fields, both relative to the expected rows.
+    """
+    fields = ("street_name", "house_number", "postal_code", "city")
+    rows_right = fields_right = 0
+    for address, reference in zip(addresses, expected):
+        right = sum(_normalize(getattr(address, field)) == _normalize(reference[field]) for field in fields)
+        fields_right += right
+        rows_right += right == len(fields)
+    return {
+        "row_accuracy": rows_right / len(expected),
+        "field_accuracy": fields_right / (len(expected) * len(fields)),
+        "extra_rows": max(len(addresses) - len(expected), 0),
+    }
+
+
+async def benchmark_mode(mode: str, base64_images: list[str], media_types: list[str], repeats: int) -> dict:
+    """Extract the sample image `repeats` times with one mode, without the extraction cache."""
+    from pictoroute.core.genai import close_claude_client
+    from pictoroute.core.image_processing import extract_addresses
+    from pictoroute.core.metrics import LLM_TOKENS
+
+    expected = json.loads(EXPECTED_ADDRESSES.read_text())["addresses"]
+    output_tokens_before = sum(v for (_, kind), v in LLM_TOKENS.snapshot().items() if kind == "output")
+    latencies, accuracies = [], []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        addresses = await extract_addresses(base64_images, media_types, use_cache=False, mode=mode)
+        latencies.append(time.perf_counter() - start)
+        accuracies.append(address_accuracy(addresses, expected))
+    output_tokens = sum(v for (_, kind), v in LLM_TOKENS.snapshot().items() if kind == "output") - output_tokens_before
+    # The client is bound to this event loop and to the stub of this mode
+    await close_claude_client()
+
+    return {
+        "p50_seconds": statistics.median(latencies),
+        "output_tokens": output_tokens / repeats,
+        **{key: statistics.mean(a[key] for a in accuracies) for key in accuracies[0]},
+    }
+
+
+def run_extraction_benchmarks(latency_scale: float = 1.0, repeats: int = 3, record: bool = False) -> dict:
+    """
+    Run every extraction mode against a vision stub that replays the fixture of that mode.
+
+    With `record` the stub forwards the calls to the live API and records the fixtures.
+    """
+    from pictoroute.benchmarks.stubs import BackgroundServer, vision_stub_app
+    from pictoroute.core.image_preprocessing import preprocess_image
+
+    image, media_type = preprocess_image(SAMPLE_IMAGE.read_bytes())
+    base64_images, media_types = [base64.b64encode(image).decode("utf-8")], [media_type]
+
+    results = {}
+    for mode, fixture in MODE_FIXTURES.items():
+        upstream = "https://api.anthropic.com" if record else None
+        with BackgroundServer(vision_stub_app(str(fixture), latency_scale, upstream)) as stub:
+            # The client is created on first use, so it picks up the URL of this stub
+            os.environ["ANTHROPIC_BASE_URL"] = stub.url
+            results[f"extraction/{mode}"] = asyncio.run(
+                benchmark_mode(mode, base64_images, media_types, 1 if record else repeats)
+            )
+        print(f"extraction/{mode}: {results[f'extraction/{mode}']}")
+    return results
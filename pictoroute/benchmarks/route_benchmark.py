@@ -0,0 +1,43 @@
+"""create_path latency, peak memory and tour length on synthetic Amersfoort address sets."""
+
+import gc
+import statistics
+import time
+import tracemalloc
+
+from pictoroute.benchmarks.synthetic import synthetic_addresses
+from pictoroute.core.route_planning import create_path
+
+ROUTE_SIZES = (10, 50, 200, 1000, 5000)
+
+
+def benchmark_create_path(n_stops: int, repeats: int = 3, seed: int = 0) -> dict:
+    """Time create_path on a fixed synthetic set of n_stops addresses."""
+    addresses = synthetic_addresses(n_stops, seed)
+    timings = []
+    for _ in range(repeats):
+        gc.collect()
+        start = time.perf_counter()
+        path = create_path(addresses)
+        timings.append(time.perf_counter() - start)
+
+    # Memory is measured in a separate run, tracing slows down the solver
+    gc.collect()
+    tracemalloc.start()
+    create_path(addresses)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "seconds": statistics.median(timings),
+        "peak_mb": peak / 2**20,
+        "length_km": path.length,
+    }
+
+
+def run_route_benchmarks(sizes=ROUTE_SIZES, repeats: int = 3) -> dict:
+    results = {}
+    for n_stops in sizes:
+        results[f"create_path[{n_stops}]"] = benchmark_create_path(n_stops, repeats)
+        print(f"create_path[{n_stops}]: {results[f'create_path[{n_stops}]']}")
+    return results
@@ -0,0 +1,57 @@
+"""Import time of the modules loaded at worker start-up, each measured in a fresh interpreter."""
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Modules imported by a uvicorn worker (main), a route solver pool worker (route_planning)
+# and by anything that uses the model clients (genai)
+STARTUP_MODULES = ("pictoroute.core.genai", "pictoroute.core.route_planning", "pictoroute.main")
+# Heavy dependencies that should only be imported when they are used
+HEAVY_MODULES = ("openai", "anthropic", "geopy", "cv2")
+
+_MEASURE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure_import(module: str, repeats: int = 5, pythonpath: str | None = None) -> dict:
+    """Median import time of a module over `repeats` fresh interpreters, and the heavy modules it loaded."""
+    env = dict(os.environ)
+    if pythonpath:
+        env["PYTHONPATH"] = pythonpath
+    # The eager OpenAI client needs a key to import at all, the lazy one does not
+    env.setdefault("OPENAI_API_KEY", "benchmark")
+    seconds, loaded = [], []
+    for _ in range(repeats):
+        output = subprocess.run(
+            [sys.executable, "-c", _MEASURE.format(module=module, heavy=HEAVY_MODULES)],
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        seconds.append(result["seconds"])
+        loaded = result["loaded"]
+    return {"import_seconds": statistics.median(seconds), "heavy_modules": len(loaded), "loaded": loaded}
+
+
+def run_startup_benchmarks(repeats: int = 5, pythonpath: str | None = None) -> dict:
+    results = {}
+    for module in STARTUP_MODULES:
+        result = measure_import(module, repeats, pythonpath)
+        print(f"import {module}: {result}")
+        results[f"import/{module}"] = {key: value for key, value in result.items() if key != "loaded"}
+    return results
+
+
+if __name__ == "__main__":
+    # Usage: python -m pictoroute.benchmarks.startup_benchmark [PYTHONPATH of another checkout]
+    run_startup_benchmarks(pythonpath=sys.argv[1] if len(sys.argv) > 1 else None)
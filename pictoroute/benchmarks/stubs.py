@@ -0,0 +1,133 @@
+"""Local stub servers that replay recorded Anthropic and Nominatim responses."""
+
+import asyncio
+import hashlib
+import json
+import re
+import socket
+import threading
+import time
+from typing import Optional
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from pictoroute.benchmarks.synthetic import AMERSFOORT_BOUNDS
+
+
+class BackgroundServer:
+    """Run an ASGI app with uvicorn in a background thread on a free local port."""
+
+    def __init__(self, app):
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            self.port = s.getsockname()[1]
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.server = uvicorn.Server(
+            uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning")
+        )
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self) -> "BackgroundServer":
+        self.thread.start()
+        while not self.server.started:
+            if not self.thread.is_alive():
+                raise RuntimeError(f"Server on port {self.port} did not start")
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.should_exit = True
+        self.thread.join()
+
+
+def _load(fixture_path: str) -> dict:
+    with open(fixture_path, "r") as f:
+        return json.load(f)
+
+
+def _save(fixture_path: str, fixture: dict):
+    with open(fixture_path, "w") as f:
+        json.dump(fixture, f, indent=2, ensure_ascii=False)
+
+
+def vision_stub_app(fixture_path: str, latency_scale: float = 1.0, upstream: Optional[str] = None) -> FastAPI:
+    """
+    Anthropic messages API stub.
+
+    Every call gets the recorded message after the recorded latency (times
+    latency_scale). With `upstream` the calls are forwarded to the real API instead
+    and the last response is recorded in the fixture.
+    """
+    app = FastAPI()
+    app.state.calls = 0
+
+    @app.post("/v1/messages")
+    async def messages(request: Request):
+        app.state.calls += 1
+        if upstream:
+            headers = {k: v for k, v in request.headers.items() if k in ("x-api-key", "anthropic-version", "content-type")}
+            start = time.perf_counter()
+            async with httpx.AsyncClient(base_url=upstream, timeout=300) as client:
+                response = await client.post("/v1/messages", content=await request.body(), headers=headers)
+            if response.status_code == 200:
+                _save(fixture_path, {"latency_seconds": time.perf_counter() - start, "response": response.json()})
+            return JSONResponse(response.json(), status_code=response.status_code)
+
+        fixture = _load(fixture_path)
+        await asyncio.sleep(fixture["latency_seconds"] * latency_scale)
+        return fixture["response"]
+
+    return app
+
+
+def _normalize_query(query: str) -> str:
+    return re.sub(r"\s+", " ", query).strip().lower()
+
+
+def nominatim_stub_app(fixture_path: str, latency_scale: float = 1.0, upstream: Optional[str] = None) -> FastAPI:
+    """
+    Nominatim /search stub.
+
+    Recorded queries get their recorded results. Other queries (the synthetic
+    addresses) get a point in Amersfoort derived from a hash of the query, so
+    results are reproducible. With `upstream` the queries are forwarded to the real
+    service and recorded in the fixture.
+    """
+    app = FastAPI()
+    app.state.calls = 0
+    (south, west), (north, east) = AMERSFOORT_BOUNDS
+
+    @app.get("/search")
+    async def search(request: Request):
+        app.state.calls += 1
+        query = request.query_params.get("q", "")
+        fixture = _load(fixture_path)
+
+        if upstream:
+            start = time.perf_counter()
+            async with httpx.AsyncClient(base_url=upstream, timeout=30) as client:
+                response = await client.get(
+                    "/search", params=request.query_params, headers={"User-Agent": request.headers.get("user-agent", "")}
+                )
+            fixture["latency_seconds"] = time.perf_counter() - start
+            fixture["queries"][_normalize_query(query)] = response.json()
+            _save(fixture_path, fixture)
+            return JSONResponse(response.json(), status_code=response.status_code)
+
+        await asyncio.sleep(fixture["latency_seconds"] * latency_scale)
+        recorded = fixture["queries"].get(_normalize_query(query))
+        if recorded is not None:
+            return recorded
+        digest = hashlib.sha256(query.encode("utf-8")).digest()
+        fraction_lat = int.from_bytes(digest[:4], "big") / 2**32
+        fraction_lon = int.from_bytes(digest[4:8], "big") / 2**32
+        return [{
+            "lat": str(south + fraction_lat * (north - south)),
+            "lon": str(west + fraction_lon * (east - west)),
+            "display_name": query,
+        }]
+
+    return app
@@ -0,0 +1,49 @@
+"""Synthetic address sets in and around Amersfoort, reproducible from a seed."""
+
+import numpy as np
+
+from pictoroute.models.address import Address, Coordinates
+
+# Bounding box of Amersfoort (lat, lon)
+AMERSFOORT_BOUNDS = ((52.130, 5.330), (52.185, 5.430))
+
+STREET_NAMES = [
+    "Albert Schweitzersingel", "Amsterdamseweg", "Leusderweg", "Noordewierweg",
+    "Euterpeplein", "Buma", "Piet Mondriaanplein", "Eemplein", "Utrechtseweg",
+    "Arnhemseweg", "Hogeweg", "Kapelweg", "Soesterweg", "Stadsring", "Langestraat",
+    "Kamp", "Hof", "Zuidsingel", "Westsingel", "Kortegracht", "Bisschopsweg",
+    "Vondellaan", "Heiligenbergerweg", "Hooglandseweg", "Neptunusplein",
+]
+
+
+def synthetic_addresses(n: int, seed: int = 0, with_coordinates: bool = True) -> list[Address]:
+    """
+    Create n addresses spread over streets in Amersfoort.
+
+    Every street gets a random center and its houses are scattered around it, so
+    the stops cluster like real delivery addresses instead of being uniform noise.
+    """
+    rng = np.random.default_rng(seed)
+    (south, west), (north, east) = AMERSFOORT_BOUNDS
+    centers = np.column_stack([
+        rng.uniform(south, north, len(STREET_NAMES)),
+        rng.uniform(west, east, len(STREET_NAMES)),
+    ])
+    streets = rng.integers(len(STREET_NAMES), size=n)
+    # About 300 m of spread around the street center
+    points = centers[streets] + rng.normal(0, [0.0027, 0.0044], size=(n, 2))
+    numbers = rng.integers(1, 250, size=n)
+
+    addresses = []
+    for index in range(n):
+        street = int(streets[index])
+        addresses.append(Address(
+            street_name=STREET_NAMES[street],
+            house_number=str(numbers[index]),
+            postal_code=f"38{11 + street % 15:02d}{chr(65 + street % 26)}{chr(65 + index % 26)}",
+            city="Amersfoort",
+            coordinates=Coordinates(
+                latitude=float(points[index, 0]), longitude=float(points[index, 1])
+            ) if with_coordinates else None,
+        ))
+    return addresses
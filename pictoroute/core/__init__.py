@@ -1,2 +1,22 @@
-from pictoroute.core.genai import *
-from pictoroute.core.image_processing import *
\ No newline at end of file
+"""
+The names of genai and image_processing are available from pictoroute.core as well.
+
+They are resolved on first access instead of being star-imported, so importing one
+core module (as every route solver worker does) does not load the vision pipeline.
+"""
+
+import importlib
+import importlib.util
+
+_REEXPORTED_MODULES = ("pictoroute.core.genai", "pictoroute.core.image_processing")
+
+
+def __getattr__(name: str):
+    # Submodules (`from pictoroute.core import route_planning`) are imported on their own
+    if importlib.util.find_spec(f"{__name__}.{name}") is not None:
+        return importlib.import_module(f"{__name__}.{name}")
+    for module_name in _REEXPORTED_MODULES:
+        module = importlib.import_module(module_name)
+        if not name.startswith("_") and hasattr(module, name):
+            return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
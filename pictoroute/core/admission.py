@@ -0,0 +1,107 @@
+"""Admission control for extraction jobs: a limit on jobs in flight with a bounded queue."""
+
+import asyncio
+import math
+import os
+import time
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from pictoroute.core.metrics import EXTRACTION_ADMISSIONS, span
+
+load_dotenv()
+
+# Extraction jobs (uploads being read, preprocessed and sent to the vision model)
+# running at the same time in this worker process
+EXTRACTION_MAX_JOBS = int(os.getenv("EXTRACTION_MAX_JOBS", "8"))
+# Jobs that may wait for a free slot, later jobs are rejected with a 429 right away
+EXTRACTION_MAX_QUEUED = int(os.getenv("EXTRACTION_MAX_QUEUED", "32"))
+# Seconds a job waits in the queue before it is rejected
+EXTRACTION_QUEUE_TIMEOUT = float(os.getenv("EXTRACTION_QUEUE_TIMEOUT", "30"))
+
+
+class ExtractionBusyError(RuntimeError):
+    """No extraction slot is available, retry after `retry_after` seconds."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Too many extraction jobs, retry after {retry_after} seconds.")
+        self.retry_after = retry_after
+
+
+class ExtractionSlot:
+    """A slot held by a running job, released once (also when released twice)."""
+
+    def __init__(self, limiter: "ExtractionLimiter"):
+        self.limiter = limiter
+        self.started_at = time.monotonic()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.limiter._release(time.monotonic() - self.started_at)
+
+
+class ExtractionLimiter:
+    """
+    Limits the extraction jobs in flight, jobs over the limit queue up.
+
+    A job is rejected with an ExtractionBusyError when the queue is full or it waited
+    longer than `queue_timeout`. The retry-after estimate is the time the queue
+    ahead of it needs at the average job duration so far.
+    """
+
+    def __init__(
+        self,
+        max_jobs: int = EXTRACTION_MAX_JOBS,
+        max_queued: int = EXTRACTION_MAX_QUEUED,
+        queue_timeout: float = EXTRACTION_QUEUE_TIMEOUT,
+    ):
+        self.max_jobs = max_jobs
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.running = 0
+        self.waiting = 0
+        # Exponential moving average of the job duration in seconds
+        self.average_seconds = 5.0
+        self._semaphore = asyncio.Semaphore(max_jobs)
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil((self.waiting + 1) * self.average_seconds / self.max_jobs))
+
+    async def acquire(self) -> ExtractionSlot:
+        """Wait for a free slot, raise an ExtractionBusyError when the job can not be admitted."""
+        if self._semaphore.locked() and self.waiting >= self.max_queued:
+            EXTRACTION_ADMISSIONS.inc(result="rejected")
+            raise ExtractionBusyError(self.retry_after())
+
+        self.waiting += 1
+        try:
+            with span("extraction_queue"):
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            EXTRACTION_ADMISSIONS.inc(result="timed_out")
+            raise ExtractionBusyError(self.retry_after())
+        finally:
+            self.waiting -= 1
+
+        self.running += 1
+        EXTRACTION_ADMISSIONS.inc(result="admitted")
+        return ExtractionSlot(self)
+
+    def _release(self, duration: float):
+        self.running -= 1
+        self.average_seconds = 0.8 * self.average_seconds + 0.2 * duration
+        self._semaphore.release()
+
+
+_default_limiter: Optional[ExtractionLimiter] = None
+
+
+def get_extraction_limiter() -> ExtractionLimiter:
+    """Return the extraction limiter of this process."""
+    global _default_limiter
+    if _default_limiter is None:
+        _default_limiter = ExtractionLimiter()
+    return _default_limiter
@@ -0,0 +1,346 @@
+"""
+Bulk geocoding of CSV or JSONL address files, streamed row by row with checkpoints.
+
+Usage:
+    python -m pictoroute.core.bulk_geocoding customers.csv customers_geocoded.csv
+    python -m pictoroute.core.bulk_geocoding customers.jsonl out.jsonl --workers 8 --rate-limit 20
+
+CSV files have the columns street_name, house_number, postal_code and city, the
+coordinates are written to latitude and longitude columns. JSONL lines are Address
+objects, the coordinates are written to their "coordinates" field. Other columns
+and fields are passed through. Rows that already have coordinates are not looked
+up. Rows that can not be parsed (invalid JSON, malformed coordinates) are written
+unchanged and counted as failed. An interrupted run continues where it stopped
+when started again with the same arguments, the progress is kept in a checkpoint
+file next to the output.
+"""
+
+import argparse
+import asyncio
+import csv
+import io
+import json
+import os
+import sys
+import time
+from collections import deque
+from pathlib import Path
+from typing import Iterator, Optional
+
+from pictoroute.core.geocoding_service import (
+    GEOCODE_MAX_CONCURRENCY,
+    NOMINATIM_BURST,
+    NOMINATIM_RATE_LIMIT,
+    GeocodingService,
+)
+from pictoroute.models.address import Address, Coordinates
+
+# Rows written between two checkpoints
+CHECKPOINT_EVERY = 100
+# Seconds between two progress lines
+PROGRESS_INTERVAL = 10.0
+# Rows read ahead per worker, bounds the memory while rows wait to be written in order
+READ_AHEAD_PER_WORKER = 4
+
+
+def detect_format(path: str) -> str:
+    suffix = Path(path).suffix.lower()
+    if suffix == ".csv":
+        return "csv"
+    if suffix in (".jsonl", ".ndjson"):
+        return "jsonl"
+    raise ValueError(f"Unknown file format of {path}, use --format csv or --format jsonl.")
+
+
+def count_rows(path: str, file_format: str) -> int:
+    """Count the rows of a file without parsing them, for the ETA."""
+    with open(path, "rb") as f:
+        lines = sum(1 for line in f if line.strip())
+    return max(lines - 1, 0) if file_format == "csv" else lines
+
+
+def read_rows(path: str, file_format: str) -> tuple[list[str], Iterator]:
+    """
+    Return the CSV columns (empty for JSONL) and an iterator over the rows.
+
+    JSONL lines that are not valid JSON are returned as the line itself, a string,
+    so they can be written through unchanged.
+    """
+    f = open(path, "r", newline="", encoding="utf-8")
+    if file_format == "csv":
+        reader = csv.DictReader(f)
+        columns = list(reader.fieldnames or [])
+
+        def rows():
+            with f:
+                yield from reader
+
+        return columns, rows()
+
+    def rows():
+        with f:
+            for line in f:
+                if line.strip():
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        yield line.rstrip("\r\n")
+
+    return [], rows()
+
+
+def row_address(row, file_format: str) -> Address:
+    """
+    The address of a row, with its coordinates when the row has them.
+
+    Raises:
+        ValueError: The row is not an address object or its fields are malformed.
+    """
+    if not isinstance(row, dict):
+        raise ValueError(f"Not an address object: {str(row)[:80]}")
+    try:
+        coordinates = None
+        if file_format == "csv":
+            if row.get("latitude") and row.get("longitude"):
+                coordinates = Coordinates(latitude=float(row["latitude"]), longitude=float(row["longitude"]))
+        elif row.get("coordinates"):
+            coordinates = Coordinates(**row["coordinates"])
+        return Address(
+            street_name=row.get("street_name") or "",
+            house_number=str(row.get("house_number") or ""),
+            postal_code=row.get("postal_code") or "",
+            city=row.get("city") or "",
+            coordinates=coordinates,
+        )
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid address row: {e}")
+
+
+class RowWriter:
+    """Writes rows as encoded lines to a binary file, so the byte offset can be checkpointed."""
+
+    def __init__(self, f, file_format: str, columns: list[str]):
+        self.f = f
+        self.file_format = file_format
+        self.columns = columns + [column for column in ("latitude", "longitude") if column not in columns]
+
+    def write_header(self):
+        if self.file_format == "csv":
+            self._write_csv(self.columns)
+
+    def write(self, row, coordinates: Optional[Coordinates]):
+        if isinstance(row, str):
+            # An unparsable JSONL line, written as it was read
+            self.f.write((row + "\n").encode("utf-8"))
+        elif self.file_format == "csv":
+            if coordinates is not None:
+                row = {**row, "latitude": coordinates.latitude, "longitude": coordinates.longitude}
+            self._write_csv([row.get(column, "") for column in self.columns])
+        else:
+            if coordinates is not None:
+                row = {**row, "coordinates": coordinates.model_dump()}
+            self.f.write((json.dumps(row, ensure_ascii=False) + "\n").encode("utf-8"))
+
+    def _write_csv(self, values: list):
+        line = io.StringIO()
+        csv.writer(line).writerow(values)
+        self.f.write(line.getvalue().encode("utf-8"))
+
+
+def load_checkpoint(checkpoint_path: str, input_path: str) -> Optional[dict]:
+    """Return the checkpoint of an earlier run on the same input, None to start over."""
+    if not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path, "r") as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("input") != os.path.abspath(input_path) or checkpoint.get("input_size") != os.path.getsize(input_path):
+        raise ValueError(f"{checkpoint_path} belongs to another input file, remove it to start over.")
+    return checkpoint
+
+
+def save_checkpoint(checkpoint_path: str, input_path: str, rows: int, output_bytes: int, stats: dict):
+    # Written to a temporary file and renamed, so a crash never leaves a half written checkpoint
+    temporary_path = checkpoint_path + ".tmp"
+    with open(temporary_path, "w") as f:
+        json.dump(
+            {
+                "input": os.path.abspath(input_path),
+                "input_size": os.path.getsize(input_path),
+                "rows": rows,
+                "output_bytes": output_bytes,
+                "stats": stats,
+            },
+            f,
+        )
+    os.replace(temporary_path, checkpoint_path)
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+async def geocode_file(
+    input_path: str,
+    output_path: str,
+    file_format: Optional[str] = None,
+    workers: int = GEOCODE_MAX_CONCURRENCY,
+    rate_limit: float = NOMINATIM_RATE_LIMIT,
+    checkpoint_path: Optional[str] = None,
+    checkpoint_every: int = CHECKPOINT_EVERY,
+    progress_interval: float = PROGRESS_INTERVAL,
+    service: Optional[GeocodingService] = None,
+) -> dict:
+    """
+    Geocode all rows of a CSV or JSONL file and write them, in the same order, to the output file.
+
+    Up to `workers` lookups run at the same time within the rate limit of the
+    geocoding service, the offline geocoder and the geocode cache are used first.
+    Every `checkpoint_every` rows the output is flushed and the number of rows done
+    is stored, a next run with the same input resumes from there.
+
+    Args:
+        input_path (str): CSV or JSONL file with addresses.
+        output_path (str): File to write the rows with coordinates to.
+        file_format (str): "csv" or "jsonl", detected from the input file name when None.
+        workers (int): Lookups running at the same time.
+        rate_limit (float): Geocoding requests per second.
+        checkpoint_path (str): Progress file, `output_path` + ".checkpoint" by default.
+        checkpoint_every (int): Rows written between two checkpoints.
+        progress_interval (float): Seconds between two progress lines.
+        service (GeocodingService): Service to use, a new one with `workers` and `rate_limit` by default.
+
+    Returns:
+        dict: Counts of the rows found, not found, skipped (already with coordinates) and failed.
+    """
+    file_format = file_format or detect_format(input_path)
+    checkpoint_path = checkpoint_path or output_path + ".checkpoint"
+    checkpoint = load_checkpoint(checkpoint_path, input_path)
+    stats = dict(checkpoint["stats"]) if checkpoint else {"found": 0, "not_found": 0, "skipped": 0, "failed": 0}
+    rows_done = checkpoint["rows"] if checkpoint else 0
+    resumed_rows = rows_done
+    total = count_rows(input_path, file_format)
+
+    own_service = service is None
+    if own_service:
+        service = GeocodingService(rate_limit=rate_limit, burst=max(NOMINATIM_BURST, 1), max_concurrency=workers)
+
+    async def resolve(address: Address) -> tuple[Optional[Coordinates], str]:
+        try:
+            coordinates = await service.geocode_address(address)
+        except Exception as e:
+            print(f"Error geocoding {address.street_name} {address.house_number} {address.city}: {e}")
+            return None, "failed"
+        return coordinates, "found" if coordinates is not None else "not_found"
+
+    columns, rows = read_rows(input_path, file_format)
+    if checkpoint:
+        # Drop rows written after the last checkpoint, they are geocoded again
+        with open(output_path, "r+b") as f:
+            f.truncate(checkpoint["output_bytes"])
+        print(f"Resuming after {rows_done} of {total} rows")
+    output = open(output_path, "ab" if checkpoint else "wb")
+    writer = RowWriter(output, file_format, columns)
+    if not checkpoint:
+        writer.write_header()
+
+    started_at = last_progress = time.monotonic()
+    pending: deque = deque()
+    completed = False
+
+    def report():
+        elapsed = time.monotonic() - started_at
+        rate = (rows_done - resumed_rows) / elapsed if elapsed > 0 else 0.0
+        eta = format_duration((total - rows_done) / rate) if rate > 0 else "-"
+        print(f"{rows_done}/{total} rows, {rate:.1f} rows/s, ETA {eta}, {stats}")
+
+    async def write_ready(max_pending: int):
+        """Write finished rows in input order, wait for the oldest row while more than max_pending are open."""
+        nonlocal rows_done, last_progress
+        while pending and (len(pending) > max_pending or pending[0][1] is None or pending[0][1].done()):
+            row, task, result = pending.popleft()
+            # Counted when written, so the counts in a checkpoint match the rows written
+            coordinates, result = await task if task is not None else (None, result)
+            writer.write(row, coordinates)
+            stats[result] += 1
+            rows_done += 1
+            if rows_done % checkpoint_every == 0:
+                output.flush()
+                os.fsync(output.fileno())
+                save_checkpoint(checkpoint_path, input_path, rows_done, output.tell(), stats)
+            if progress_interval and time.monotonic() - last_progress >= progress_interval:
+                last_progress = time.monotonic()
+                report()
+
+    try:
+        read_ahead = max(workers, 1) * READ_AHEAD_PER_WORKER
+        for index, row in enumerate(rows):
+            if index < resumed_rows:
+                continue
+            # A malformed row is written through and counted, instead of failing every resume on it
+            try:
+                address = row_address(row, file_format)
+            except ValueError as e:
+                print(f"Skipping row {index + 1}: {e}")
+                pending.append((row, None, "failed"))
+            else:
+                if address.coordinates is not None:
+                    pending.append((row, None, "skipped"))
+                else:
+                    pending.append((row, asyncio.ensure_future(resolve(address)), None))
+            await write_ready(read_ahead)
+        await write_ready(0)
+        completed = True
+    finally:
+        for _, task, _ in pending:
+            if task is not None:
+                task.cancel()
+        output.flush()
+        os.fsync(output.fileno())
+        if completed:
+            output.close()
+            if os.path.exists(checkpoint_path):
+                os.remove(checkpoint_path)
+        else:
+            # Everything written so far is complete, so an interruption resumes from here
+            save_checkpoint(checkpoint_path, input_path, rows_done, output.tell(), stats)
+            output.close()
+        if own_service:
+            await service.aclose()
+
+    report()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Geocode a CSV or JSONL file of addresses")
+    parser.add_argument("input", help="CSV or JSONL file with addresses")
+    parser.add_argument("output", help="File to write the addresses with coordinates to")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="File format, detected from the input file name by default")
+    parser.add_argument("--workers", type=int, default=GEOCODE_MAX_CONCURRENCY, help="Lookups running at the same time")
+    parser.add_argument("--rate-limit", type=float, default=NOMINATIM_RATE_LIMIT, help="Geocoding requests per second")
+    parser.add_argument("--checkpoint", help="Progress file, the output file + .checkpoint by default")
+    parser.add_argument("--checkpoint-every", type=int, default=CHECKPOINT_EVERY, help="Rows between two checkpoints")
+    parser.add_argument("--progress-interval", type=float, default=PROGRESS_INTERVAL, help="Seconds between progress lines")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(
+            geocode_file(
+                args.input,
+                args.output,
+                file_format=args.format,
+                workers=args.workers,
+                rate_limit=args.rate_limit,
+                checkpoint_path=args.checkpoint,
+                checkpoint_every=args.checkpoint_every,
+                progress_interval=args.progress_interval,
+            )
+        )
+    except KeyboardInterrupt:
+        print("Interrupted, run the same command again to resume")
+        sys.exit(130)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Split a list of stops over several couriers with balanced k-means clustering."""
+
+import numpy as np
+
+# Maximum number of k-means iterations
+MAX_ITERATIONS = 50
+
+
+def _project(coordinates) -> np.ndarray:
+    """Equirectangular projection of (lat, lon) pairs, accurate enough to cluster a city."""
+    coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+    scale = np.cos(np.radians(coordinates[:, 0].mean())) if len(coordinates) else 1.0
+    return np.column_stack([coordinates[:, 0], coordinates[:, 1] * scale])
+
+
+def _balanced_assignment(squared, capacity) -> np.ndarray:
+    """Assign every point to the nearest center that still has room, closest pairs first."""
+    n, k = squared.shape
+    labels = [-1] * n
+    sizes = [0] * k
+    assigned = 0
+    for flat in np.argsort(squared, axis=None).tolist():
+        point, center = divmod(flat, k)
+        if labels[point] < 0 and sizes[center] < capacity:
+            labels[point] = center
+            sizes[center] += 1
+            assigned += 1
+            if assigned == n:
+                break
+    return np.asarray(labels)
+
+
+def cluster_stops(coordinates, k: int, seed: int = 0) -> list[list[int]]:
+    """
+    Split stops into k geographically compact clusters of (almost) equal size.
+
+    Centers are initialized with k-means++ and every iteration assigns the stops
+    to the nearest center with room left, so no cluster gets more than
+    ceil(n / k) stops.
+
+    Args:
+        coordinates: (lat, lon) pairs of the stops.
+        k (int): Number of clusters (couriers).
+        seed (int): Seed of the k-means++ initialization.
+
+    Returns:
+        list[list[int]]: The indices of the stops in every cluster, empty clusters
+            are left out when there are fewer stops than couriers.
+    """
+    if k < 1:
+        raise ValueError("The number of couriers must be at least 1.")
+    points = _project(coordinates)
+    n = len(points)
+    if n == 0:
+        return []
+    k = min(k, n)
+    capacity = -(-n // k)
+
+    # k-means++: every next center is picked with a probability proportional to the
+    # squared distance to the nearest center so far
+    rng = np.random.default_rng(seed)
+    centers = [points[rng.integers(n)]]
+    nearest = ((points - centers[0]) ** 2).sum(axis=1)
+    for _ in range(1, k):
+        probabilities = nearest / nearest.sum() if nearest.sum() > 0 else None
+        centers.append(points[rng.choice(n, p=probabilities)])
+        nearest = np.minimum(nearest, ((points - centers[-1]) ** 2).sum(axis=1))
+    centers = np.asarray(centers)
+
+    labels = None
+    for _ in range(MAX_ITERATIONS):
+        squared = ((points[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+        new_labels = _balanced_assignment(squared, capacity)
+        if labels is not None and np.array_equal(labels, new_labels):
+            break
+        labels = new_labels
+        for center in range(k):
+            members = points[labels == center]
+            if len(members):
+                centers[center] = members.mean(axis=0)
+
+    return [np.flatnonzero(labels == center).tolist() for center in range(k) if (labels == center).any()]
@@ -0,0 +1,167 @@
+"""
+Columnar route requests: the stops as latitude and longitude arrays instead of Address objects.
+
+A request body is a JSON (or msgpack) object:
+
+    {"latitudes": [52.15, ...], "longitudes": [5.38, ...], "ids": ["a", ...],
+     "start": [52.16, 5.38], "end": [52.16, 5.38]}
+
+Only the latitudes and longitudes are required. In msgpack bodies they may also be
+binary, packed little-endian float64 values, which are read without a copy. The
+response only holds the visiting order of the stops (their ids, or their indices
+when no ids were sent), the length in km and whether the solver converged.
+"""
+
+import json
+from typing import Optional
+
+import numpy as np
+
+from pictoroute.core.route_planning import END_ADDRESS, START_ADDRESS
+
+try:
+    # Optional, msgpack request and response bodies (pip install msgpack)
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+MSGPACK_MEDIA_TYPES = (MSGPACK_MEDIA_TYPE, "application/x-msgpack", "application/vnd.msgpack")
+
+
+class UnsupportedMediaTypeError(ValueError):
+    """The body of a columnar request is not JSON or msgpack (or msgpack is not installed)."""
+
+
+class ColumnarRoute:
+    """
+    The stops of a columnar request as one (n + 2) x 2 coordinate array.
+
+    The start depot is the first row and the end depot the last, so the array goes
+    to the solver as is.
+    """
+
+    def __init__(self, coordinates: np.ndarray, ids: Optional[list] = None):
+        self.coordinates = coordinates
+        self.ids = ids
+
+    @property
+    def stops(self) -> int:
+        return len(self.coordinates) - 2
+
+    def order(self, path: list[int]) -> list:
+        """The stops of a solver path in visiting order, as ids or as indices into the request arrays."""
+        path = np.asarray(path)
+        indices = path[(path > 0) & (path <= self.stops)] - 1
+        if self.ids is None:
+            return indices.tolist()
+        return [self.ids[i] for i in indices.tolist()]
+
+
+def _media_type(content_type: Optional[str]) -> str:
+    return (content_type or JSON_MEDIA_TYPE).split(";")[0].strip().lower()
+
+
+def _column(values, name: str) -> np.ndarray:
+    if values is None:
+        raise ValueError(f"The {name} are missing.")
+    if isinstance(values, (bytes, bytearray, memoryview)):
+        if len(values) % 8:
+            raise ValueError(f"The binary {name} are not packed float64 values.")
+        return np.frombuffer(values, dtype="<f8")
+    try:
+        column = np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        raise ValueError(f"The {name} must be numbers.")
+    if column.ndim != 1:
+        raise ValueError(f"The {name} must be a flat array.")
+    return column
+
+
+def _depot(value, default) -> tuple[float, float]:
+    if value is None:
+        return default.coordinates.latitude, default.coordinates.longitude
+    if not isinstance(value, (list, tuple)) or len(value) != 2:
+        raise ValueError("A depot must be a [latitude, longitude] pair.")
+    # float() would accept strings like "52.1" and booleans, only take numbers
+    if not all(isinstance(number, (int, float)) and not isinstance(number, bool) for number in value):
+        raise ValueError("A depot must be a [latitude, longitude] pair of numbers.")
+    try:
+        return float(value[0]), float(value[1])
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError("A depot must be a [latitude, longitude] pair of numbers.")
+
+
+def decode_columnar_route(body: bytes, content_type: Optional[str] = JSON_MEDIA_TYPE) -> ColumnarRoute:
+    """
+    Decode a columnar request body into a ColumnarRoute.
+
+    Args:
+        body (bytes): The request body.
+        content_type (str): The Content-Type header, JSON when None.
+
+    Returns:
+        ColumnarRoute: The coordinates of the depots and stops, and the ids of the stops.
+    """
+    media_type = _media_type(content_type)
+    if media_type in MSGPACK_MEDIA_TYPES:
+        if msgpack is None:
+            raise UnsupportedMediaTypeError("msgpack bodies need the msgpack package, send JSON instead.")
+        try:
+            payload = msgpack.unpackb(body)
+        except Exception as e:
+            raise ValueError(f"Invalid msgpack body: {e}")
+    elif media_type == JSON_MEDIA_TYPE:
+        try:
+            payload = json.loads(body)
+        except ValueError as e:
+            raise ValueError(f"Invalid JSON body: {e}")
+    else:
+        raise UnsupportedMediaTypeError(f"Unsupported media type: {media_type}")
+    if not isinstance(payload, dict):
+        raise ValueError("The body must be an object with latitudes and longitudes.")
+
+    latitudes = _column(payload.get("latitudes"), "latitudes")
+    longitudes = _column(payload.get("longitudes"), "longitudes")
+    if len(latitudes) != len(longitudes):
+        raise ValueError("The latitudes and longitudes have different lengths.")
+    if not len(latitudes):
+        raise ValueError("At least one stop is needed.")
+
+    ids = payload.get("ids")
+    if ids is not None and (not isinstance(ids, list) or len(ids) != len(latitudes)):
+        raise ValueError("The ids must be a list with one id per stop.")
+
+    # One copy into the array the solver uses, with the depots around the stops
+    coordinates = np.empty((len(latitudes) + 2, 2), dtype=np.float64)
+    coordinates[0] = _depot(payload.get("start"), START_ADDRESS)
+    coordinates[1:-1, 0] = latitudes
+    coordinates[1:-1, 1] = longitudes
+    coordinates[-1] = _depot(payload.get("end"), END_ADDRESS)
+
+    if not np.isfinite(coordinates).all():
+        raise ValueError("The coordinates must be finite numbers.")
+    if (np.abs(coordinates[:, 0]) > 90).any() or (np.abs(coordinates[:, 1]) > 180).any():
+        raise ValueError("The coordinates are out of range.")
+    return ColumnarRoute(coordinates, ids)
+
+
+def response_media_type(accept: Optional[str], content_type: Optional[str]) -> str:
+    """Answer in the format of the Accept header, or else in the format of the request."""
+    accepted = [_media_type(part) for part in (accept or "").split(",")]
+    if msgpack is not None and any(media_type in MSGPACK_MEDIA_TYPES for media_type in accepted):
+        return MSGPACK_MEDIA_TYPE
+    if JSON_MEDIA_TYPE in accepted:
+        return JSON_MEDIA_TYPE
+    if msgpack is not None and _media_type(content_type) in MSGPACK_MEDIA_TYPES:
+        return MSGPACK_MEDIA_TYPE
+    return JSON_MEDIA_TYPE
+
+
+def encode_columnar_path(order: list, length: float, converged: bool, media_type: str = JSON_MEDIA_TYPE) -> bytes:
+    """Encode the visiting order, length (km) and converged flag of a path as JSON or msgpack."""
+    result = {"order": order, "length": length, "converged": converged}
+    if media_type == MSGPACK_MEDIA_TYPE:
+        return msgpack.packb(result)
+    return json.dumps(result, separators=(",", ":")).encode("utf-8")
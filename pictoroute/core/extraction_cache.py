@@ -0,0 +1,146 @@
+"""Content-addressed cache of addresses extracted from images by the vision model."""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from pictoroute.core.metrics import EXTRACTION_CACHE_LOOKUPS
+from pictoroute.core.sqlite_store import SQLiteStore
+from pictoroute.models.address import Address
+
+load_dotenv()
+
+EXTRACTION_CACHE_PATH = os.getenv("EXTRACTION_CACHE_PATH", "extraction_cache.sqlite3")
+EXTRACTION_CACHE_TTL = float(os.getenv("EXTRACTION_CACHE_TTL_DAYS", "30")) * 24 * 3600
+EXTRACTION_CACHE_MAX_ENTRIES = int(os.getenv("EXTRACTION_CACHE_MAX_ENTRIES", "10000"))
+
+
+def content_hash(base64_images: list[str]) -> str:
+    """SHA-256 over the images sent to the model, in order."""
+    digest = hashlib.sha256()
+    for base64_image in base64_images:
+        digest.update(hashlib.sha256(base64_image.encode("ascii")).digest())
+    return digest.hexdigest()
+
+
+class ExtractionCache(SQLiteStore):
+    """
+    SQLite backed cache of extracted addresses, keyed on image content, prompt and model.
+
+    Only exact repeats are hits, found on the SHA-256 of the images. Perceptual
+    hashes can not tell sheets printed on the same table template apart, so
+    near-identical retakes are extracted again. Entries expire after `ttl` seconds
+    and the least recently used entries are evicted above `max_entries`.
+    """
+
+    def __init__(
+        self,
+        path: str = EXTRACTION_CACHE_PATH,
+        ttl: float = EXTRACTION_CACHE_TTL,
+        max_entries: int = EXTRACTION_CACHE_MAX_ENTRIES,
+    ):
+        super().__init__(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._connection().execute(
+            """
+            CREATE TABLE IF NOT EXISTS extraction_cache (
+                key TEXT PRIMARY KEY,
+                prompt_version TEXT NOT NULL,
+                model TEXT NOT NULL,
+                addresses TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+
+    @staticmethod
+    def key(base64_images: list[str], prompt_version: str, model: str) -> str:
+        """The cache key of these images, computed once for a `get` and the `set` after a miss."""
+        return f"{content_hash(base64_images)}:{prompt_version}:{model}"
+
+    def get(self, key: str) -> Optional[list[Address]]:
+        """Return the cached addresses for the images of this key, None on a miss."""
+        connection = self._connection()
+        now = time.time()
+        row = connection.execute(
+            "SELECT addresses FROM extraction_cache WHERE key = ? AND created_at >= ?",
+            (key, now - self.ttl),
+        ).fetchone()
+
+        if row is None:
+            with self._lock:
+                self.misses += 1
+            EXTRACTION_CACHE_LOOKUPS.inc(result="miss")
+            return None
+
+        connection.execute("UPDATE extraction_cache SET last_access = ? WHERE key = ?", (now, key))
+        with self._lock:
+            self.hits += 1
+        EXTRACTION_CACHE_LOOKUPS.inc(result="hit")
+        return [Address(**address) for address in json.loads(row[0])]
+
+    def set(self, key: str, prompt_version: str, model: str, addresses: list[Address]):
+        """Store the addresses extracted from the images of this key."""
+        now = time.time()
+        row = (
+            key,
+            prompt_version,
+            model,
+            json.dumps([address.model_dump(exclude={"coordinates"}) for address in addresses]),
+            now,
+            now,
+        )
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute(
+                "INSERT OR REPLACE INTO extraction_cache "
+                "(key, prompt_version, model, addresses, created_at, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                row,
+            )
+            connection.execute(
+                "DELETE FROM extraction_cache WHERE created_at < ?", (now - self.ttl,)
+            )
+            (size,) = connection.execute("SELECT COUNT(*) FROM extraction_cache").fetchone()
+            if size > self.max_entries:
+                connection.execute(
+                    "DELETE FROM extraction_cache WHERE key IN "
+                    "(SELECT key FROM extraction_cache ORDER BY last_access LIMIT ?)",
+                    (size - self.max_entries,),
+                )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def stats(self) -> dict:
+        """Return the hit/miss counters of this process and the size of the cache."""
+        (size,) = self._connection().execute("SELECT COUNT(*) FROM extraction_cache").fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": size,
+        }
+
+
+_default_cache: Optional[ExtractionCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_extraction_cache() -> ExtractionCache:
+    """Return the extraction cache shared by the whole process, created on first use."""
+    global _default_cache
+    if _default_cache is None:
+        with _default_cache_lock:
+            if _default_cache is None:
+                _default_cache = ExtractionCache()
+    return _default_cache
@@ -1,22 +1,201 @@
 """Module for generating AI responses."""
 
+import asyncio
+import importlib
 import json
 import os
+import random
+from typing import Callable, Optional
 
-from anthropic import Anthropic
 from dotenv import load_dotenv
-from openai import AsyncOpenAI
+
+from pictoroute.core.metrics import LLM_TOKENS, span
 
 load_dotenv()
 
-client = AsyncOpenAI()
+CLAUDE_TIMEOUT = float(os.getenv("CLAUDE_TIMEOUT", "120"))
+CLAUDE_MAX_RETRIES = int(os.getenv("CLAUDE_MAX_RETRIES", "3"))
+CLAUDE_MAX_CONCURRENCY = int(os.getenv("CLAUDE_MAX_CONCURRENCY", "8"))
+CLAUDE_RETRY_BASE_DELAY = float(os.getenv("CLAUDE_RETRY_BASE_DELAY", "1"))
+CLAUDE_RETRY_MAX_DELAY = float(os.getenv("CLAUDE_RETRY_MAX_DELAY", "30"))
+
+# Providers whose connection is opened in the application lifespan, comma separated (e.g. "anthropic")
+GENAI_WARM_UP_PROVIDERS = [name for name in os.getenv("GENAI_WARM_UP_PROVIDERS", "").split(",") if name.strip()]
+# Seconds the warm-up of a provider may take
+GENAI_WARM_UP_TIMEOUT = float(os.getenv("GENAI_WARM_UP_TIMEOUT", "5"))
+
+
+class Provider:
+    """
+    A model provider whose SDK is imported and client created the first time it is used.
+
+    Importing the SDKs of all providers at start-up costs every worker process
+    hundreds of milliseconds, and creating a client can fail without its API key.
+    """
+
+    def __init__(self, name: str, module: str, create_client: Callable, warm_up_path: Optional[str] = None):
+        self.name = name
+        self.module_name = module
+        self.create_client = create_client
+        self.warm_up_path = warm_up_path
+        self._module = None
+        self._client = None
+
+    @property
+    def module(self):
+        """The SDK module, imported on first use."""
+        if self._module is None:
+            self._module = importlib.import_module(self.module_name)
+        return self._module
+
+    @property
+    def client(self):
+        """The client shared by all requests of this process, its connection pool is reused."""
+        if self._client is None:
+            self._client = self.create_client(self.module)
+        return self._client
+
+    async def warm_up(self):
+        """Create the client and open a connection ahead of the first request, errors are only logged."""
+        client = self.client
+        if self.warm_up_path is None:
+            return
+        try:
+            # Any response will do, the point is the pooled (TLS) connection
+            await asyncio.wait_for(client.get(self.warm_up_path, cast_to=object), GENAI_WARM_UP_TIMEOUT)
+        except Exception as e:
+            print(f"Warm-up of the {self.name} client: {e.__class__.__name__}")
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+
+_providers: dict[str, Provider] = {}
+
+
+def register_provider(
+    name: str, module: str, create_client: Callable, warm_up_path: Optional[str] = None
+) -> Provider:
+    """
+    Register a model provider, nothing is imported until it is used.
+
+    Args:
+        name (str): Name to look the provider up with.
+        module (str): The SDK module, imported on first use.
+        create_client (Callable): Called with the SDK module, returns the client.
+        warm_up_path (str): Path requested on warm-up to open a connection, None only creates the client.
+    """
+    provider = Provider(name, module, create_client, warm_up_path)
+    _providers[name] = provider
+    return provider
+
+
+def get_provider(name: str) -> Provider:
+    if name not in _providers:
+        raise ValueError(f"Unknown model provider: {name}")
+    return _providers[name]
+
+
+async def warm_up_providers(names: list[str] = GENAI_WARM_UP_PROVIDERS):
+    """Create the clients of these providers and open their connections, used on application startup."""
+    await asyncio.gather(*[get_provider(name.strip()).warm_up() for name in names])
+
+
+async def close_providers():
+    """Close the clients that were created, used on application shutdown."""
+    global _claude_semaphore
+    for provider in _providers.values():
+        await provider.close()
+    _claude_semaphore = None
+
+
+register_provider("openai", "openai", lambda openai: openai.AsyncOpenAI(), warm_up_path="/models")
+register_provider(
+    "anthropic",
+    "anthropic",
+    lambda anthropic: anthropic.AsyncAnthropic(
+        api_key=os.getenv("CLAUDE_API_KEY"),
+        timeout=CLAUDE_TIMEOUT,
+        # Retries are done in create_claude_message, with jitter and under the semaphore
+        max_retries=0,
+    ),
+    warm_up_path="/v1/models",
+)
+
+_claude_semaphore: Optional[asyncio.Semaphore] = None
+
+
+def __getattr__(name: str):
+    # `client` (the OpenAI client) used to be created at import time, it is now created on first access
+    if name == "client":
+        return get_provider("openai").client
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def get_openai_client():
+    """Return the OpenAI client shared by all requests."""
+    return get_provider("openai").client
+
+
+def get_claude_client():
+    """Return the Anthropic client shared by all requests, its connection pool is reused."""
+    global _claude_semaphore
+    if _claude_semaphore is None:
+        _claude_semaphore = asyncio.Semaphore(CLAUDE_MAX_CONCURRENCY)
+    return get_provider("anthropic").client
+
+
+def retryable_claude_errors() -> tuple:
+    """Errors worth retrying: network problems, rate limits and overloaded/5xx responses."""
+    anthropic = get_provider("anthropic").module
+    return (anthropic.APIConnectionError, anthropic.RateLimitError, anthropic.InternalServerError)
+
+
+async def close_claude_client():
+    """Close the shared Anthropic client, used on application shutdown."""
+    global _claude_semaphore
+    await get_provider("anthropic").close()
+    _claude_semaphore = None
+
+
+async def create_claude_message(**kwargs):
+    """
+    Call the Anthropic messages API with the shared client.
+
+    At most CLAUDE_MAX_CONCURRENCY calls are in flight per worker, retryable errors
+    are retried with exponential backoff and full jitter.
+    """
+    claude_client = get_claude_client()
+    for attempt in range(CLAUDE_MAX_RETRIES + 1):
+        try:
+            async with _claude_semaphore:
+                with span("claude_request"):
+                    message = await claude_client.messages.create(**kwargs)
+            record_token_usage(message, kwargs.get("model"))
+            return message
+        except retryable_claude_errors() as e:
+            if attempt == CLAUDE_MAX_RETRIES:
+                raise
+            delay = random.uniform(0, min(CLAUDE_RETRY_MAX_DELAY, CLAUDE_RETRY_BASE_DELAY * 2**attempt))
+            print(f"Claude request failed ({e.__class__.__name__}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+def record_token_usage(message, model):
+    """Count the input and output tokens of a Claude response."""
+    usage = getattr(message, "usage", None)
+    if usage is not None:
+        LLM_TOKENS.inc(usage.input_tokens or 0, model=model, type="input")
+        LLM_TOKENS.inc(usage.output_tokens or 0, model=model, type="output")
 
 
 async def generate_ai_response_given_messages_and_obtain_chat_response(
     messages, model="gpt-4o"
 ):
     """Generate an AI response given messages."""
-    chat_completion = await client.chat.completions.create(
+    chat_completion = await get_openai_client().chat.completions.create(
         messages=messages,
         model=model,
     )
@@ -27,7 +206,7 @@ async def generate_ai_response_given_messages_and_obtain_json_response(
     messages, model="gpt-4o"
 ):
     """Generate an AI response given messages."""
-    chat_completion = await client.chat.completions.create(
+    chat_completion = await get_openai_client().chat.completions.create(
         messages=messages,
         model=model,
         response_format={"type": "json_object"},
@@ -38,7 +217,7 @@ async def generate_ai_response_given_messages_and_obtain_json_response(
 
 async def generate_ai_response_user_only(prompt, model="gpt-4o"):
     """Generate an AI response with only user message."""
-    chat_completion = await client.chat.completions.create(
+    chat_completion = await get_openai_client().chat.completions.create(
         messages=[
             {
                 "role": "user",
@@ -52,7 +231,7 @@ async def generate_ai_response_user_only(prompt, model="gpt-4o"):
 
 async def generate_ai_response_user_only_json(prompt, model="gpt-4o"):
     """Generate an AI response with only user message."""
-    chat_completion = await client.chat.completions.create(
+    chat_completion = await get_openai_client().chat.completions.create(
         messages=[
             {
                 "role": "user",
@@ -69,7 +248,7 @@ async def generate_ai_response_with_system_message_json(
     prompt, system_message, model="gpt-4o"
 ):
     """Generate an AI response with a system message."""
-    chat_completion = await client.chat.completions.create(
+    chat_completion = await get_openai_client().chat.completions.create(
         messages=[
             {
                 "role": "system",
@@ -91,7 +270,7 @@ async def generate_ai_response_with_system_message(
     prompt, system_message, model="gpt-4o"
 ):
     """Generate an AI response with a system message."""
-    chat_completion = await client.chat.completions.create(
+    chat_completion = await get_openai_client().chat.completions.create(
         messages=[
             {
                 "role": "system",
@@ -126,7 +305,7 @@ async def vision_response_with_json_response(
         for base64_image in base64_images
     ]
 
-    chat_completion = await client.chat.completions.create(
+    chat_completion = await get_openai_client().chat.completions.create(
         messages=messages,
         model=model,
         response_format={"type": "json_object"},
@@ -135,37 +314,129 @@ async def vision_response_with_json_response(
     return json.loads(chat_completion.choices[0].message.content)
 
 
-async def claude_vision_response_with_json_response(
-    prompt: str, base64_images: list[bytes], model="claude-3-5-sonnet-20241022"
-):
-    """Generate an AI response with images using Claude 3.5 Sonnet."""
-    client = Anthropic(api_key=os.getenv("CLAUDE_API_KEY"))
+def claude_vision_messages(
+    prompt: str, base64_images: list[bytes], media_types: list[str] | None = None, prefill: bool = True
+) -> list[dict]:
+    """Build the messages for a Claude vision call, prefilled to start the JSON answer unless `prefill` is False."""
     content = [{"type": "text", "text": prompt}]
 
+    # Images are sent as JPEG unless their media type is given
+    if media_types is None:
+        media_types = ["image/jpeg"] * len(base64_images)
+
     # Add each image to the content array
-    for base64_image in base64_images:
+    for base64_image, media_type in zip(base64_images, media_types):
         content.append(
             {
                 "type": "image",
                 "source": {
                     "type": "base64",
-                    "media_type": "image/jpeg",
+                    "media_type": media_type,
                     "data": base64_image,
                 },
             }
         )
 
-    messages = [
-        {"role": "user", "content": content},
-        {"role": "assistant", "content": "Here is the JSON requested:\n{"},
-    ]
+    messages = [{"role": "user", "content": content}]
+    if prefill:
+        messages.append({"role": "assistant", "content": "Here is the JSON requested:\n{"})
+    return messages
+
 
-    chat_completion = client.messages.create(
+async def claude_vision_response_with_json_response(
+    prompt: str,
+    base64_images: list[bytes],
+    model="claude-3-5-sonnet-20241022",
+    media_types: list[str] | None = None,
+    max_tokens: int = 8192,
+):
+    """Generate an AI response with images using Claude 3.5 Sonnet."""
+    messages = claude_vision_messages(prompt, base64_images, media_types)
+
+    chat_completion = await create_claude_message(
         messages=messages,
         model=model,
-        max_tokens=8192,
+        max_tokens=max_tokens,
         temperature=0,
     )
     chat_completion = chat_completion.content[0].text
 
     return json.loads("{" + chat_completion[: chat_completion.rfind("}") + 1])
+
+
+async def claude_vision_tool_response(
+    prompt: str,
+    base64_images: list[bytes],
+    tool: dict,
+    model="claude-3-5-sonnet-20241022",
+    media_types: list[str] | None = None,
+    max_tokens: int = 4096,
+) -> dict:
+    """
+    Generate a structured response with images, the model has to answer by calling `tool`.
+
+    Returns:
+        dict: The input of the tool call, it follows the input schema of the tool.
+    """
+    message = await create_claude_message(
+        messages=claude_vision_messages(prompt, base64_images, media_types, prefill=False),
+        model=model,
+        max_tokens=max_tokens,
+        temperature=0,
+        tools=[tool],
+        tool_choice={"type": "tool", "name": tool["name"]},
+    )
+    if message.stop_reason == "max_tokens":
+        raise ValueError(f"The structured answer was cut off at max_tokens={max_tokens}.")
+    for block in message.content:
+        if block.type == "tool_use":
+            return block.input
+    raise ValueError(f"The model did not call the {tool['name']} tool.")
+
+
+async def stream_claude_vision_response(
+    prompt: str,
+    base64_images: list[bytes],
+    model="claude-3-5-sonnet-20241022",
+    media_types: list[str] | None = None,
+    max_tokens: int = 8192,
+    tool: dict | None = None,
+):
+    """
+    Stream the text of an AI response with images using Claude 3.5 Sonnet.
+
+    The text continues the prefilled "{" of the answer. With a `tool` the model has
+    to answer by calling it and the streamed text is the JSON input of the call.
+    Retryable errors are only retried as long as no text has been yielded yet.
+    """
+    messages = claude_vision_messages(prompt, base64_images, media_types, prefill=tool is None)
+    tool_kwargs = {} if tool is None else {"tools": [tool], "tool_choice": {"type": "tool", "name": tool["name"]}}
+    claude_client = get_claude_client()
+    semaphore = _claude_semaphore
+
+    for attempt in range(CLAUDE_MAX_RETRIES + 1):
+        started = False
+        try:
+            async with semaphore:
+                async with claude_client.messages.stream(
+                    messages=messages,
+                    model=model,
+                    max_tokens=max_tokens,
+                    temperature=0,
+                    **tool_kwargs,
+                ) as stream:
+                    async for event in stream:
+                        if event.type == "text" and tool is None:
+                            started = True
+                            yield event.text
+                        elif event.type == "input_json":
+                            started = True
+                            yield event.partial_json
+                    record_token_usage(await stream.get_final_message(), model)
+            return
+        except retryable_claude_errors() as e:
+            if started or attempt == CLAUDE_MAX_RETRIES:
+                raise
+            delay = random.uniform(0, min(CLAUDE_RETRY_MAX_DELAY, CLAUDE_RETRY_BASE_DELAY * 2**attempt))
+            print(f"Claude request failed ({e.__class__.__name__}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
@@ -0,0 +1,270 @@
+"""Persistent on-disk cache for geocoding results, shared between worker processes."""
+
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from pictoroute.core.metrics import GEOCODE_CACHE_LOOKUPS
+from pictoroute.core.sqlite_store import SQLiteStore
+from pictoroute.models.address import Address, Coordinates
+
+load_dotenv()
+
+GEOCODE_CACHE_PATH = os.getenv("GEOCODE_CACHE_PATH", "geocode_cache.sqlite3")
+GEOCODE_CACHE_TTL = float(os.getenv("GEOCODE_CACHE_TTL_DAYS", "90")) * 24 * 3600
+GEOCODE_CACHE_NEGATIVE_TTL = float(os.getenv("GEOCODE_CACHE_NEGATIVE_TTL_HOURS", "24")) * 3600
+GEOCODE_CACHE_MAX_ENTRIES = int(os.getenv("GEOCODE_CACHE_MAX_ENTRIES", "100000"))
+# The last access of an entry (for the LRU eviction) is written at most once per interval,
+# so cache hits are reads only
+GEOCODE_CACHE_ACCESS_INTERVAL = 3600
+# Keys per SELECT, below SQLite's limit of host parameters
+LOOKUP_CHUNK_SIZE = 500
+
+# Marker returned for addresses that are known to not resolve
+NOT_FOUND = object()
+
+
+def normalize_address_key(address: Address) -> str:
+    """Create a cache key from street, house number, postal code and city."""
+
+    def clean(value: str) -> str:
+        return re.sub(r"\s+", " ", value or "").strip().lower()
+
+    # "3812 ea" and "3812EA84" (house number glued to postcode) both become "3812ea"
+    postal_code = re.sub(r"\s+", "", address.postal_code or "").lower()[:6]
+    return "|".join(
+        [
+            clean(address.street_name),
+            clean(address.house_number).replace(" ", ""),
+            postal_code,
+            clean(address.city),
+        ]
+    )
+
+
+class GeocodeCache(SQLiteStore):
+    """
+    SQLite backed cache of address coordinates.
+
+    Successful lookups are kept for `ttl` seconds and failed lookups (negative
+    entries) for `negative_ttl` seconds. When the cache grows beyond `max_entries`
+    the least recently used entries are evicted.
+    """
+
+    def __init__(
+        self,
+        path: str = GEOCODE_CACHE_PATH,
+        ttl: float = GEOCODE_CACHE_TTL,
+        negative_ttl: float = GEOCODE_CACHE_NEGATIVE_TTL,
+        max_entries: int = GEOCODE_CACHE_MAX_ENTRIES,
+    ):
+        super().__init__(path)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self._connection().execute(
+            """
+            CREATE TABLE IF NOT EXISTS geocode_cache (
+                key TEXT PRIMARY KEY,
+                latitude REAL,
+                longitude REAL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._connection().execute(
+            "CREATE INDEX IF NOT EXISTS idx_geocode_cache_last_access ON geocode_cache (last_access)"
+        )
+
+    def get(self, address: Address):
+        """
+        Look up the coordinates of an address.
+
+        Returns:
+            Coordinates for a cached result, NOT_FOUND for a cached failed lookup
+            and None when the address is not in the cache (or expired).
+        """
+        return self.get_many([address])[0]
+
+    def get_many(self, addresses: list[Address]) -> list:
+        """Look up several addresses at once, returns a result per address as `get` does."""
+        keys = [normalize_address_key(address) for address in addresses]
+        now = time.time()
+        rows = {}
+        connection = self._connection()
+        distinct = list(dict.fromkeys(keys))
+        for start in range(0, len(distinct), LOOKUP_CHUNK_SIZE):
+            chunk = distinct[start : start + LOOKUP_CHUNK_SIZE]
+            rows.update(
+                (row[0], row[1:])
+                for row in connection.execute(
+                    "SELECT key, latitude, longitude, created_at, last_access FROM geocode_cache "
+                    f"WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                )
+            )
+
+        results, touched = [], []
+        hits = negative_hits = misses = 0
+        for key in keys:
+            row = rows.get(key)
+            if row is not None:
+                latitude, longitude, created_at, last_access = row
+                ttl = self.negative_ttl if latitude is None else self.ttl
+                if now - created_at <= ttl:
+                    if now - last_access > GEOCODE_CACHE_ACCESS_INTERVAL:
+                        touched.append((now, key))
+                        rows[key] = (latitude, longitude, created_at, now)
+                    if latitude is None:
+                        negative_hits += 1
+                        results.append(NOT_FOUND)
+                    else:
+                        hits += 1
+                        results.append(Coordinates(latitude=latitude, longitude=longitude))
+                    continue
+            misses += 1
+            results.append(None)
+
+        if touched:
+            connection.executemany("UPDATE geocode_cache SET last_access = ? WHERE key = ?", touched)
+        with self._lock:
+            self.hits += hits
+            self.negative_hits += negative_hits
+            self.misses += misses
+        for result, count in (("hit", hits), ("negative_hit", negative_hits), ("miss", misses)):
+            if count:
+                GEOCODE_CACHE_LOOKUPS.inc(count, result=result)
+        return results
+
+    def set(self, address: Address, coordinates: Optional[Coordinates]):
+        """Store the result of a lookup, None stores a negative entry."""
+        self.set_many([(address, coordinates)])
+
+    def set_many(self, entries: list[tuple[Address, Optional[Coordinates]]]):
+        """Store several lookup results in a single transaction."""
+        now = time.time()
+        rows = [
+            (
+                normalize_address_key(address),
+                coordinates.latitude if coordinates else None,
+                coordinates.longitude if coordinates else None,
+                now,
+                now,
+            )
+            for address, coordinates in entries
+        ]
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany(
+                "INSERT OR REPLACE INTO geocode_cache VALUES (?, ?, ?, ?, ?)", rows
+            )
+            self._evict(connection, now)
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def _evict(self, connection: sqlite3.Connection, now: float):
+        """Remove expired entries and keep at most max_entries (least recently used first)."""
+        connection.execute(
+            "DELETE FROM geocode_cache WHERE (latitude IS NULL AND created_at < ?) OR created_at < ?",
+            (now - self.negative_ttl, now - self.ttl),
+        )
+        (size,) = connection.execute("SELECT COUNT(*) FROM geocode_cache").fetchone()
+        if size > self.max_entries:
+            connection.execute(
+                "DELETE FROM geocode_cache WHERE key IN "
+                "(SELECT key FROM geocode_cache ORDER BY last_access LIMIT ?)",
+                (size - self.max_entries,),
+            )
+
+    def warm_from_file(self, file_path: str, batch_size: int = 1000) -> int:
+        """
+        Fill the cache from a file of addresses with coordinates.
+
+        CSV and JSONL files (by extension) are read row by row in the formats written
+        by `python -m pictoroute.core.bulk_geocoding`. Other files are read as a JSON
+        list of address dicts, or a dict with an "addresses" list. Addresses without
+        coordinates and rows that can not be parsed are skipped.
+
+        Returns:
+            int: The number of addresses added to the cache.
+        """
+        # Imported here, bulk_geocoding imports this module through the geocoding service
+        from pictoroute.core.bulk_geocoding import detect_format, read_rows, row_address
+
+        try:
+            file_format = detect_format(file_path)
+        except ValueError:
+            file_format = None
+        if file_format is None:
+            with open(file_path, "r") as f:
+                addresses = json.load(f)
+            if isinstance(addresses, dict):
+                addresses = addresses["addresses"]
+            rows = iter(addresses)
+            file_format = "jsonl"  # Address dicts, the same as JSONL rows
+        else:
+            _, rows = read_rows(file_path, file_format)
+
+        added = 0
+        entries = []
+        for row in rows:
+            try:
+                address = row_address(row, file_format)
+            except ValueError:
+                continue
+            if address.coordinates is not None:
+                entries.append((address, address.coordinates))
+            if len(entries) >= batch_size:
+                self.set_many(entries)
+                added += len(entries)
+                entries = []
+        if entries:
+            self.set_many(entries)
+            added += len(entries)
+        return added
+
+    def stats(self) -> dict:
+        """Return the hit/miss counters of this process and the size of the cache."""
+        (size,) = self._connection().execute("SELECT COUNT(*) FROM geocode_cache").fetchone()
+        return {
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "size": size,
+        }
+
+
+_default_cache: Optional[GeocodeCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_geocode_cache() -> GeocodeCache:
+    """Return the geocode cache shared by the whole process, created on first use."""
+    global _default_cache
+    if _default_cache is None:
+        with _default_cache_lock:
+            if _default_cache is None:
+                _default_cache = GeocodeCache()
+    return _default_cache
+
+
+if __name__ == "__main__":
+    # Usage: python -m pictoroute.core.geocode_cache customers_geocoded.csv tmp_with_coordinates.txt
+    for file_path in sys.argv[1:]:
+        added = get_geocode_cache().warm_from_file(file_path)
+        print(f"Added {added} addresses from {file_path}")
+    print(get_geocode_cache().stats())
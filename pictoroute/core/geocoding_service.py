@@ -0,0 +1,248 @@
+"""Async geocoding service with a pooled HTTP client and a token bucket rate limiter."""
+
+import asyncio
+import os
+import time
+from typing import Optional
+
+import httpx
+from dotenv import load_dotenv
+
+from pictoroute.core.geocode_cache import NOT_FOUND, get_geocode_cache, normalize_address_key
+from pictoroute.core.get_coordinates import geocode_attempts
+from pictoroute.core.metrics import GEOCODE_ATTEMPTS, span
+from pictoroute.core.offline_geocoder import get_offline_geocoder
+from pictoroute.models.address import Address, Coordinates
+
+load_dotenv()
+
+NOMINATIM_URL = os.getenv("NOMINATIM_URL", "https://nominatim.openstreetmap.org")
+NOMINATIM_USER_AGENT = os.getenv("NOMINATIM_USER_AGENT", "test_app")
+# Nominatim's usage policy allows at most one request per second
+NOMINATIM_RATE_LIMIT = float(os.getenv("NOMINATIM_RATE_LIMIT", "1"))
+NOMINATIM_BURST = int(os.getenv("NOMINATIM_BURST", "1"))
+GEOCODE_MAX_CONCURRENCY = int(os.getenv("GEOCODE_MAX_CONCURRENCY", "4"))
+GEOCODE_TIMEOUT = float(os.getenv("GEOCODE_TIMEOUT", "5"))
+GEOCODE_DEADLINE = float(os.getenv("GEOCODE_DEADLINE", "30"))
+
+
+class TokenBucket:
+    """Async token bucket, allows `rate` acquisitions per second with bursts of `capacity`."""
+
+    def __init__(self, rate: float, capacity: int = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait until a token is available and take it."""
+        # The lock makes waiters queue up in order instead of all waking at once
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class GeocodingService:
+    """
+    Geocodes batches of addresses concurrently against a Nominatim compatible API.
+
+    Duplicate addresses in a batch are looked up once, every address runs through
+    its fallback attempts on its own (so a miss on the first attempt does not wait
+    for the rest of the batch) and all requests share one HTTP client and one rate
+    limiter. Results go through the persistent geocode cache.
+    """
+
+    def __init__(
+        self,
+        base_url: str = NOMINATIM_URL,
+        user_agent: str = NOMINATIM_USER_AGENT,
+        rate_limit: float = NOMINATIM_RATE_LIMIT,
+        burst: int = NOMINATIM_BURST,
+        max_concurrency: int = GEOCODE_MAX_CONCURRENCY,
+        timeout: float = GEOCODE_TIMEOUT,
+        deadline: float = GEOCODE_DEADLINE,
+        use_cache: bool = True,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.user_agent = user_agent
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.deadline = deadline
+        self.use_cache = use_cache
+        self.rate_limiter = TokenBucket(rate_limit, burst)
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Created on first use so the client binds to the running event loop
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"User-Agent": self.user_agent},
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_concurrency),
+                transport=self._transport,
+            )
+        return self._client
+
+    async def aclose(self):
+        """Close the pooled HTTP client."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def geocode(self, query: str) -> Optional[Coordinates]:
+        """Geocode a free-form query, returns None when nothing was found."""
+        async with self._semaphore:
+            await self.rate_limiter.acquire()
+            with span("nominatim_request"):
+                response = await self.client.get(
+                    "/search", params={"q": query, "format": "json", "limit": 1}
+                )
+        response.raise_for_status()
+        results = response.json()
+        if not results:
+            return None
+        return Coordinates(latitude=float(results[0]["lat"]), longitude=float(results[0]["lon"]))
+
+    async def geocode_address(self, address: Address, refresh: bool = False) -> Optional[Coordinates]:
+        """
+        Run the fallback attempts for one address until one of them resolves.
+
+        With `refresh` the cached result is skipped and overwritten, for addresses a user corrected.
+        """
+        offline_geocoder = get_offline_geocoder()
+        if offline_geocoder is not None:
+            coordinates = offline_geocoder.lookup(address)
+            if coordinates is not None:
+                return coordinates
+
+        # SQLite calls block, they run in a thread so the event loop keeps serving requests
+        cache = get_geocode_cache() if self.use_cache else None
+        if cache is not None and not refresh:
+            cached = await asyncio.to_thread(cache.get, address)
+            if cached is NOT_FOUND:
+                return None
+            if cached is not None:
+                return cached
+
+        coordinates, failed = await self._lookup(address)
+        # Only remember a negative result when every attempt got an actual answer
+        if cache is not None and (coordinates is not None or not failed):
+            await asyncio.to_thread(cache.set, address, coordinates)
+        return coordinates
+
+    async def _lookup(self, address: Address) -> tuple[Optional[Coordinates], bool]:
+        """Query the fallback attempts of an address, returns the coordinates and whether an attempt failed."""
+        failed = False
+        for number, attempt in enumerate(geocode_attempts(address), start=1):
+            try:
+                coordinates = await self.geocode(attempt)
+            except httpx.HTTPError as e:
+                print(f"Error geocoding {attempt}: {e}")
+                GEOCODE_ATTEMPTS.inc(attempt=number, result="error")
+                failed = True
+                continue
+            GEOCODE_ATTEMPTS.inc(attempt=number, result="found" if coordinates else "not_found")
+            if coordinates:
+                return coordinates, failed
+        return None, failed
+
+    async def geocode_addresses(
+        self, addresses: list[Address], deadline: Optional[float] = None, refresh: bool = False
+    ) -> list[Address]:
+        """
+        Add coordinates to a batch of addresses.
+
+        The cache is read and written once per batch, in a thread.
+
+        Args:
+            addresses (list[Address]): The addresses to geocode, updated in place.
+            deadline (float): Seconds after which unresolved addresses are returned
+                without coordinates. Defaults to the service deadline plus the time the
+                rate limit needs for one request per address that is not cached.
+            refresh (bool): Skip cached results and overwrite them with new lookups.
+
+        Returns:
+            list[Address]: The same addresses in the same order.
+        """
+        # Look up every distinct address only once
+        unique: dict[str, Address] = {}
+        for address in addresses:
+            unique.setdefault(normalize_address_key(address), address)
+
+        results: dict[str, Optional[Coordinates]] = {}
+        offline_geocoder = get_offline_geocoder()
+        if offline_geocoder is not None:
+            for key, address in unique.items():
+                coordinates = offline_geocoder.lookup(address)
+                if coordinates is not None:
+                    results[key] = coordinates
+        missing = {key: address for key, address in unique.items() if key not in results}
+
+        cache = get_geocode_cache() if self.use_cache else None
+        if cache is not None and not refresh and missing:
+            cached = await asyncio.to_thread(cache.get_many, list(missing.values()))
+            for key, value in zip(list(missing), cached):
+                if value is not None:
+                    results[key] = None if value is NOT_FOUND else value
+                    del missing[key]
+
+        if deadline is None:
+            # Every address that is not cached needs at least one rate limited request
+            deadline = self.deadline + len(missing) / self.rate_limiter.rate
+        tasks = {key: asyncio.ensure_future(self._lookup(address)) for key, address in missing.items()}
+        if tasks:
+            with span("geocode_batch"):
+                done, pending = await asyncio.wait(tasks.values(), timeout=deadline)
+            for task in pending:
+                task.cancel()
+            if pending:
+                print(f"Geocoding deadline of {deadline}s passed, {len(pending)} addresses unresolved")
+
+        entries = []
+        for key, task in tasks.items():
+            if task.done() and not task.cancelled() and task.exception() is None:
+                coordinates, failed = task.result()
+                results[key] = coordinates
+                # Only remember a negative result when every attempt got an actual answer
+                if coordinates is not None or not failed:
+                    entries.append((missing[key], coordinates))
+        if cache is not None and entries:
+            await asyncio.to_thread(cache.set_many, entries)
+
+        for address in addresses:
+            coordinates = results.get(normalize_address_key(address))
+            if coordinates is not None:
+                address.coordinates = coordinates
+        return addresses
+
+
+_default_service: Optional[GeocodingService] = None
+
+
+def get_geocoding_service() -> GeocodingService:
+    """Return the geocoding service shared by all requests of this process."""
+    global _default_service
+    if _default_service is None:
+        _default_service = GeocodingService()
+    return _default_service
+
+
+async def close_geocoding_service():
+    """Close the shared geocoding service, used on application shutdown."""
+    global _default_service
+    if _default_service is not None:
+        await _default_service.aclose()
+        _default_service = None
@@ -1,6 +1,8 @@
 import json
-from geopy.geocoders import Nominatim
 
+from pictoroute.core.geocode_cache import NOT_FOUND, get_geocode_cache
+from pictoroute.core.metrics import GEOCODE_ATTEMPTS, span
+from pictoroute.core.offline_geocoder import get_offline_geocoder
 from pictoroute.models.address import Address, Coordinates
 
 
@@ -24,46 +26,70 @@ def load_addresses_from_file_with_json_string(file_path: str) -> dict:
     return addresses
 
 
-def geocode_with_fallback(geolocator, address: Address):
-    attempts = [
+def geocode_attempts(address: Address) -> list[str]:
+    """Queries to try in order, the postal code is dropped in the fallback."""
+    return [
         f"{address.street_name} {address.house_number} {address.postal_code[:6]} {address.city}",
         f"{address.street_name} {address.house_number} {address.city}",
     ]
+
+
+def geocode_with_fallback(geolocator, address: Address):
+    attempts = geocode_attempts(address)
     
-    for attempt in attempts:
-        location = geolocator.geocode(attempt, exactly_one=True)
+    for number, attempt in enumerate(attempts, start=1):
+        with span("nominatim_request"):
+            location = geolocator.geocode(attempt, exactly_one=True)
+        GEOCODE_ATTEMPTS.inc(attempt=number, result="found" if location else "not_found")
         if location:
             return location
     
     return None
 
 
-def append_coordinates_to_address(address: Address) -> Address:
+def append_coordinates_to_address(address: Address, use_cache: bool = True) -> Address:
     """Get coordinates for address."""
+    # Resolve from the local postcode index first, Nominatim is only used on a miss
+    offline_geocoder = get_offline_geocoder()
+    if offline_geocoder is not None:
+        coordinates = offline_geocoder.lookup(address)
+        if coordinates is not None:
+            address.coordinates = coordinates
+            return address
+
+    cache = get_geocode_cache() if use_cache else None
+    if cache is not None:
+        cached = cache.get(address)
+        if cached is NOT_FOUND:
+            return address
+        if cached is not None:
+            address.coordinates = cached
+            return address
+
+    # geopy is only needed on this synchronous path, imported on first use
+    from geopy.geocoders import Nominatim
+
     geolocator = Nominatim(user_agent="test_app", timeout=5)
     
     location = geocode_with_fallback(geolocator, address)
 
+    coordinates = None
     if location:
         coordinates = Coordinates(
             latitude=location.latitude,
             longitude=location.longitude,
         )
         address.coordinates = coordinates
+
+    # Also remember addresses that could not be resolved (negative caching)
+    if cache is not None:
+        cache.set(address, coordinates)
     return address
 
 
 if __name__ == "__main__":
-    addresses = load_addresses_from_file_with_json_string('tests/test_addresses.txt')
-    addresses_with_coordinates = []
-
-    # add coordinates to addresses 
-    for address in addresses:
-        address = Address(**address)
-        address = append_coordinates_to_address(address)
-        addresses_with_coordinates.append(address)
-        
-    # save to file
-    with open('tmp_with_coordinates.txt', 'w') as f:
-        f.write(json.dumps([address.dict() for address in addresses_with_coordinates], indent=2))
+    # Files of addresses are geocoded by the streaming bulk command, with checkpoints and parallel lookups
+    from pictoroute.core.bulk_geocoding import main
+
+    main()
 
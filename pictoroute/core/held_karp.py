@@ -0,0 +1,98 @@
+"""Exact Held-Karp solver for paths with a fixed start and end point."""
+
+import os
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Upper bound on the memory of the dynamic programming tables
+HELD_KARP_MAX_BYTES = int(os.getenv("HELD_KARP_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Rough cost per (subset, last, previous) combination, used to estimate the run time
+SECONDS_PER_STATE = 5e-9
+
+
+def held_karp_memory_bytes(n: int) -> int:
+    """Memory needed for n points (including start and end): a float64 cost and int8 parent per state."""
+    m = max(n - 2, 0)
+    return (2**m) * m * (8 + 1)
+
+
+def estimate_held_karp_seconds(n: int) -> float:
+    """Estimate the run time of `held_karp_fixed_endpoints` for n points."""
+    m = max(n - 2, 0)
+    return (2**m) * m * m * SECONDS_PER_STATE
+
+
+def held_karp_fixed_endpoints(distances, start_index=0, end_index=None) -> list[int]:
+    """
+    Find the shortest path from start to end through all points with bitmask dynamic programming.
+
+    The table is filled one subset size at a time, all subsets of a size are
+    handled in a single vectorized step per last point.
+
+    Args:
+        distances: n x n distance matrix.
+        start_index (int): Index of the fixed first point.
+        end_index (int): Index of the fixed last point, defaults to the last point.
+
+    Returns:
+        list[int]: The optimal path, starting at start_index and ending at end_index.
+    """
+    distances = np.asarray(distances, dtype=np.float64)
+    n = len(distances)
+    if end_index is None:
+        end_index = n - 1
+    if start_index == end_index:
+        raise ValueError("Start and end points cannot be the same.")
+
+    stops = np.array([i for i in range(n) if i not in (start_index, end_index)], dtype=np.int64)
+    m = len(stops)
+    if m == 0:
+        return [start_index, end_index]
+    if held_karp_memory_bytes(n) > HELD_KARP_MAX_BYTES:
+        raise ValueError(f"Too many points ({n}) for the exact solver.")
+
+    # Distances between the stops only, and from the start / to the end
+    between = distances[np.ix_(stops, stops)]
+    from_start = distances[start_index, stops]
+    to_end = distances[stops, end_index]
+
+    # cost[mask, j]: shortest path from the start through the stops in mask, ending at stop j
+    cost = np.full((2**m, m), np.inf)
+    parent = np.full((2**m, m), -1, dtype=np.int8)
+    singles = 1 << np.arange(m)
+    cost[singles, np.arange(m)] = from_start
+
+    masks = np.arange(2**m)
+    popcounts = np.zeros(2**m, dtype=np.int64)
+    for bit in range(m):
+        popcounts += (masks >> bit) & 1
+
+    for size in range(2, m + 1):
+        layer = masks[popcounts == size]
+        for j in range(m):
+            with_j = layer[(layer >> j) & 1 == 1]
+            previous = with_j ^ (1 << j)
+            # cost of arriving at j from every possible previous last stop i
+            candidates = cost[previous] + between[:, j]
+            best = np.argmin(candidates, axis=1)
+            cost[with_j, j] = candidates[np.arange(len(with_j)), best]
+            parent[with_j, j] = best
+
+    full = 2**m - 1
+    last = int(np.argmin(cost[full] + to_end))
+
+    # Walk back through the parents
+    order = []
+    mask = full
+    while last >= 0:
+        order.append(last)
+        previous = int(parent[mask, last])
+        mask ^= 1 << last
+        last = previous
+    order.reverse()
+
+    return [start_index] + [int(stops[j]) for j in order] + [end_index]
@@ -0,0 +1,191 @@
+"""Preprocessing of uploaded images to shrink them before the vision call."""
+
+import asyncio
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+from PIL import Image, ImageOps
+
+load_dotenv()
+
+try:
+    # Optional, registers HEIC/HEIF support (iPhone photos) with Pillow
+    from pillow_heif import register_heif_opener
+
+    register_heif_opener()
+except ImportError:
+    pass
+
+# Claude downscales images with a long edge above 1568 px or more than ~1.15 megapixels,
+# sending anything larger only costs upload time
+MAX_LONG_EDGE = int(os.getenv("IMAGE_MAX_LONG_EDGE", "1568"))
+MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", "1150000"))
+JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+
+# Only correct small rotations, larger angles are more likely a misdetection
+MAX_DESKEW_ANGLE = 15.0
+MIN_DESKEW_ANGLE = 0.3
+
+# Only crop when the detected table covers at least this part of the image
+MIN_TABLE_AREA = 0.2
+
+# Media types accepted by the vision API, keyed on the file signature
+MEDIA_TYPE_SIGNATURES = {
+    b"\xff\xd8\xff": "image/jpeg",
+    b"\x89PNG\r\n\x1a\n": "image/png",
+    b"GIF87a": "image/gif",
+    b"GIF89a": "image/gif",
+}
+
+class UnsupportedImageError(ValueError):
+    """An upload can not be decoded and is not in a format the vision API accepts."""
+
+
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("IMAGE_PREPROCESSING_WORKERS", "4")),
+    thread_name_prefix="image-preprocessing",
+)
+
+
+def detect_media_type(data: bytes) -> Optional[str]:
+    """Detect the media type of encoded image bytes, None when the vision API does not accept the format."""
+    for signature, media_type in MEDIA_TYPE_SIGNATURES.items():
+        if data.startswith(signature):
+            return media_type
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def deskew(gray: np.ndarray) -> np.ndarray:
+    """Rotate the image so that the (table) lines are horizontal."""
+    binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)[1]
+    height, width = gray.shape
+    lines = cv2.HoughLinesP(
+        binary, 1, np.pi / 180, threshold=100, minLineLength=width // 3, maxLineGap=20
+    )
+    if lines is None:
+        return gray
+
+    x1, y1, x2, y2 = lines.reshape(-1, 4).T
+    angles = np.degrees(np.arctan2(y2 - y1, x2 - x1))
+    # Fold to (-90, 90] and keep the near horizontal lines
+    angles = np.where(angles > 90, angles - 180, np.where(angles <= -90, angles + 180, angles))
+    angles = angles[np.abs(angles) <= MAX_DESKEW_ANGLE]
+    if len(angles) == 0:
+        return gray
+
+    angle = float(np.median(angles))
+    if abs(angle) < MIN_DESKEW_ANGLE:
+        return gray
+
+    rotation = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    return cv2.warpAffine(
+        gray, rotation, (width, height), flags=cv2.INTER_LINEAR, borderValue=255
+    )
+
+
+def crop_to_table(gray: np.ndarray) -> np.ndarray:
+    """Crop the image to the bounding box of its table lines, if a table is found."""
+    binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)[1]
+    height, width = gray.shape
+
+    # Long horizontal and vertical strokes are table borders, text is removed by the opening
+    horizontal = cv2.morphologyEx(
+        binary, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (max(width // 20, 1), 1))
+    )
+    vertical = cv2.morphologyEx(
+        binary, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (1, max(height // 20, 1)))
+    )
+    points = cv2.findNonZero(horizontal | vertical)
+    if points is None:
+        return gray
+
+    x, y, w, h = cv2.boundingRect(points)
+    if w * h < MIN_TABLE_AREA * width * height:
+        return gray
+
+    # Keep a small margin so text touching the border is not cut off
+    margin = max(width, height) // 100
+    return gray[
+        max(y - margin, 0) : min(y + h + margin, height),
+        max(x - margin, 0) : min(x + w + margin, width),
+    ]
+
+
+def downscale(gray: np.ndarray, max_long_edge=MAX_LONG_EDGE, max_pixels=MAX_PIXELS) -> np.ndarray:
+    """Downscale the image to the effective resolution of the vision model."""
+    height, width = gray.shape
+    scale = min(1.0, max_long_edge / max(width, height), (max_pixels / (width * height)) ** 0.5)
+    if scale >= 1.0:
+        return gray
+    size = (max(int(width * scale), 1), max(int(height * scale), 1))
+    return cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+
+
+def preprocess_image(
+    data: bytes,
+    deskew_image: bool = True,
+    crop_table: bool = True,
+) -> tuple[bytes, str]:
+    """
+    Prepare an uploaded image for the vision model.
+
+    Applies the EXIF rotation, converts to grayscale, deskews, crops to the table,
+    downscales to the model's effective resolution and re-encodes as JPEG. When the
+    image can not be decoded but is in a format the vision API accepts, the original
+    bytes are returned unchanged.
+
+    Args:
+        data (bytes): The encoded image as uploaded.
+        deskew_image (bool): Whether to straighten a slightly rotated photo.
+        crop_table (bool): Whether to crop to the table region.
+
+    Returns:
+        tuple[bytes, str]: The encoded image and its media type.
+
+    Raises:
+        UnsupportedImageError: The image can not be decoded nor sent as it is (for
+            example HEIC photos without the optional pillow-heif package).
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image = ImageOps.exif_transpose(image)
+            gray = np.asarray(image.convert("L"))
+    except Exception as e:
+        media_type = detect_media_type(data)
+        if media_type is None:
+            raise UnsupportedImageError(
+                "Could not decode the image, send a JPEG, PNG, GIF or WebP image "
+                "(HEIC photos need the optional pillow-heif package)."
+            )
+        print(f"Could not decode image, sending it unprocessed: {e}")
+        return data, media_type
+
+    # Work on at most twice the target resolution, keeps the line detection below fast
+    gray = downscale(gray, 2 * MAX_LONG_EDGE, 4 * MAX_PIXELS)
+    if deskew_image:
+        gray = deskew(gray)
+    if crop_table:
+        gray = crop_to_table(gray)
+    gray = downscale(gray)
+
+    output = io.BytesIO()
+    Image.fromarray(gray).save(output, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+    return output.getvalue(), "image/jpeg"
+
+
+async def run_in_preprocessing_pool(function, *args, **kwargs):
+    """Run a CPU-bound image function in the preprocessing thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, lambda: function(*args, **kwargs))
+
+
+async def preprocess_image_async(data: bytes, **kwargs) -> tuple[bytes, str]:
+    """Run `preprocess_image` in the preprocessing thread pool."""
+    return await run_in_preprocessing_pool(preprocess_image, data, **kwargs)
@@ -1,8 +1,24 @@
+import asyncio
 import base64
-from typing import List
+import hashlib
+import json
+import os
+import re
+from typing import AsyncIterator, List
 from fastapi import UploadFile
+from pydantic import ValidationError
 
-from pictoroute.core.genai import claude_vision_response_with_json_response
+from pictoroute.core.extraction_cache import get_extraction_cache
+from pictoroute.core.genai import (
+    claude_vision_response_with_json_response,
+    claude_vision_tool_response,
+    stream_claude_vision_response,
+)
+from pictoroute.core.geocoding_service import get_geocoding_service
+from pictoroute.core.image_preprocessing import UnsupportedImageError, detect_media_type, preprocess_image_async
+from pictoroute.core.local_ocr import LOCAL_OCR_ENABLED, extract_addresses_locally_async
+from pictoroute.core.metrics import span
+from pictoroute.core.uploads import UploadBudget, UploadTooLargeError, encode_upload, read_upload
 from pictoroute.models.address import Address
 
 
@@ -77,30 +93,420 @@ Remember:
 Now, process the addresses from the provided image(s) and present your findings in the specified format.
 """
 
-async def process_images(images: List[UploadFile]) -> list[Address]:
+# Prompt of the fast mode: no reasoning transcript, the addresses are returned through
+# the record_addresses tool, so every output token is an address field
+FAST_PROMPT = """
+Extract every Dutch address from the table(s) in the attached image(s), in the order of the rows.
+
+- street_name: the street, spelled as in the image (keep Dutch spelling).
+- house_number: the number with its suffix, e.g. "47A".
+- postal_code: "1234AB" without the house number (a cell like "1234AB84" is postal code 1234AB and house number 84), "" when missing.
+- city: the city, from the row or the context of the table.
+
+Skip incomplete rows. Call record_addresses with all addresses.
+"""
+
+# Fields the model fills in, the other Address fields are set by the application
+ADDRESS_FIELDS = ("street_name", "house_number", "postal_code", "city")
+
+ADDRESS_TOOL = {
+    "name": "record_addresses",
+    "description": "Record the addresses extracted from the images.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "addresses": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        field: {"type": "string"} for field in ADDRESS_FIELDS
+                    },
+                    "required": list(ADDRESS_FIELDS),
+                },
+            }
+        },
+        "required": ["addresses"],
+    },
+}
+
+VISION_MODEL = "claude-3-5-sonnet-20241022"
+
+# "verbose" (PROMPT, the model reasons about every address before the JSON) or
+# "fast" (FAST_PROMPT, structured output with only the address fields)
+EXTRACTION_MODE = os.getenv("EXTRACTION_MODE", "verbose")
+EXTRACTION_MODES = ("verbose", "fast")
+# Output token budgets of a vision call per mode
+VISION_MAX_TOKENS = {
+    "verbose": int(os.getenv("VISION_VERBOSE_MAX_TOKENS", "8192")),
+    "fast": int(os.getenv("VISION_FAST_MAX_TOKENS", "4096")),
+}
+
+# Number of images sent per vision call, 0 sends all images of an upload in one call
+VISION_IMAGES_PER_CALL = int(os.getenv("VISION_IMAGES_PER_CALL", "0"))
+# Maximum number of vision calls running at the same time for one upload
+VISION_MAX_PARALLEL_CALLS = int(os.getenv("VISION_MAX_PARALLEL_CALLS", "4"))
+
+# Cached extraction results are only reused for the same prompt
+PROMPT_VERSION = hashlib.sha256(PROMPT.encode("utf-8")).hexdigest()[:12]
+PROMPT_VERSIONS = {
+    "verbose": PROMPT_VERSION,
+    "fast": hashlib.sha256((FAST_PROMPT + json.dumps(ADDRESS_TOOL)).encode("utf-8")).hexdigest()[:12],
+}
+
+async def encode_images(
+    images: List[UploadFile], preprocess: bool = True
+) -> tuple[list[str], list[str]]:
     """
-    Process a list of images and return the processed images as base64 strings.
+    Read, preprocess and base64-encode uploaded images.
+
+    Uploads are read in chunks within the size limits of `pictoroute.core.uploads`,
+    without preprocessing they are encoded while reading, so only the base64 text is kept.
 
     Args:
         images (List[UploadFile]): A list of image files to be processed.
+        preprocess (bool): Whether to straighten, crop and downscale the images first.
 
     Returns:
-        dict: A dictionary with base64-encoded images and OCR results.
+        tuple[list[str], list[str]]: The base64-encoded images and their media types.
+
+    Raises:
+        UploadTooLargeError: An image or all images together exceed the size limits.
+        UnsupportedImageError: An image can not be decoded or sent to the vision model.
     """
     base64_images = []
+    media_types = []
+    budget = UploadBudget()
     for image in images:
         try:
-            # Read the image file and encode to base64
-            img_data = await image.read()
-            img_base64 = base64.b64encode(img_data).decode("utf-8")
+            if preprocess:
+                # Read the image file, shrink it (in a thread pool) and encode to base64
+                with span("read_upload"):
+                    img_data = await read_upload(image, budget)
+                with span("preprocess"):
+                    try:
+                        img_data, media_type = await preprocess_image_async(img_data)
+                    except UnsupportedImageError as e:
+                        raise UnsupportedImageError(f"{image.filename}: {e}")
+                with span("base64_encode"):
+                    img_base64 = base64.b64encode(img_data).decode("utf-8")
+                del img_data
+            else:
+                with span("read_upload"):
+                    img_base64, head = await encode_upload(image, budget)
+                media_type = detect_media_type(head)
+                if media_type is None:
+                    raise UnsupportedImageError(f"{image.filename} is not a JPEG, PNG, GIF or WebP image.")
             base64_images.append(img_base64)
+            media_types.append(media_type)
+        except (UploadTooLargeError, UnsupportedImageError):
+            raise
         except Exception as e:
             print(f"Error processing image {image.filename}: {e}")
             continue
+    return base64_images, media_types
+
+
+def deduplicate_addresses(addresses: list[Address]) -> list[Address]:
+    """
+    Drop repeated addresses, keeping the first.
+
+    A full postal code and house number identify an address. Without a full postal
+    code (the fast prompt leaves it empty when it is unreadable) the street name is
+    compared as well, so "Kerkstraat 12" and "Dorpsstraat 12" are both kept.
+    """
+    seen = set()
+    unique = []
+    for address in addresses:
+        postal_code = re.sub(r"\s+", "", address.postal_code).upper()[:6]
+        key = (
+            postal_code,
+            re.sub(r"\s+", "", address.house_number).lower(),
+            "" if len(postal_code) == 6 else re.sub(r"\s+", " ", address.street_name).strip().lower(),
+        )
+        if key not in seen:
+            seen.add(key)
+            unique.append(address)
+    return unique
+
+
+def parse_addresses(items: list) -> list[Address]:
+    """Validate the address objects of a structured answer, invalid objects are skipped."""
+    addresses = []
+    for item in items:
+        try:
+            addresses.append(Address.model_validate({field: item.get(field) for field in ADDRESS_FIELDS}))
+        except AttributeError:
+            print(f"Skipping invalid address {item}")
+        except ValidationError as e:
+            fields = ", ".join(str(error["loc"][0]) for error in e.errors())
+            print(f"Skipping invalid address {item}, invalid fields: {fields}")
+    return addresses
+
+
+async def extract_addresses(
+    base64_images: list[str], media_types: list[str], use_cache: bool = True, mode: str = EXTRACTION_MODE
+) -> list[Address]:
+    """Extract the addresses from encoded images with a single vision call, see EXTRACTION_MODES."""
+    if mode not in EXTRACTION_MODES:
+        raise ValueError(f"Unknown extraction mode: {mode}")
+
+    # Repeated uploads of the same job list skip the vision call
+    # Hashing megabytes of images and the SQLite reads and writes stay off the event loop
+    cache = get_extraction_cache() if use_cache else None
+    if cache is not None:
+        key = await asyncio.to_thread(cache.key, base64_images, PROMPT_VERSIONS[mode], VISION_MODEL)
+        cached = await asyncio.to_thread(cache.get, key)
+        if cached is not None:
+            return cached
 
     # Pass the base64-encoded images to the vision API or any other service
-    addresses = await claude_vision_response_with_json_response(
-        prompt=PROMPT, base64_images=base64_images
+    with span("vision_extraction"):
+        if mode == "fast":
+            answer = await claude_vision_tool_response(
+                prompt=FAST_PROMPT,
+                base64_images=base64_images,
+                tool=ADDRESS_TOOL,
+                model=VISION_MODEL,
+                media_types=media_types,
+                max_tokens=VISION_MAX_TOKENS[mode],
+            )
+            addresses = parse_addresses(answer.get("addresses", []))
+        else:
+            answer = await claude_vision_response_with_json_response(
+                prompt=PROMPT,
+                base64_images=base64_images,
+                model=VISION_MODEL,
+                media_types=media_types,
+                max_tokens=VISION_MAX_TOKENS[mode],
+            )
+            addresses = [Address(**address) for address in answer["addresses"]]
+
+    if cache is not None:
+        await asyncio.to_thread(cache.set, key, PROMPT_VERSIONS[mode], VISION_MODEL, addresses)
+    return addresses
+
+
+async def process_images(
+    images: List[UploadFile],
+    preprocess: bool = True,
+    use_cache: bool = True,
+    images_per_call: int = VISION_IMAGES_PER_CALL,
+    local_ocr: bool = LOCAL_OCR_ENABLED,
+    mode: str = EXTRACTION_MODE,
+) -> list[Address]:
+    """
+    Process a list of images and return the processed images as base64 strings.
+
+    Args:
+        images (List[UploadFile]): A list of image files to be processed.
+        preprocess (bool): Whether to straighten, crop and downscale the images first.
+        use_cache (bool): Whether to reuse addresses extracted earlier from the same images.
+        images_per_call (int): Split the images over concurrent vision calls of this
+            many images each, 0 sends all images in one call.
+        local_ocr (bool): Whether to try the local OCR first, images it reads with
+            enough confidence skip the vision model.
+        mode (str): Extraction mode of the vision calls, see EXTRACTION_MODES.
+
+    Returns:
+        dict: A dictionary with base64-encoded images and OCR results.
+    """
+    base64_images, media_types = await encode_images(images, preprocess)
+
+    # Read the images locally first, only images without a confident result need the vision model
+    if local_ocr:
+        with span("local_ocr"):
+            local_results = await asyncio.gather(
+                *[extract_addresses_locally_async(base64_image) for base64_image in base64_images]
+            )
+    else:
+        local_results = [None] * len(base64_images)
+
+    # Groups in upload order: addresses of a locally read image, or indices of a run of
+    # images for one vision call (at most images_per_call images)
+    groups: list[tuple[str, list]] = []
+    vision_images: list[int] = []
+    for index, local_result in enumerate(local_results):
+        if local_result is not None:
+            if vision_images:
+                groups.append(("vision", vision_images))
+                vision_images = []
+            groups.append(("local", local_result))
+            continue
+        vision_images.append(index)
+        if images_per_call > 0 and len(vision_images) == images_per_call:
+            groups.append(("vision", vision_images))
+            vision_images = []
+    if vision_images or not groups:
+        groups.append(("vision", vision_images))
+
+    # At most VISION_MAX_PARALLEL_CALLS vision calls at a time
+    semaphore = asyncio.Semaphore(VISION_MAX_PARALLEL_CALLS)
+
+    async def extract_group(kind: str, group: list) -> list[Address]:
+        if kind == "local":
+            return group
+        async with semaphore:
+            return await extract_addresses(
+                [base64_images[index] for index in group],
+                [media_types[index] for index in group],
+                use_cache,
+                mode,
+            )
+
+    if len(groups) == 1:
+        return await extract_group(*groups[0])
+
+    results = await asyncio.gather(
+        *[extract_group(kind, group) for kind, group in groups],
+        return_exceptions=True,
     )
 
-    return [Address(**address) for address in addresses["addresses"]]
+    # Merge in upload order, a failed group does not fail the others
+    addresses = []
+    errors = []
+    for result in results:
+        if isinstance(result, BaseException):
+            print(f"Error extracting addresses: {result}")
+            errors.append(result)
+        else:
+            addresses.extend(result)
+    if len(errors) == len(results):
+        raise errors[0]
+
+    # Overlapping photos show the same rows more than once
+    return deduplicate_addresses(addresses)
+
+
+class AddressStreamParser:
+    """
+    Incrementally parses the objects of the "addresses" array from streamed JSON text.
+
+    Text before the array (such as <processing> blocks) is skipped, every object is
+    returned as soon as its closing brace has been received.
+    """
+
+    START_PATTERN = re.compile(r'"addresses"\s*:\s*\[')
+
+    def __init__(self):
+        self.buffer = ""
+        self.position = None
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.object_start = None
+        self.done = False
+
+    def feed(self, text: str) -> list[dict]:
+        """Add streamed text and return the address objects completed by it."""
+        self.buffer += text
+        if self.position is None:
+            match = self.START_PATTERN.search(self.buffer)
+            if not match:
+                return []
+            self.position = match.end()
+
+        objects = []
+        while self.position < len(self.buffer) and not self.done:
+            char = self.buffer[self.position]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == "{":
+                if self.depth == 0:
+                    self.object_start = self.position
+                self.depth += 1
+            elif char == "}":
+                self.depth -= 1
+                if self.depth == 0:
+                    objects.append(json.loads(self.buffer[self.object_start : self.position + 1]))
+            elif char == "]" and self.depth == 0:
+                self.done = True
+            self.position += 1
+        return objects
+
+
+async def stream_addresses(
+    base64_images: list[str], media_types: list[str], mode: str = EXTRACTION_MODE
+) -> AsyncIterator[Address]:
+    """Yield the addresses in the images while the vision model is still answering."""
+    if mode not in EXTRACTION_MODES:
+        raise ValueError(f"Unknown extraction mode: {mode}")
+    cache = get_extraction_cache()
+    key = await asyncio.to_thread(cache.key, base64_images, PROMPT_VERSIONS[mode], VISION_MODEL)
+    cached = await asyncio.to_thread(cache.get, key)
+    if cached is not None:
+        for address in cached:
+            yield address
+        return
+
+    # In the fast mode the streamed text is the {"addresses": [...]} input of the tool call
+    parser = AddressStreamParser()
+    addresses = []
+    async for text in stream_claude_vision_response(
+        prompt=FAST_PROMPT if mode == "fast" else PROMPT,
+        base64_images=base64_images,
+        model=VISION_MODEL,
+        media_types=media_types,
+        max_tokens=VISION_MAX_TOKENS[mode],
+        tool=ADDRESS_TOOL if mode == "fast" else None,
+    ):
+        for item in parser.feed(text):
+            for address in parse_addresses([item]) if mode == "fast" else [Address(**item)]:
+                addresses.append(address)
+                yield address
+
+    # Only cache complete answers
+    if parser.done:
+        await asyncio.to_thread(cache.set, key, PROMPT_VERSIONS[mode], VISION_MODEL, addresses)
+
+
+async def stream_geocoded_addresses(
+    base64_images: list[str], media_types: list[str], mode: str = EXTRACTION_MODE
+) -> AsyncIterator[str]:
+    """
+    Stream extracted addresses with coordinates as NDJSON lines.
+
+    Every address is geocoded as soon as it is extracted and written as
+    {"index": <position in the image>, "address": {...}} once its coordinates are
+    known, so lines can arrive out of order. An error ends the stream with an
+    {"error": "..."} line.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    geocoding_service = get_geocoding_service()
+
+    async def geocode(index: int, address: Address):
+        await geocoding_service.geocode_addresses([address])
+        await queue.put((index, address))
+
+    async def extract():
+        tasks = []
+        try:
+            index = 0
+            async for address in stream_addresses(base64_images, media_types, mode):
+                tasks.append(asyncio.create_task(geocode(index, address)))
+                index += 1
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await queue.put(None)
+
+    producer = asyncio.create_task(extract())
+    try:
+        while (item := await queue.get()) is not None:
+            index, address = item
+            yield json.dumps({"index": index, "address": address.model_dump()}) + "\n"
+        await producer
+    except Exception as e:
+        print(f"Error streaming addresses: {e}")
+        yield json.dumps({"error": str(e)}) + "\n"
+    finally:
+        # Stop extracting when the client disconnects
+        producer.cancel()
@@ -0,0 +1,204 @@
+"""Local address extraction with OpenCV table detection, Tesseract OCR and a Dutch address parser."""
+
+import base64
+import io
+import os
+import re
+from typing import Optional
+
+import cv2
+import numpy as np
+import pytesseract
+from dotenv import load_dotenv
+from PIL import Image
+
+from pictoroute.core.image_preprocessing import run_in_preprocessing_pool
+from pictoroute.models.address import Address
+
+load_dotenv()
+
+LOCAL_OCR_ENABLED = os.getenv("LOCAL_OCR_ENABLED", "false").lower() == "true"
+# Tesseract language(s), "nld" needs the tesseract-ocr-nld language pack
+LOCAL_OCR_LANGUAGE = os.getenv("LOCAL_OCR_LANGUAGE", "nld")
+# Images with an address row below this confidence are sent to the vision model
+LOCAL_OCR_MIN_CONFIDENCE = float(os.getenv("LOCAL_OCR_MIN_CONFIDENCE", "0.8"))
+
+POSTAL_CODE = r"\d{4}\s?[A-Z]{2}"
+POSTAL_CODE_PATTERN = re.compile(POSTAL_CODE)
+# A street name and house number, "Eemplein 65"
+STREET_NUMBER_PATTERN = re.compile(r"[^\W\d_]{2,}\s\d+")
+# "Eemplein 65 | 3812EA65 Amersfoort", the house number may be glued to the postal code,
+# the street may start with an ordinal ("2e Hugo de Grootstraat", "1ste Loosdrechtseweg")
+ADDRESS_PATTERN = re.compile(
+    r"(?P<street>(?:\d+(?:[eE]|ste|de)\s)?[^\W\d_][\w'.\- ]*?)\s+"
+    r"(?P<house_number>\d+(?:\s?[a-zA-Z](?![a-zA-Z]))?(?:[-/]\w+)?)"
+    r"[^\w]+"
+    r"(?P<postal_code>" + POSTAL_CODE + r")"
+    r"(?:\s?(?P<repeated_house_number>\d+[a-zA-Z]?))?"
+    r"[\s,|]*"
+    r"(?P<city>[^\W\d_][\w'\- ]*[^\W\d_])?"
+)
+
+# Minimal height in pixels between two table lines to count as a row
+MIN_ROW_HEIGHT = 12
+
+_tesseract_available = True
+
+
+def parse_dutch_address(text: str) -> Optional[tuple[Address, float]]:
+    """
+    Parse a single Dutch address from a line of text.
+
+    Handles the house number glued to the postal code ("1234AB84"). The returned
+    confidence (0-1) drops when the city is missing, when the repeated house
+    number does not match the one after the street name or when text right before
+    the street is dropped (it may be part of the street name).
+
+    Returns:
+        tuple[Address, float]: The address and the confidence of the parse, or None.
+    """
+    text = re.sub(r"\s+", " ", text).strip()
+    match = ADDRESS_PATTERN.search(text)
+    if not match:
+        return None
+
+    house_number = match.group("house_number").replace(" ", "")
+    repeated_house_number = match.group("repeated_house_number")
+    city = (match.group("city") or "").strip()
+
+    confidence = 1.0
+    # "1-3" is repeated as "1" after the postal code, so only the numbers are compared
+    if repeated_house_number and re.match(r"\d+", repeated_house_number).group() != re.match(
+        r"\d+", house_number
+    ).group():
+        confidence *= 0.5
+    if not city:
+        confidence *= 0.5
+    # Text in a separate cell ("Jansen | Eemplein 65") is fine, text glued to the street is not
+    leading = text[: match.start()].rstrip()
+    if leading and leading[-1].isalnum():
+        confidence *= 0.5
+
+    address = Address(
+        street_name=match.group("street").strip(" .-"),
+        house_number=house_number,
+        postal_code=match.group("postal_code").replace(" ", ""),
+        city=city,
+    )
+    return address, confidence
+
+
+def find_rows(gray: np.ndarray) -> list[tuple[int, int]]:
+    """Find the rows of a table as (top, bottom) pixel ranges between horizontal lines."""
+    binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)[1]
+    width = gray.shape[1]
+    horizontal = cv2.morphologyEx(
+        binary, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (max(width // 4, 1), 1))
+    )
+
+    # y positions covered by a line, runs of neighbouring positions are one line
+    line_ys = np.flatnonzero(horizontal.any(axis=1))
+    if len(line_ys) < 2:
+        return []
+    breaks = np.flatnonzero(np.diff(line_ys) > 1)
+    starts = np.concatenate([[line_ys[0]], line_ys[breaks + 1]])
+    ends = np.concatenate([line_ys[breaks], [line_ys[-1]]])
+
+    return [
+        (int(top), int(bottom))
+        for top, bottom in zip(ends[:-1] + 1, starts[1:])
+        if bottom - top >= MIN_ROW_HEIGHT
+    ]
+
+
+def ocr_lines(gray: np.ndarray) -> list[tuple[str, float]]:
+    """OCR an image and return its text lines with their mean word confidence (0-1)."""
+    data = pytesseract.image_to_data(
+        gray, lang=LOCAL_OCR_LANGUAGE, config="--psm 6", output_type=pytesseract.Output.DICT
+    )
+    lines: dict[tuple, tuple[list[str], list[float]]] = {}
+    for index, word in enumerate(data["text"]):
+        confidence = float(data["conf"][index])
+        if not word.strip() or confidence < 0:
+            continue
+        key = (data["block_num"][index], data["par_num"][index], data["line_num"][index])
+        words, confidences = lines.setdefault(key, ([], []))
+        words.append(word)
+        confidences.append(confidence / 100)
+    return [(" ".join(words), float(np.mean(confidences))) for words, confidences in lines.values()]
+
+
+def extract_addresses_locally(base64_image: str) -> Optional[list[tuple[Address, float]]]:
+    """
+    Extract addresses from an image without calling the vision model.
+
+    Table rows are found with OpenCV and read with Tesseract, every row with a
+    postal code is parsed as an address. Table rows with a street and house number
+    but no postal code (a misread postal code) count as unread rows with confidence
+    0, other rows without a postal code (headers) are skipped. The confidence of a
+    row is the OCR confidence times the parse confidence.
+
+    Returns:
+        list[tuple[Address, float]]: The addresses with their confidence, or None when
+            no address could be read (or Tesseract is not installed).
+    """
+    global _tesseract_available
+    if not _tesseract_available:
+        return None
+
+    with Image.open(io.BytesIO(base64.b64decode(base64_image))) as image:
+        gray = np.asarray(image.convert("L"))
+
+    rows = find_rows(gray)
+    try:
+        if rows:
+            # Cells can span multiple lines, so every table row is joined into one line
+            lines = []
+            for top, bottom in rows:
+                row_lines = ocr_lines(gray[top:bottom])
+                if row_lines:
+                    text = " ".join(text for text, _ in row_lines)
+                    confidence = min(confidence for _, confidence in row_lines)
+                    lines.append((text, confidence))
+        else:
+            lines = ocr_lines(gray)
+    except pytesseract.TesseractNotFoundError:
+        print("Tesseract is not installed, local OCR is disabled")
+        _tesseract_available = False
+        return None
+
+    addresses = []
+    for text, ocr_confidence in lines:
+        if not POSTAL_CODE_PATTERN.search(text):
+            if rows and STREET_NUMBER_PATTERN.search(text):
+                # An address row without a readable postal code, the vision model has to read it
+                addresses.append((None, 0.0))
+            continue
+        parsed = parse_dutch_address(text)
+        if parsed is None:
+            # A postal code that can not be parsed is a row we could not read
+            addresses.append((None, 0.0))
+            continue
+        address, parse_confidence = parsed
+        addresses.append((address, ocr_confidence * parse_confidence))
+    return addresses or None
+
+
+async def extract_addresses_locally_async(
+    base64_image: str, min_confidence: float = LOCAL_OCR_MIN_CONFIDENCE
+) -> Optional[list[Address]]:
+    """
+    Run the local extraction in the preprocessing thread pool.
+
+    Returns:
+        list[Address]: The addresses when every address row reached `min_confidence`,
+            None when the image should go to the vision model instead.
+    """
+    try:
+        addresses = await run_in_preprocessing_pool(extract_addresses_locally, base64_image)
+    except Exception as e:
+        print(f"Error during local OCR: {e}")
+        return None
+    if addresses is None or any(confidence < min_confidence for _, confidence in addresses):
+        return None
+    return [address for address, _ in addresses]
@@ -0,0 +1,250 @@
+"""Local search engine for improving routes with fixed start and end points."""
+
+import time
+from collections import deque
+
+import numpy as np
+
+from pictoroute.core.metrics import LOCAL_SEARCH_ITERATIONS, LOCAL_SEARCH_MOVES
+
+# Number of nearest neighbors considered as candidates for each point
+DEFAULT_NEIGHBORS = 10
+
+# Longest segment that is moved as a whole by an Or-opt move
+DEFAULT_OR_OPT_SEGMENT = 3
+
+# Minimal improvement (in km) for a move to be accepted, avoids cycling on float noise
+EPSILON = 1e-9
+
+# Number of points processed between two checks of the deadline
+DEADLINE_CHECK_INTERVAL = 64
+
+
+def neighbor_lists(distances, k=DEFAULT_NEIGHBORS) -> list[list[int]]:
+    """Return the k nearest other points for every point, sorted by distance."""
+    n = len(distances)
+    k = min(k, n - 1)
+    if k <= 0:
+        return [[] for _ in range(n)]
+
+    candidates = np.array(distances, dtype=np.float64)
+    np.fill_diagonal(candidates, np.inf)
+
+    # argpartition finds the k nearest in O(n) per row, only those k are sorted
+    nearest = np.argpartition(candidates, k - 1, axis=1)[:, :k]
+    order = np.take_along_axis(candidates, nearest, axis=1).argsort(axis=1)
+    return np.take_along_axis(nearest, order, axis=1).tolist()
+
+
+def matrix_rows(distances):
+    """
+    Return a matrix that can be indexed as d[a][b] from Python at list speed.
+
+    The rows of a numpy array become memoryviews on its buffer, so the matrix is
+    not copied (a float32 matrix stays float32) and every lookup returns a Python
+    float. Nested lists and lazy matrices are returned as they are.
+    """
+    if isinstance(distances, np.ndarray):
+        return [memoryview(row) for row in np.ascontiguousarray(distances)]
+    return distances
+
+
+def local_search_fixed_endpoints(
+    distances,
+    path,
+    k=DEFAULT_NEIGHBORS,
+    max_segment_length=DEFAULT_OR_OPT_SEGMENT,
+    neighbors=None,
+    deadline=None,
+):
+    """
+    Improve a path with 2-opt and Or-opt moves while keeping the start and end fixed.
+
+    See `local_search_with_deadline`, this returns only the path.
+    """
+    return local_search_with_deadline(
+        distances, path, deadline, k=k, max_segment_length=max_segment_length, neighbors=neighbors
+    )[0]
+
+
+def local_search_with_deadline(
+    distances,
+    path,
+    deadline=None,
+    k=DEFAULT_NEIGHBORS,
+    max_segment_length=DEFAULT_OR_OPT_SEGMENT,
+    neighbors=None,
+    active=None,
+):
+    """
+    Improve a path with 2-opt and Or-opt moves until no move improves it or the deadline passes.
+
+    Every move is scored with an O(1) delta on the distance matrix, candidate moves
+    are restricted to the k nearest neighbors of a point and points whose
+    surroundings did not change are skipped (don't-look bits).
+
+    Args:
+        distances: n x n distance matrix (numpy array or nested lists).
+        path (list[int]): Initial path, the first and last index stay in place.
+        k (int): Number of nearest neighbors considered for each point.
+        max_segment_length (int): Longest segment moved by an Or-opt move.
+        neighbors (list[list[int]]): Precomputed neighbor lists, computed when None.
+        deadline (float): Wall clock time (time.time()) to stop at, None runs until converged.
+        active (list[int]): Points to search moves from, all points when None. Used to
+            repair a path locally after a change, points touched by a move are added.
+
+    Returns:
+        tuple[list[int], bool]: The improved path and whether it is a local optimum,
+            False when the search was stopped by the deadline.
+    """
+    route = list(path)
+    n = len(route)
+    if n < 4:
+        return route, True
+
+    if neighbors is None:
+        neighbors = neighbor_lists(distances, k)
+    # Indexing numpy arrays element by element from Python is slow, index memoryview rows instead
+    d = matrix_rows(distances)
+
+    pos = [0] * len(d)
+    for index, node in enumerate(route):
+        pos[node] = index
+
+    def reverse(i, j):
+        """Reverse route[i..j] in place and update the positions."""
+        route[i : j + 1] = route[i : j + 1][::-1]
+        for index in range(i, j + 1):
+            pos[route[index]] = index
+
+    def try_two_opt(a):
+        """Try to find an improving 2-opt move that adds an edge from a to a neighbor."""
+        pa = pos[a]
+        for succ in (True, False):
+            if succ and pa >= n - 1 or not succ and pa == 0:
+                continue
+            b = route[pa + 1] if succ else route[pa - 1]
+            d_ab = d[a][b]
+            for c in neighbors[a]:
+                d_ac = d[a][c]
+                # Neighbors are sorted, so no later candidate can give a gain either
+                if d_ac >= d_ab:
+                    break
+                pc = pos[c]
+                if succ:
+                    # Replace (a, b) and (c, e) by (a, c) and (b, e)
+                    if pc >= n - 1:
+                        continue
+                    e = route[pc + 1]
+                    i, j = (pa, pc) if pa < pc else (pc, pa)
+                else:
+                    # Replace (b, a) and (e, c) by (b, e) and (c, a)
+                    if pc == 0:
+                        continue
+                    e = route[pc - 1]
+                    i, j = (pa - 1, pc - 1) if pa < pc else (pc - 1, pa - 1)
+                delta = d_ac + d[b][e] - d_ab - d[c][e]
+                if delta < -EPSILON:
+                    reverse(i + 1, j)
+                    return (a, b, c, e)
+        return None
+
+    def try_or_opt(a):
+        """Try to move a segment starting or ending at a next to one of its neighbors."""
+        pa = pos[a]
+        for length in range(1, max_segment_length + 1):
+            for first in (pa, pa - length + 1):
+                last = first + length - 1
+                # The segment may never contain the fixed start or end point
+                if first < 1 or last > n - 2:
+                    continue
+                p, nx = route[first - 1], route[last + 1]
+                s0, s1 = route[first], route[last]
+                removal_gain = d[p][s0] + d[s1][nx] - d[p][nx]
+                if removal_gain <= EPSILON:
+                    continue
+
+                for end in (s0, s1) if length > 1 else (s0,):
+                    for c in neighbors[end]:
+                        d_c_end = d[c][end]
+                        if d_c_end >= removal_gain:
+                            break
+                        pc = pos[c]
+                        if first <= pc <= last:
+                            continue
+                        # Insert the segment on either side of c, with end adjacent to c
+                        for u, v in ((pc, pc + 1), (pc - 1, pc)):
+                            if u < 0 or v > n - 1 or first <= u <= last or first <= v <= last:
+                                continue
+                            nu, nv = route[u], route[v]
+                            # Orientation so that end lies next to c
+                            if (nu == c) == (end == s0):
+                                x, y, reversed_segment = s0, s1, False
+                            else:
+                                x, y, reversed_segment = s1, s0, True
+                            insertion_cost = d[nu][x] + d[y][nv] - d[nu][nv]
+                            if insertion_cost - removal_gain < -EPSILON:
+                                move_segment(first, last, v, reversed_segment)
+                                return (p, nx, s0, s1, nu, nv)
+        return None
+
+    def move_segment(first, last, before, reversed_segment):
+        """Move route[first..last] so that it ends up just before position `before`."""
+        segment = route[first : last + 1]
+        if reversed_segment:
+            segment.reverse()
+        del route[first : last + 1]
+        if before > last:
+            before -= len(segment)
+        route[before:before] = segment
+        lo, hi = min(first, before), max(last, before + len(segment) - 1)
+        for index in range(lo, hi + 1):
+            pos[route[index]] = index
+
+    # Don't-look bits: only points in the queue are used to search for moves
+    active = deque(route if active is None else active)
+    in_queue = [False] * len(d)
+    for node in active:
+        in_queue[node] = True
+
+    # Counted in local variables and recorded once, metrics stay out of the hot loop
+    processed = two_opt_moves = or_opt_moves = 0
+    converged = True
+    while active:
+        processed += 1
+        if deadline is not None and processed % DEADLINE_CHECK_INTERVAL == 0 and time.time() >= deadline:
+            converged = False
+            break
+        a = active.popleft()
+        in_queue[a] = False
+        touched = try_two_opt(a)
+        if touched:
+            two_opt_moves += 1
+        else:
+            touched = try_or_opt(a)
+            if touched:
+                or_opt_moves += 1
+        if touched:
+            for node in touched:
+                if not in_queue[node]:
+                    in_queue[node] = True
+                    active.append(node)
+
+    LOCAL_SEARCH_ITERATIONS.inc(processed)
+    LOCAL_SEARCH_MOVES.inc(two_opt_moves, move="2opt")
+    LOCAL_SEARCH_MOVES.inc(or_opt_moves, move="or_opt")
+    return route, converged
+
+
+def double_bridge(path, rng) -> list[int]:
+    """
+    Perturb a path with a random double-bridge move, used to restart the local search.
+
+    The inner part A B C of the path becomes A C B, a change that 2-opt and Or-opt
+    can not undo in a single move. The start and end stay in place.
+    """
+    route = list(path)
+    if len(route) < 5:
+        return route
+    i, j, k = sorted(rng.choice(np.arange(1, len(route) - 1), size=3, replace=False).tolist())
+    return route[:i] + route[j:k] + route[i:j] + route[k:]
@@ -0,0 +1,220 @@
+"""Counters, latency histograms and per-request traces, exported in the Prometheus text format."""
+
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+# Add a Server-Timing header with the stage timings to every response, not only
+# to requests that ask for it with the X-Pictoroute-Trace header
+TRACE_ALL_REQUESTS = os.getenv("TRACE_ALL_REQUESTS", "false").lower() == "true"
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Counter:
+    """A monotonically increasing value per combination of label values."""
+
+    type = "counter"
+
+    def __init__(self, name: str, description: str, labels: tuple = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = tuple(str(labels[label]) for label in self.labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            for key, value in self.values.items():
+                yield self.name, dict(zip(self.labels, key)), value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {key: value for key, value in self.values.items()}
+
+    def merge(self, values: dict):
+        with self._lock:
+            for key, value in values.items():
+                self.values[key] = self.values.get(key, 0) + value
+
+
+class Histogram(Counter):
+    """Observations counted in cumulative buckets, with their sum and count."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, description: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = tuple(str(labels[label]) for label in self.labels)
+        with self._lock:
+            # [count per bucket..., +Inf count, sum]
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[index] += 1
+            state[-2] += 1
+            state[-1] += value
+
+    def samples(self):
+        with self._lock:
+            for key, state in self.values.items():
+                labels = dict(zip(self.labels, key))
+                for bound, count in zip(self.buckets, state):
+                    yield f"{self.name}_bucket", {**labels, "le": str(bound)}, count
+                yield f"{self.name}_bucket", {**labels, "le": "+Inf"}, state[-2]
+                yield f"{self.name}_sum", labels, state[-1]
+                yield f"{self.name}_count", labels, state[-2]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {key: list(state) for key, state in self.values.items()}
+
+    def merge(self, values: dict):
+        with self._lock:
+            for key, state in values.items():
+                current = self.values.setdefault(key, [0] * len(state))
+                for index, value in enumerate(state):
+                    current[index] += value
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, Counter] = {}
+
+    def counter(self, name: str, description: str, labels: tuple = ()) -> Counter:
+        return self.metrics.setdefault(name, Counter(name, description, labels))
+
+    def histogram(self, name: str, description: str, labels: tuple = ()) -> Histogram:
+        return self.metrics.setdefault(name, Histogram(name, description, labels))
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                label_text = ",".join(
+                    f'{label}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                    for label, v in labels.items()
+                )
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def delta(self, before: dict) -> dict:
+        """What was recorded since the snapshot `before`, used to send worker process metrics back."""
+        delta = {}
+        for name, values in self.snapshot().items():
+            old = before.get(name, {})
+            changed = {}
+            for key, value in values.items():
+                if isinstance(value, list):
+                    previous = old.get(key, [0] * len(value))
+                    difference = [a - b for a, b in zip(value, previous)]
+                    if any(difference):
+                        changed[key] = difference
+                elif value != old.get(key, 0):
+                    changed[key] = value - old.get(key, 0)
+            if changed:
+                delta[name] = changed
+        return delta
+
+    def merge(self, delta: dict):
+        for name, values in delta.items():
+            if name in self.metrics:
+                self.metrics[name].merge(values)
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.histogram(
+    "pictoroute_stage_seconds", "Duration of the processing stages", ("stage",)
+)
+REQUEST_SECONDS = registry.histogram(
+    "pictoroute_request_seconds", "Duration of the HTTP requests", ("method", "path", "status")
+)
+LLM_TOKENS = registry.counter(
+    "pictoroute_llm_tokens_total", "Tokens used by the vision model", ("model", "type")
+)
+GEOCODE_CACHE_LOOKUPS = registry.counter(
+    "pictoroute_geocode_cache_lookups_total", "Geocode cache lookups", ("result",)
+)
+EXTRACTION_CACHE_LOOKUPS = registry.counter(
+    "pictoroute_extraction_cache_lookups_total", "Extraction cache lookups", ("result",)
+)
+EXTRACTION_ADMISSIONS = registry.counter(
+    "pictoroute_extraction_admissions_total", "Extraction jobs admitted, rejected or timed out in the queue", ("result",)
+)
+GEOCODE_ATTEMPTS = registry.counter(
+    "pictoroute_geocode_attempts_total",
+    "Geocoding queries, attempt 2 and up are fallbacks",
+    ("attempt", "result"),
+)
+LOCAL_SEARCH_MOVES = registry.counter(
+    "pictoroute_local_search_moves_total", "Improving moves made by the route local search", ("move",)
+)
+LOCAL_SEARCH_ITERATIONS = registry.counter(
+    "pictoroute_local_search_iterations_total", "Points examined by the route local search"
+)
+
+# Stage timings of the current request, None when the request is not traced
+_trace: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("pictoroute_trace", default=None)
+
+
+@contextmanager
+def span(stage: str):
+    """Time a stage, recorded in the stage histogram and in the trace of the current request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        STAGE_SECONDS.observe(duration, stage=stage)
+        trace = _trace.get()
+        if trace is not None:
+            trace.append((stage, duration))
+
+
+def start_trace(enabled: bool = True) -> Optional[list]:
+    """Start collecting the stage timings of the current request (or worker task), None when not enabled."""
+    trace = [] if enabled else None
+    _trace.set(trace)
+    return trace
+
+
+def add_to_trace(spans: list):
+    """Add stage timings recorded elsewhere (in a worker process) to the current trace."""
+    trace = _trace.get()
+    if trace is not None:
+        trace.extend(spans)
+
+
+def server_timing_header(trace: list) -> str:
+    """Format a trace as a Server-Timing header value, durations in milliseconds."""
+    return ", ".join(f"{stage};dur={duration * 1000:.1f}" for stage, duration in trace)
@@ -0,0 +1,160 @@
+"""Offline geocoder for Dutch addresses using a local postcode + house number index."""
+
+import csv
+import os
+import re
+import sys
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+from pictoroute.models.address import Address, Coordinates
+
+load_dotenv()
+
+# Directory with the index files created by `build_index`, the geocoder is disabled when empty
+OFFLINE_GEOCODER_PATH = os.getenv("OFFLINE_GEOCODER_PATH", "")
+
+KEYS_FILE = "keys.npy"
+COORDINATES_FILE = "coordinates.npy"
+
+POSTAL_CODE_PATTERN = re.compile(r"^(\d{4})([A-Z]{2})")
+HOUSE_NUMBER_PATTERN = re.compile(r"^\s*(\d+)\s*[-\s]?\s*([a-zA-Z])?")
+
+MAX_HOUSE_NUMBER = 100_000
+
+
+def address_key(postal_code: str, house_number: str) -> Optional[int]:
+    """
+    Encode a postal code and house number as a single sortable integer.
+
+    "3812EA" and "65b" become ((3812 * 676 + EA) * MAX_HOUSE_NUMBER + 65) * 32 + 2.
+    Returns None when the postal code or house number can not be parsed.
+    """
+    postal_code = re.sub(r"\s+", "", postal_code or "").upper()
+    postal_match = POSTAL_CODE_PATTERN.match(postal_code)
+    house_match = HOUSE_NUMBER_PATTERN.match(house_number or "")
+    if not postal_match or not house_match:
+        return None
+
+    digits, letters = postal_match.groups()
+    postal_number = int(digits) * 676 + (ord(letters[0]) - 65) * 26 + (ord(letters[1]) - 65)
+    number = int(house_match.group(1))
+    if number >= MAX_HOUSE_NUMBER:
+        return None
+    letter = house_match.group(2)
+    letter_number = ord(letter.lower()) - 96 if letter else 0
+    return (postal_number * MAX_HOUSE_NUMBER + number) * 32 + letter_number
+
+
+class OfflineGeocoder:
+    """
+    Looks up coordinates in a sorted, memory-mapped array of address keys.
+
+    The index consists of a sorted int64 key array and a float32 (latitude,
+    longitude) array. Both are memory-mapped, so loading is instant and the
+    operating system shares the pages between worker processes.
+    """
+
+    def __init__(self, index_path: str):
+        index_path = Path(index_path)
+        self.keys = np.load(index_path / KEYS_FILE, mmap_mode="r")
+        self.coordinates = np.load(index_path / COORDINATES_FILE, mmap_mode="r")
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _find(self, key: int) -> Optional[int]:
+        index = int(np.searchsorted(self.keys, key))
+        if index < len(self.keys) and self.keys[index] == key:
+            return index
+        return None
+
+    def lookup(self, address: Address) -> Optional[Coordinates]:
+        """Return the coordinates of an address, or None when it is not in the index."""
+        key = address_key(address.postal_code, address.house_number)
+        if key is None:
+            return None
+
+        index = self._find(key)
+        # Fall back to the house number without its letter ("12b" -> "12")
+        if index is None and key % 32:
+            index = self._find(key - key % 32)
+        if index is None:
+            return None
+
+        latitude, longitude = self.coordinates[index]
+        return Coordinates(latitude=float(latitude), longitude=float(longitude))
+
+
+def build_index(
+    csv_path: str,
+    index_path: str,
+    postal_code_column: str = "postcode",
+    house_number_column: str = "huisnummer",
+    house_letter_column: str = "huisletter",
+    latitude_column: str = "lat",
+    longitude_column: str = "lon",
+) -> int:
+    """
+    Build the offline index from a CSV file, for example an extract of the BAG.
+
+    Rows that can not be parsed are skipped, for duplicate keys the first row wins.
+
+    Returns:
+        int: The number of addresses in the index.
+    """
+    keys, latitudes, longitudes = [], [], []
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            house_number = row[house_number_column] + (row.get(house_letter_column) or "")
+            key = address_key(row[postal_code_column], house_number)
+            if key is None:
+                continue
+            try:
+                latitude, longitude = float(row[latitude_column]), float(row[longitude_column])
+            except ValueError:
+                continue
+            keys.append(key)
+            latitudes.append(latitude)
+            longitudes.append(longitude)
+
+    keys = np.asarray(keys, dtype=np.int64)
+    coordinates = np.column_stack([latitudes, longitudes]).astype(np.float32).reshape(-1, 2)
+
+    # Sort on key (stable, so the first duplicate wins) and drop duplicates
+    order = np.argsort(keys, kind="stable")
+    keys, coordinates = keys[order], coordinates[order]
+    unique = np.ones(len(keys), dtype=bool)
+    unique[1:] = keys[1:] != keys[:-1]
+    keys, coordinates = keys[unique], coordinates[unique]
+
+    index_path = Path(index_path)
+    index_path.mkdir(parents=True, exist_ok=True)
+    np.save(index_path / KEYS_FILE, keys)
+    np.save(index_path / COORDINATES_FILE, np.ascontiguousarray(coordinates))
+    return len(keys)
+
+
+_offline_geocoder: Optional[OfflineGeocoder] = None
+_offline_geocoder_loaded = False
+
+
+def get_offline_geocoder() -> Optional[OfflineGeocoder]:
+    """Return the offline geocoder of this process, None when no index is configured."""
+    global _offline_geocoder, _offline_geocoder_loaded
+    if not _offline_geocoder_loaded:
+        _offline_geocoder_loaded = True
+        if OFFLINE_GEOCODER_PATH and (Path(OFFLINE_GEOCODER_PATH) / KEYS_FILE).exists():
+            _offline_geocoder = OfflineGeocoder(OFFLINE_GEOCODER_PATH)
+        elif OFFLINE_GEOCODER_PATH:
+            print(f"No offline geocoder index found at {OFFLINE_GEOCODER_PATH}")
+    return _offline_geocoder
+
+
+if __name__ == "__main__":
+    # Usage: python -m pictoroute.core.offline_geocoder bag_addresses.csv data/offline_geocoder
+    count = build_index(sys.argv[1], sys.argv[2])
+    print(f"Indexed {count} addresses in {sys.argv[2]}")
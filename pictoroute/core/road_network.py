@@ -0,0 +1,262 @@
+"""Bicycle road network from a local OpenStreetMap extract, for travel distance/time matrices."""
+
+import os
+import sys
+from typing import Optional
+
+import numpy as np
+from dotenv import load_dotenv
+from scipy.sparse import csr_matrix
+from scipy.spatial import cKDTree
+from scipy.sparse.csgraph import dijkstra
+
+load_dotenv()
+
+# Graph file created by `build_graph`, road distances are disabled when empty
+ROAD_NETWORK_PATH = os.getenv("ROAD_NETWORK_PATH", "")
+
+# Cycling speed in km/h per highway type, ways of other types are not rideable
+CYCLING_SPEEDS = {
+    "cycleway": 18.0,
+    "primary": 16.0,
+    "secondary": 16.0,
+    "tertiary": 16.0,
+    "unclassified": 16.0,
+    "residential": 16.0,
+    "living_street": 10.0,
+    "service": 12.0,
+    "track": 12.0,
+    "path": 12.0,
+    "footway": 8.0,
+    "pedestrian": 8.0,
+    "bridleway": 8.0,
+    "primary_link": 16.0,
+    "secondary_link": 16.0,
+    "tertiary_link": 16.0,
+}
+
+# Used between stops that are not connected in the graph (haversine times this factor)
+DETOUR_FACTOR = 1.3
+
+# Number of sources per Dijkstra batch, bounds the memory of the full distance rows
+DIJKSTRA_BATCH_SIZE = 32
+
+
+def _segment_lengths(lat1, lon1, lat2, lon2):
+    """Haversine length in km of road segments, vectorized."""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371.0 * np.arcsin(np.sqrt(a))
+
+
+class RoadNetwork:
+    """
+    Directed bicycle graph with edge lengths (km) and travel times (s).
+
+    Stops are snapped to the nearest graph node with a k-d tree and many-to-many
+    matrices are computed with multi-source Dijkstra on a sparse adjacency matrix.
+    The network is built once and pickled to the solver workers, see `set_road_network`.
+    """
+
+    def __init__(self, latitudes, longitudes, sources, targets, lengths, times):
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        n = len(self.latitudes)
+        # Parallel edges are summed by csr_matrix, keep only the shortest one instead
+        order = np.lexsort((lengths, targets, sources))
+        sources, targets = np.asarray(sources)[order], np.asarray(targets)[order]
+        keep = np.ones(len(sources), dtype=bool)
+        keep[1:] = (sources[1:] != sources[:-1]) | (targets[1:] != targets[:-1])
+        # Zero weights would be dropped from the sparse matrix, so keep them just above zero
+        self.graphs = {
+            weight: csr_matrix(
+                (
+                    np.maximum(np.asarray(values, dtype=np.float64)[order][keep], 1e-9),
+                    (sources[keep], targets[keep]),
+                ),
+                shape=(n, n),
+            )
+            for weight, values in (("length", lengths), ("time", times))
+        }
+        # Equirectangular projection is accurate enough to find the nearest node in a city
+        self.scale = np.cos(np.radians(self.latitudes.mean())) if n else 1.0
+        self.tree = cKDTree(np.column_stack((self.latitudes, self.longitudes * self.scale)))
+
+    @classmethod
+    def load(cls, graph_path: str) -> "RoadNetwork":
+        """Load a graph file created by `build_graph`."""
+        with np.load(graph_path) as data:
+            return cls(
+                data["latitudes"],
+                data["longitudes"],
+                data["sources"],
+                data["targets"],
+                data["lengths"],
+                data["times"],
+            )
+
+    def snap(self, coordinates) -> np.ndarray:
+        """Return the index of the nearest graph node for every (lat, lon) pair."""
+        coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+        _, nodes = self.tree.query(np.column_stack((coordinates[:, 0], coordinates[:, 1] * self.scale)))
+        return np.asarray(nodes, dtype=np.int64)
+
+    def matrix(self, coordinates, weight: str = "length") -> np.ndarray:
+        """
+        Compute the travel matrix between all coordinates.
+
+        Args:
+            coordinates: (lat, lon) pairs.
+            weight (str): "length" for distances in km, "time" for travel times in seconds.
+
+        Returns:
+            np.ndarray: n x n matrix, not necessarily symmetric because of one-way streets.
+        """
+        coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+        nodes = self.snap(coordinates)
+        unique_nodes, inverse = np.unique(nodes, return_inverse=True)
+
+        result = np.empty((len(unique_nodes), len(unique_nodes)), dtype=np.float64)
+        for start in range(0, len(unique_nodes), DIJKSTRA_BATCH_SIZE):
+            batch = unique_nodes[start : start + DIJKSTRA_BATCH_SIZE]
+            rows = dijkstra(self.graphs[weight], directed=True, indices=batch)
+            result[start : start + len(batch)] = rows[:, unique_nodes]
+        result = result[inverse][:, inverse]
+
+        _fill_unreachable(result, coordinates, coordinates, weight)
+        np.fill_diagonal(result, 0.0)
+        return result
+
+    def rows(self, origins, destinations, weight: str = "length", reverse: bool = False) -> np.ndarray:
+        """
+        Compute the travel matrix from a few origins to many destinations.
+
+        Args:
+            origins: (lat, lon) pairs, one Dijkstra search is run per origin.
+            destinations: (lat, lon) pairs.
+            weight (str): "length" for distances in km, "time" for travel times in seconds.
+            reverse (bool): Return the travel from every destination to the origins instead.
+
+        Returns:
+            np.ndarray: len(origins) x len(destinations) matrix.
+        """
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 2)
+        destinations = np.asarray(destinations, dtype=np.float64).reshape(-1, 2)
+        graph = self.graphs[weight].T.tocsr() if reverse else self.graphs[weight]
+        result = dijkstra(graph, directed=True, indices=self.snap(origins))[:, self.snap(destinations)]
+        _fill_unreachable(result, origins, destinations, weight)
+        return result
+
+
+def _fill_unreachable(result, origins, destinations, weight):
+    """Stops in disconnected parts of the graph fall back to a straight line with detour."""
+    unreachable = ~np.isfinite(result)
+    if unreachable.any():
+        straight = _segment_lengths(
+            origins[:, None, 0], origins[:, None, 1],
+            destinations[None, :, 0], destinations[None, :, 1],
+        ) * DETOUR_FACTOR
+        if weight == "time":
+            straight = straight / CYCLING_SPEEDS["residential"] * 3600
+        result[unreachable] = straight[unreachable]
+
+
+def build_graph(pbf_path: str, graph_path: str) -> int:
+    """
+    Build the bicycle graph file from an .osm.pbf extract.
+
+    Needs the optional `osmium` package (pip install osmium).
+
+    Returns:
+        int: The number of nodes in the graph.
+    """
+    import osmium
+
+    node_ids: dict[int, int] = {}
+    latitudes, longitudes = [], []
+    sources, targets, speeds = [], [], []
+
+    def node_index(node) -> int:
+        index = node_ids.get(node.ref)
+        if index is None:
+            index = node_ids[node.ref] = len(latitudes)
+            latitudes.append(node.lat)
+            longitudes.append(node.lon)
+        return index
+
+    class WayHandler(osmium.SimpleHandler):
+        def way(self, way):
+            tags = way.tags
+            speed = CYCLING_SPEEDS.get(tags.get("highway"))
+            if speed is None or tags.get("bicycle") == "no" or tags.get("area") == "yes":
+                return
+            if tags.get("highway") in ("footway", "pedestrian") and tags.get("bicycle") not in ("yes", "designated"):
+                return
+
+            oneway = tags.get("oneway", "no")
+            if tags.get("oneway:bicycle") == "no" or tags.get("cycleway") == "opposite":
+                oneway = "no"
+
+            refs = [node_index(node) for node in way.nodes if node.location.valid()]
+            for a, b in zip(refs[:-1], refs[1:]):
+                if oneway != "-1":
+                    sources.append(a)
+                    targets.append(b)
+                    speeds.append(speed)
+                if oneway not in ("yes", "true", "1"):
+                    sources.append(b)
+                    targets.append(a)
+                    speeds.append(speed)
+
+    WayHandler().apply_file(pbf_path, locations=True)
+
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    sources = np.asarray(sources, dtype=np.int64)
+    targets = np.asarray(targets, dtype=np.int64)
+    lengths = _segment_lengths(
+        latitudes[sources], longitudes[sources], latitudes[targets], longitudes[targets]
+    )
+    times = lengths / np.asarray(speeds, dtype=np.float64) * 3600
+
+    np.savez(
+        graph_path,
+        latitudes=latitudes,
+        longitudes=longitudes,
+        sources=sources,
+        targets=targets,
+        lengths=lengths,
+        times=times,
+    )
+    return len(latitudes)
+
+
+_road_network: Optional[RoadNetwork] = None
+_road_network_loaded = False
+
+
+def get_road_network() -> Optional[RoadNetwork]:
+    """Return the road network of this process, None when no graph file is configured."""
+    global _road_network, _road_network_loaded
+    if not _road_network_loaded:
+        _road_network_loaded = True
+        if ROAD_NETWORK_PATH and os.path.exists(ROAD_NETWORK_PATH):
+            _road_network = RoadNetwork.load(ROAD_NETWORK_PATH)
+        elif ROAD_NETWORK_PATH:
+            print(f"No road network found at {ROAD_NETWORK_PATH}, road metrics use haversine distances")
+        else:
+            print("No road network configured (ROAD_NETWORK_PATH), road metrics use haversine distances")
+    return _road_network
+
+
+def set_road_network(road_network: Optional[RoadNetwork]):
+    """Use a road network built by another process, the initializer of the solver workers."""
+    global _road_network, _road_network_loaded
+    _road_network = road_network
+    _road_network_loaded = True
+
+
+if __name__ == "__main__":
+    # Usage: python -m pictoroute.core.road_network amersfoort.osm.pbf data/amersfoort_bicycle.npz
+    count = build_graph(sys.argv[1], sys.argv[2])
+    print(f"Built a bicycle graph with {count} nodes in {sys.argv[2]}")
@@ -1,8 +1,21 @@
  
-from math import radians, sin, cos, sqrt, atan2
+import os
+import time
+
+import numpy as np
 from xml.dom import minidom
 from urllib.parse import quote_plus
 from pictoroute.core.get_coordinates import load_addresses_from_file_with_json_string
+from pictoroute.core.held_karp import (
+    HELD_KARP_MAX_BYTES,
+    estimate_held_karp_seconds,
+    held_karp_fixed_endpoints,
+    held_karp_memory_bytes,
+)
+from pictoroute.core.local_search import DEFAULT_NEIGHBORS, double_bridge, local_search_with_deadline
+from pictoroute.core.metrics import LOCAL_SEARCH_MOVES, span
+from pictoroute.core.road_network import get_road_network
+from pictoroute.core.spatial_index import LazyDistances, SpatialIndex
 from pictoroute.models.address import Address, Coordinates
 from pictoroute.models.shortest_path import ShortestPath
 
@@ -22,24 +35,116 @@ END_ADDRESS = Address(
     coordinates=Coordinates(latitude=52.1588444, longitude=5.3820278),
 )
 
+# Cost optimized by the planner: "haversine" (straight line), "road_distance" or "road_time"
+# (the road metrics need a bicycle graph, see pictoroute.core.road_network)
+ROUTE_METRIC = os.getenv("ROUTE_METRIC", "haversine")
+ROUTE_METRICS = ("haversine", "road_distance", "road_time")
+
+# The "auto" solver solves exactly up to this many stops (excluding start and end),
+# as long as the estimated solve time stays within the time budget (in seconds)
+EXACT_SOLVER_MAX_STOPS = int(os.getenv("EXACT_SOLVER_MAX_STOPS", "15"))
+EXACT_SOLVER_TIME_BUDGET = float(os.getenv("EXACT_SOLVER_TIME_BUDGET", "1.0"))
+SOLVERS = ("auto", "exact", "heuristic")
+
+# From this many points on, haversine routes are planned with a spatial index and
+# distances computed on demand instead of a full n x n distance matrix
+SPATIAL_INDEX_MIN_POINTS = int(os.getenv("SPATIAL_INDEX_MIN_POINTS", "500"))
+
 # Function to calculate Haversine distance between two points
+# coord1 and coord2 can be single (lat, lon) pairs or arrays of shape (..., 2)
 def haversine(coord1, coord2):
     R = 6371.0  # Radius of the Earth in kilometers
-    lat1, lon1 = coord1
-    lat2, lon2 = coord2
-
-    lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
+    coord1 = np.asarray(coord1, dtype=np.float64)
+    coord2 = np.asarray(coord2, dtype=np.float64)
+    lat1, lon1 = np.radians(coord1[..., 0]), np.radians(coord1[..., 1])
+    lat2, lon2 = np.radians(coord2[..., 0]), np.radians(coord2[..., 1])
 
     dlat = lat2 - lat1
     dlon = lon2 - lon1
-    a = sin(dlat / 2)**2 + cos(lat1) * cos(lat2) * sin(dlon / 2)**2
-    c = 2 * atan2(sqrt(a), sqrt(1 - a))
+    a = np.sin(dlat / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2)**2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
     distance = R * c
-    
+
+    # Keep returning a plain float for a single pair of coordinates
+    if np.ndim(distance) == 0:
+        return float(distance)
     return distance
 
-def nearest_neighbor_with_end(coordinates, start_index=0, end_index=None):
-    n = len(coordinates)
+# Function to build the full n x n haversine distance matrix in one vectorized pass
+def distance_matrix(coordinates, dtype=np.float64):
+    """Compute the pairwise distance matrix (in km) for a list of (lat, lon) tuples."""
+    coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+    # Broadcast (n, 1, 2) against (1, n, 2) to get all pairs at once
+    distances = haversine(coordinates[:, None, :], coordinates[None, :, :])
+    return np.asarray(distances, dtype=dtype)
+
+# Function to get the matrix to optimize and the matrix of distances in km
+def travel_matrices(coordinates, metric=ROUTE_METRIC, dtype=np.float64):
+    """Return (costs, distances) for the coordinates, costs are what the solver minimizes."""
+    road_network = get_road_network() if metric != "haversine" else None
+    if road_network is None:
+        distances = distance_matrix(coordinates, dtype=dtype)
+        return distances, distances
+
+    distances = road_network.matrix(coordinates, "length").astype(dtype)
+    costs = distances if metric == "road_distance" else road_network.matrix(coordinates, "time").astype(dtype)
+    # One-way streets make the matrix asymmetric, the solvers assume a symmetric cost
+    # (reversing a segment keeps its length), so they optimize the mean of both directions
+    costs = (costs + costs.T) / 2
+    return costs, distances
+
+# Function to compute the matrix rows of a few new stops, for routes that change one stop at a time
+def travel_rows(new_coordinates, coordinates, metric=ROUTE_METRIC):
+    """
+    Return the travel between new stops and existing stops, each of shape (new, existing).
+
+    Returns:
+        tuple: (costs, distances from the new stops, distances to the new stops), with
+            the costs symmetrized in the same way as `travel_matrices`.
+    """
+    road_network = get_road_network() if metric != "haversine" else None
+    if road_network is None:
+        distances = np.asarray(haversine(
+            np.asarray(new_coordinates, dtype=np.float64).reshape(-1, 1, 2),
+            np.asarray(coordinates, dtype=np.float64).reshape(1, -1, 2),
+        )).reshape(len(new_coordinates), len(coordinates))
+        return distances, distances, distances
+
+    weight = "length" if metric == "road_distance" else "time"
+    distances_from = road_network.rows(new_coordinates, coordinates, "length")
+    distances_to = road_network.rows(new_coordinates, coordinates, "length", reverse=True)
+    if weight == "length":
+        costs = (distances_from + distances_to) / 2
+    else:
+        costs = (road_network.rows(new_coordinates, coordinates, "time")
+                 + road_network.rows(new_coordinates, coordinates, "time", reverse=True)) / 2
+    return costs, distances_from, distances_to
+
+# Function to compute the matrices of several routes at once, for routes that share stops
+def shared_travel_matrices(coordinate_lists, metric=ROUTE_METRIC, dtype=np.float64):
+    """
+    Return (costs, distances) for every list of coordinates, computed for the distinct coordinates only.
+
+    Every distinct stop is snapped and searched from once, so depots and stops that
+    appear in several routes are not routed again. For haversine distances the
+    matrices are computed per route, which is cheaper than one matrix over all stops.
+    """
+    if metric == "haversine" or get_road_network() is None:
+        return [travel_matrices(coordinates, metric, dtype) for coordinates in coordinate_lists]
+
+    sizes = [len(coordinates) for coordinates in coordinate_lists]
+    stacked = np.asarray([pair for coordinates in coordinate_lists for pair in coordinates], dtype=np.float64)
+    unique, inverse = np.unique(stacked, axis=0, return_inverse=True)
+    costs, distances = travel_matrices(unique, metric, dtype)
+
+    matrices = []
+    for indices in np.split(inverse.reshape(-1), np.cumsum(sizes)[:-1]):
+        rows = np.ix_(indices, indices)
+        matrices.append((costs[rows], distances[rows]))
+    return matrices
+
+def nearest_neighbor_with_end(distances, start_index=0, end_index=None):
+    n = len(distances)
     
     if end_index is None:
         end_index = n - 1  # Default: the last point if not provided
@@ -48,34 +153,30 @@ def nearest_neighbor_with_end(coordinates, start_index=0, end_index=None):
     if start_index == end_index:
         raise ValueError("Start and end points cannot be the same.")
     
-    unvisited = set(range(n))
+    # Visited points (and the end point, which we don't visit until last) get an
+    # infinite distance, so a single argmin per step finds the nearest unvisited point
+    distances = np.asarray(distances)
+    visited = np.zeros(n, dtype=bool)
+    visited[[start_index, end_index]] = True
     path = [start_index]  # Start at the given starting point
-    unvisited.remove(start_index)
-    
-    # If the end point is specified, we don't visit it until last
-    if end_index in unvisited:
-        unvisited.remove(end_index)
 
-    while unvisited:
+    for _ in range(n - 2):
         last_visited = path[-1]
         # Find the nearest unvisited point
-        next_point = min(unvisited, key=lambda i: haversine(coordinates[last_visited], coordinates[i]))
+        next_point = int(np.argmin(np.where(visited, np.inf, distances[last_visited])))
         path.append(next_point)
-        unvisited.remove(next_point)
+        visited[next_point] = True
 
     # Now append the end point to the path
     path.append(end_index)
 
     return path
 
-# Function to compute the total distance of a path
-def total_distance(path, coordinates):
-    dist = 0
-    for i in range(len(path) - 1):
-        dist += haversine(coordinates[path[i]], coordinates[path[i + 1]])
-    # Return to the start
-    dist += haversine(coordinates[path[-1]], coordinates[path[0]])
-    return dist
+# Function to compute the total distance of a path from its first to its last point
+# (no return leg, the start and end depots are both part of the path and may differ)
+def total_distance(path, distances):
+    path = np.asarray(path)
+    return float(distances[path[:-1], path[1:]].sum(dtype=np.float64))
 
 def create_gmaps_links(path: list[int], addresses: list[Address], n_addresses_per_chunk: int = 10):
     # create chunks of n_addresses_per_chunk addresses
@@ -105,10 +206,10 @@ def two_opt_swap(route, i, k):
     return new_route
 
 # 2-opt optimization function with fixed start and end points
-def two_opt_fixed_endpoints(coordinates, path):
+def two_opt_fixed_endpoints(distances, path):
     """Apply 2-opt algorithm to the given path with fixed start and end."""
     best_path = path
-    best_distance = total_distance(best_path, coordinates)
+    best_distance = total_distance(best_path, distances)
     improved = True
     
     # Loop until no improvements can be made
@@ -119,33 +220,164 @@ def two_opt_fixed_endpoints(coordinates, path):
         for i in range(1, len(path) - 2):  # Avoid swapping the start point
             for k in range(i + 1, len(path) - 1):  # Avoid swapping the end point
                 new_path = two_opt_swap(best_path, i, k)
-                new_distance = total_distance(new_path, coordinates)
+                new_distance = total_distance(new_path, distances)
                 if new_distance < best_distance:
+                    LOCAL_SEARCH_MOVES.inc(move="2opt")
                     best_path = new_path
                     best_distance = new_distance
                     improved = True
     
     return best_path
 
-def create_path(addresses: list[Address], start_index=0, end_index=None) -> ShortestPath:
-    # Add the start and end addresses to the list of addresses
-    addresses = [START_ADDRESS] + addresses + [END_ADDRESS]
+# The plain 2-opt can not be stopped early, it always runs until converged
+def two_opt_with_deadline(distances, path, deadline=None):
+    return two_opt_fixed_endpoints(distances, path), True
+
+# Available strategies to improve the nearest neighbor path, selectable in create_path
+# (called with the deadline, they return the path and whether it converged)
+IMPROVEMENT_STRATEGIES = {
+    "local_search": local_search_with_deadline,
+    "two_opt": two_opt_with_deadline,
+}
+
+# Decide whether the exact solver fits within the stop limit, memory and time budget
+def use_exact_solver(n, time_budget=EXACT_SOLVER_TIME_BUDGET):
+    return (
+        n - 2 <= EXACT_SOLVER_MAX_STOPS
+        and held_karp_memory_bytes(n) <= HELD_KARP_MAX_BYTES
+        and estimate_held_karp_seconds(n) <= time_budget
+    )
+
+def solve_path(costs, start_index=0, end_index=None, improvement="local_search", solver="auto", deadline=None, seed=None):
+    """
+    Find a short path through all points of a cost matrix with a fixed start and end.
+
+    Args:
+        costs: n x n (symmetric) cost matrix.
+        improvement (str): Strategy to improve the nearest neighbor path, see IMPROVEMENT_STRATEGIES.
+        solver (str): "exact", "heuristic" or "auto" (exact for few points, see `use_exact_solver`).
+        deadline (float): Wall clock time (time.time()) at which the improvement stops
+            and the best path found so far is returned, None runs until converged.
+        seed (int): When set, the improvement restarts from a randomly perturbed
+            nearest neighbor path, different seeds give different local optima.
+
+    Returns:
+        tuple[list[int], bool]: The path and whether the solver converged before the deadline.
+    """
+    if improvement not in IMPROVEMENT_STRATEGIES:
+        raise ValueError(f"Unknown improvement strategy: {improvement}")
+    if solver not in SOLVERS:
+        raise ValueError(f"Unknown solver: {solver}")
+
+    # The exact solver can not be interrupted, so it also has to fit before the deadline
+    time_budget = EXACT_SOLVER_TIME_BUDGET
+    if deadline is not None:
+        time_budget = min(time_budget, deadline - time.time())
+
+    if solver == "exact" or solver == "auto" and use_exact_solver(len(costs), time_budget):
+        # Few stops: find the optimal path with Held-Karp
+        with span("exact_solver"):
+            return held_karp_fixed_endpoints(costs, start_index, end_index), True
 
-    # Get the coordinates from the addresses
-    coordinates = [(address.coordinates.latitude, address.coordinates.longitude) for address in addresses]
-    
     # Get the nearest neighbor path with the fixed start and end points
-    path = nearest_neighbor_with_end(coordinates, start_index, end_index)
+    with span("nearest_neighbor"):
+        path = nearest_neighbor_with_end(costs, start_index, end_index)
+    if seed is not None:
+        path = double_bridge(path, np.random.default_rng(seed))
+
+    # Improve the path with the selected strategy (2-opt/Or-opt local search by default)
+    with span("improve"):
+        return IMPROVEMENT_STRATEGIES[improvement](costs, path, deadline)
+
+# Decide whether to plan without a distance matrix (haversine local search on many points only)
+def use_spatial_index(n, metric=ROUTE_METRIC, improvement="local_search", solver="auto"):
+    return (
+        n >= SPATIAL_INDEX_MIN_POINTS
+        and improvement == "local_search"
+        and solver != "exact"
+        and (metric == "haversine" or get_road_network() is None)
+    )
+
+def solve_path_spatial(coordinates, start_index=0, end_index=None, deadline=None, seed=None):
+    """
+    Plan a haversine path through many points without building the distance matrix.
+
+    The nearest neighbor path and the candidate lists come from a KD-tree (O(n log n))
+    and the local search computes only the distances it looks up.
+
+    Returns:
+        tuple[list[int], bool]: The path and whether the local search converged before the deadline.
+    """
+    with span("spatial_index"):
+        index = SpatialIndex(coordinates)
+        neighbors = index.neighbor_lists(DEFAULT_NEIGHBORS)
+    with span("nearest_neighbor"):
+        path = index.nearest_neighbor_tour(start_index, end_index)
+    if seed is not None:
+        path = double_bridge(path, np.random.default_rng(seed))
+    with span("improve"):
+        return local_search_with_deadline(LazyDistances(coordinates), path, deadline, neighbors=neighbors)
+
+# Function to compute the total haversine distance of a path without a distance matrix
+def path_length(path, coordinates):
+    coordinates = np.asarray(coordinates, dtype=np.float64)[np.asarray(path)]
+    # From the first to the last point, the same as total_distance
+    return float(haversine(coordinates[:-1], coordinates[1:]).sum())
+
+def plan_coordinates(coordinates, start_index=0, end_index=None, dtype=np.float64, improvement="local_search", metric=ROUTE_METRIC, solver="auto", deadline=None, seed=None, matrices=None):
+    """
+    Plan a path through (lat, lon) coordinates, without Address objects.
+
+    Args:
+        coordinates: n (lat, lon) pairs, a list or an n x 2 array.
+        matrices (tuple): Precomputed (costs, distances) for the coordinates, see `shared_travel_matrices`.
+
+    Returns:
+        tuple[list[int], float, bool]: The path, its length in km and whether the solver converged.
+    """
+    if metric not in ROUTE_METRICS:
+        raise ValueError(f"Unknown route metric: {metric}")
+
+    if matrices is None and use_spatial_index(len(coordinates), metric, improvement, solver):
+        # Many stops: plan with a spatial index, a full matrix would take O(n^2) time and memory
+        path, converged = solve_path_spatial(coordinates, start_index, end_index, deadline, seed)
+        return path, path_length(path, coordinates), converged
+
+    if matrices is not None:
+        costs, distances = matrices
+    else:
+        # Compute all pairwise costs once, every solver stage below only does lookups
+        # (use dtype=np.float32 to halve the memory of the matrix for large address lists)
+        with span("distance_matrix"):
+            costs, distances = travel_matrices(coordinates, metric, dtype)
+
+    path, converged = solve_path(costs, start_index, end_index, improvement, solver, deadline, seed)
 
-    # Apply 2-opt optimization to the path
-    path = two_opt_fixed_endpoints(coordinates, path)
-    
     # Calculate the total distance of the found path
-    min_distance = total_distance(path, coordinates)
+    return path, total_distance(path, distances), converged
+
+def create_path(addresses: list[Address], start_index=0, end_index=None, dtype=np.float64, improvement="local_search", metric=ROUTE_METRIC, solver="auto", deadline=None, seed=None, start_address=START_ADDRESS, end_address=END_ADDRESS, matrices=None) -> ShortestPath:
+    """
+    Plan a route from the start address through all addresses to the end address.
+
+    The solver arguments (improvement, solver, deadline, seed) are passed on to `solve_path`.
+
+    Args:
+        start_address (Address): Depot where the route starts, START_ADDRESS by default.
+        end_address (Address): Depot where the route ends, END_ADDRESS by default.
+        matrices (tuple): Precomputed (costs, distances) for the start address, the
+            addresses and the end address in that order, see `shared_travel_matrices`.
+    """
+    # Add the start and end addresses to the list of addresses
+    addresses = [start_address] + addresses + [end_address]
+    coordinates = [(address.coordinates.latitude, address.coordinates.longitude) for address in addresses]
+
+    path, min_distance, converged = plan_coordinates(
+        coordinates, start_index, end_index, dtype, improvement, metric, solver, deadline, seed, matrices
+    )
 
     # Create Gmaps links for each chunk of 10 addresses
     gmaps_links = create_gmaps_links(path, addresses)
-    
-    # Return the result
-    return ShortestPath(length=min_distance, addresses=[addresses[i] for i in path], gmaps_links=gmaps_links)    
 
+    # Return the result
+    return ShortestPath(length=min_distance, addresses=[addresses[i] for i in path], gmaps_links=gmaps_links, converged=converged)
@@ -0,0 +1,263 @@
+"""
+Route sessions: a planned route kept in memory and repaired locally when stops change.
+
+Sessions live in the memory of the worker process that created them. Run the API
+with a single uvicorn worker (the default) when route sessions are used, with more
+workers a request for a session that is served by another worker gets a 404.
+"""
+
+import asyncio
+import bisect
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+from pictoroute.core.local_search import DEFAULT_NEIGHBORS, local_search_with_deadline, matrix_rows, neighbor_lists
+from pictoroute.core.route_planning import (
+    END_ADDRESS,
+    ROUTE_METRIC,
+    START_ADDRESS,
+    create_gmaps_links,
+    solve_path,
+    total_distance,
+    travel_matrices,
+    travel_rows,
+)
+from pictoroute.core.route_solver import ROUTE_TIME_BUDGET, geocode_missing_coordinates, run_in_solver_pool
+from pictoroute.models.address import Address
+from pictoroute.models.courier_route import CourierRoute
+from pictoroute.models.route_session import RouteSessionPath
+
+load_dotenv()
+
+# Sessions are kept in the memory of the worker process that created them, see above
+ROUTE_SESSION_TTL = float(os.getenv("ROUTE_SESSION_TTL_HOURS", "12")) * 3600
+ROUTE_SESSION_MAX = int(os.getenv("ROUTE_SESSION_MAX", "1000"))
+# Seconds the local repair after adding or removing a stop may take
+ROUTE_SESSION_REPAIR_BUDGET = float(os.getenv("ROUTE_SESSION_REPAIR_BUDGET", "0.5"))
+
+
+class RouteSession:
+    """
+    A route with its cost and distance matrices and nearest neighbor lists.
+
+    Adding a stop computes only the row and column of the new stop, inserts it at
+    the cheapest position and repairs the route with a local search that starts
+    around the insertion. Removing a stop joins its neighbors in the route and
+    repairs around them. The matrices are float32 numpy arrays, grown and shrunk by
+    one row and column per change.
+    """
+
+    def __init__(self, addresses, order, costs, distances, neighbors, metric, converged=True):
+        self.id = uuid.uuid4().hex
+        self.addresses = addresses  # Start depot, stops and end depot
+        self.coordinates = [(a.coordinates.latitude, a.coordinates.longitude) for a in addresses]
+        self.order = order  # Indices into addresses, in route order
+        self.costs = costs
+        self.distances = distances  # The same array as costs for haversine distances
+        self.neighbors = neighbors
+        self.metric = metric
+        self.converged = converged
+        self.updated_at = time.time()
+        self.lock = threading.Lock()
+
+    def insert(self, address: Address) -> RouteSessionPath:
+        """Add a stop (with coordinates) at the cheapest position and repair the route around it."""
+        with self.lock:
+            new = len(self.addresses)
+            cost_row, from_row, to_row = (row[0] for row in travel_rows([
+                (address.coordinates.latitude, address.coordinates.longitude)
+            ], self.coordinates, self.metric))
+
+            same = self.distances is self.costs
+            self.costs = _grow(self.costs, cost_row, cost_row)
+            self.distances = self.costs if same else _grow(self.distances, to_row, from_row)
+            self.addresses.append(address)
+            self.coordinates.append((address.coordinates.latitude, address.coordinates.longitude))
+            self._add_neighbor(new)
+
+            # Cheapest insertion between two consecutive points of the route
+            c = self.costs
+            before, after = np.asarray(self.order[:-1]), np.asarray(self.order[1:])
+            position = int(np.argmin(c[before, new] + c[new, after] - c[before, after])) + 1
+            self.order.insert(position, new)
+            self._repair([self.order[position - 1], new, self.order[position + 1]])
+            return self.shortest_path()
+
+    def remove(self, position: int) -> RouteSessionPath:
+        """Remove the stop at this position of the route and repair the route around the gap."""
+        with self.lock:
+            if not 0 < position < len(self.order) - 1:
+                raise ValueError("Only stops between the start and end can be removed.")
+            node = self.order.pop(position)
+            before, after = self.order[position - 1], self.order[position]
+
+            # Remove the row and column of the stop, the indices above it shift down by one
+            same = self.distances is self.costs
+            self.costs = _shrink(self.costs, node)
+            self.distances = self.costs if same else _shrink(self.distances, node)
+            del self.addresses[node]
+            del self.coordinates[node]
+            self.order = [i - (i > node) for i in self.order]
+            self._remove_neighbor(node)
+
+            self._repair([before - (before > node), after - (after > node)])
+            return self.shortest_path()
+
+    def _add_neighbor(self, new):
+        """Add the neighbor list of a new point and add it to the lists it belongs in."""
+        c = matrix_rows(self.costs)
+        others = [i for i in np.argsort(self.costs[new]).tolist() if i != new]
+        self.neighbors.append(others[:DEFAULT_NEIGHBORS])
+        for i, neighbors in enumerate(self.neighbors[:-1]):
+            if len(neighbors) < DEFAULT_NEIGHBORS or c[i][new] < c[i][neighbors[-1]]:
+                # Neighbor lists are sorted by cost
+                keys = [c[i][j] for j in neighbors]
+                neighbors.insert(bisect.bisect_right(keys, c[i][new]), new)
+                del neighbors[DEFAULT_NEIGHBORS:]
+
+    def _remove_neighbor(self, node):
+        """Drop a removed point from the neighbor lists, lists that contained it are recomputed."""
+        del self.neighbors[node]
+        for i, neighbors in enumerate(self.neighbors):
+            if node in neighbors:
+                row = self.costs[i].astype(np.float64)
+                row[i] = np.inf
+                k = min(DEFAULT_NEIGHBORS, len(row) - 1)
+                nearest = np.argpartition(row, k - 1)[:k] if k > 0 else np.array([], dtype=np.int64)
+                self.neighbors[i] = nearest[np.argsort(row[nearest])].tolist()
+            else:
+                self.neighbors[i] = [j - (j > node) for j in neighbors]
+
+    def _repair(self, active):
+        """Run the local search starting from the changed points only."""
+        self.order, converged = local_search_with_deadline(
+            self.costs,
+            self.order,
+            deadline=time.time() + ROUTE_SESSION_REPAIR_BUDGET,
+            neighbors=self.neighbors,
+            active=active,
+        )
+        self.converged = self.converged and converged
+        self.updated_at = time.time()
+
+    def shortest_path(self) -> RouteSessionPath:
+        """Return the current route."""
+        return RouteSessionPath(
+            session_id=self.id,
+            length=total_distance(self.order, self.distances),
+            addresses=[self.addresses[i] for i in self.order],
+            gmaps_links=create_gmaps_links(self.order, self.addresses),
+            converged=self.converged,
+        )
+
+
+def _grow(matrix: np.ndarray, column, row) -> np.ndarray:
+    """Return the matrix with one more point, `column` holds the travel to it and `row` the travel from it."""
+    n = len(matrix)
+    grown = np.empty((n + 1, n + 1), dtype=matrix.dtype)
+    grown[:n, :n] = matrix
+    grown[:n, n] = column
+    grown[n, :n] = row
+    grown[n, n] = 0.0
+    return grown
+
+
+def _shrink(matrix: np.ndarray, node: int) -> np.ndarray:
+    """Return the matrix without the row and column of a point."""
+    keep = np.arange(len(matrix)) != node
+    return matrix[np.ix_(keep, keep)]
+
+
+class RouteSessionStore:
+    """In-memory route sessions, expired after `ttl` seconds without changes, least recently used evicted first."""
+
+    def __init__(self, max_sessions: int = ROUTE_SESSION_MAX, ttl: float = ROUTE_SESSION_TTL):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions: OrderedDict[str, RouteSession] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, session: RouteSession):
+        with self._lock:
+            self._sessions[session.id] = session
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def get(self, session_id: str) -> Optional[RouteSession]:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            if time.time() - session.updated_at > self.ttl:
+                del self._sessions[session_id]
+                return None
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def remove(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+
+_default_store: Optional[RouteSessionStore] = None
+
+
+def get_route_session_store() -> RouteSessionStore:
+    """Return the route session store of this process."""
+    global _default_store
+    if _default_store is None:
+        if int(os.getenv("WEB_CONCURRENCY", "1")) > 1:
+            print("Route sessions are kept per worker process, use a single worker for route sessions")
+        _default_store = RouteSessionStore()
+    return _default_store
+
+
+async def create_route_session(
+    route: CourierRoute, time_budget: float = ROUTE_TIME_BUDGET, metric: str = ROUTE_METRIC
+) -> RouteSessionPath:
+    """
+    Plan a route in the process pool and keep it as a session for later changes.
+
+    Returns:
+        RouteSessionPath: The planned route with the ID of its session.
+    """
+    if time_budget <= 0:
+        raise ValueError("The time budget must be positive.")
+    addresses = [route.start or START_ADDRESS, *route.addresses, route.end or END_ADDRESS]
+    await geocode_missing_coordinates([addresses])
+
+    order, converged, costs, distances, neighbors = await run_in_solver_pool(
+        _plan_session, addresses, metric, time.time() + time_budget
+    )
+    session = RouteSession(
+        addresses, order, costs, costs if distances is None else distances, neighbors, metric, converged
+    )
+    get_route_session_store().add(session)
+    return session.shortest_path()
+
+
+async def insert_stop(session: RouteSession, address: Address) -> RouteSessionPath:
+    """Geocode the address when needed and add it to the session."""
+    await geocode_missing_coordinates([[address]])
+    return await asyncio.to_thread(session.insert, address)
+
+
+async def remove_stop(session: RouteSession, position: int) -> RouteSessionPath:
+    """Remove the stop at this position of the route from the session."""
+    return await asyncio.to_thread(session.remove, position)
+
+
+def _plan_session(addresses, metric, deadline):
+    coordinates = [(a.coordinates.latitude, a.coordinates.longitude) for a in addresses]
+    # float32 halves the memory of the matrices kept in the session
+    costs, distances = travel_matrices(coordinates, metric, np.float32)
+    order, converged = solve_path(costs, deadline=deadline)
+    # Distances are only sent back when they differ from the costs
+    return order, converged, costs, None if distances is costs else distances, neighbor_lists(costs)
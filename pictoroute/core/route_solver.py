@@ -0,0 +1,287 @@
+"""Route solving in a process pool, so planning never blocks the event loop."""
+
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+from pictoroute.core.clustering import cluster_stops
+from pictoroute.core.geocoding_service import get_geocoding_service
+from pictoroute.core.metrics import add_to_trace, registry, span, start_trace
+from pictoroute.core.road_network import ROAD_NETWORK_PATH, get_road_network, set_road_network
+from pictoroute.core.route_planning import (
+    END_ADDRESS,
+    ROUTE_METRIC,
+    START_ADDRESS,
+    create_path,
+    plan_coordinates,
+    shared_travel_matrices,
+)
+from pictoroute.models.address import Address
+from pictoroute.models.courier_route import CourierRoute, SplitRoute
+from pictoroute.models.shortest_path import ShortestPath
+
+load_dotenv()
+
+ROUTE_SOLVER_WORKERS = int(os.getenv("ROUTE_SOLVER_WORKERS", str(os.cpu_count() or 1)))
+# Default time budget in seconds for planning a route, the best route so far is returned after it
+ROUTE_TIME_BUDGET = float(os.getenv("ROUTE_TIME_BUDGET", "10"))
+# Maximum number of extra restarts per route, only started on otherwise idle workers
+ROUTE_SOLVER_RESTARTS = int(os.getenv("ROUTE_SOLVER_RESTARTS", "0"))
+
+_pool: Optional[ProcessPoolExecutor] = None
+_in_flight = 0
+
+
+def get_route_solver_pool() -> ProcessPoolExecutor:
+    """Return the process pool of this worker, created on first use."""
+    global _pool
+    if _pool is None:
+        # Forking a process that runs an event loop and client threads is unsafe, spawn instead.
+        # A configured road network is built once here and pickled to every worker,
+        # instead of being rebuilt from the graph file in each of them
+        road_network = get_road_network() if ROAD_NETWORK_PATH else None
+        _pool = ProcessPoolExecutor(
+            max_workers=ROUTE_SOLVER_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=set_road_network if road_network is not None else None,
+            initargs=(road_network,) if road_network is not None else (),
+        )
+    return _pool
+
+
+def warm_up_route_solver_pool():
+    """Start all worker processes ahead of the first request, they import the planner once."""
+    pool = get_route_solver_pool()
+    for _ in range(ROUTE_SOLVER_WORKERS):
+        pool.submit(_warm_up)
+
+
+def close_route_solver_pool():
+    """Shut down the process pool, used on application shutdown."""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def run_in_solver_pool(function, *args):
+    """
+    Run a function in the process pool.
+
+    Metrics and stage timings recorded in the worker are sent back with the result
+    and added to the metrics and trace of this process.
+    """
+    result, delta, trace = await asyncio.get_running_loop().run_in_executor(
+        get_route_solver_pool(), _run_instrumented, function, args
+    )
+    registry.merge(delta)
+    add_to_trace(trace)
+    return result
+
+
+async def solve_route(
+    addresses: list[Address],
+    time_budget: float = ROUTE_TIME_BUDGET,
+    restarts: int = ROUTE_SOLVER_RESTARTS,
+    **kwargs,
+) -> ShortestPath:
+    """
+    Plan a route in the process pool and return the best route found within the time budget.
+
+    Besides the regular nearest neighbor + local search run, up to `restarts` runs
+    from perturbed starting paths are started when workers are idle. The shortest
+    route of all runs is returned, its `converged` flag tells whether its local
+    search finished before the deadline.
+
+    Args:
+        addresses (list[Address]): The addresses to visit, with coordinates.
+        time_budget (float): Seconds until the best route so far is returned.
+        restarts (int): Maximum number of extra runs on idle workers.
+        **kwargs: Passed on to `create_path`.
+
+    Returns:
+        ShortestPath: The shortest route found.
+
+    Raises:
+        ValueError: When an address without coordinates can not be geocoded.
+    """
+    # Addresses the batch geocoding left without coordinates get another try here
+    await geocode_missing_coordinates([[
+        kwargs.get("start_address", START_ADDRESS), *addresses, kwargs.get("end_address", END_ADDRESS)
+    ]])
+    return await _best_of_runs(_create_path, addresses, kwargs, time_budget, restarts, key=lambda path: path.length)
+
+
+async def solve_coordinates(
+    coordinates: np.ndarray,
+    time_budget: float = ROUTE_TIME_BUDGET,
+    restarts: int = ROUTE_SOLVER_RESTARTS,
+    **kwargs,
+) -> tuple[list[int], float, bool]:
+    """
+    Plan a route through an n x 2 array of (lat, lon) coordinates in the process pool.
+
+    The same as `solve_route`, but the coordinates go to the solver as one array
+    and only the path is returned, without Address objects or Google Maps links.
+
+    Args:
+        coordinates (np.ndarray): The start, the stops and the end, in that order.
+        time_budget (float): Seconds until the best route so far is returned.
+        restarts (int): Maximum number of extra runs on idle workers.
+        **kwargs: Passed on to `plan_coordinates`.
+
+    Returns:
+        tuple[list[int], float, bool]: The path (indices into `coordinates`), its length in km
+            and whether the solver converged.
+    """
+    return await _best_of_runs(_plan_coordinates, coordinates, kwargs, time_budget, restarts, key=lambda result: result[1])
+
+
+async def _best_of_runs(function, points, kwargs: dict, time_budget: float, restarts: int, key):
+    """Run `function(points, deadline, seed, kwargs)` once plus restarts on idle workers, return the best result."""
+    global _in_flight
+    if time_budget <= 0:
+        raise ValueError("The time budget must be positive.")
+
+    # The deadline is wall clock time, so it also holds while a run waits for a free worker
+    deadline = time.time() + time_budget
+    idle = max(ROUTE_SOLVER_WORKERS - _in_flight - 1, 0)
+    seeds = [None] + list(range(1, min(max(restarts, 0), idle) + 1))
+
+    futures = [run_in_solver_pool(function, points, deadline, seed, kwargs) for seed in seeds]
+    _in_flight += len(futures)
+    try:
+        results = await asyncio.gather(*futures, return_exceptions=True)
+    finally:
+        _in_flight -= len(futures)
+
+    # The regular run decides about errors, a failed restart is only logged
+    if isinstance(results[0], BaseException):
+        raise results[0]
+    successful = []
+    for result in results:
+        if isinstance(result, BaseException):
+            print(f"Error during a route restart: {result}")
+        else:
+            successful.append(result)
+    return min(successful, key=key)
+
+
+async def solve_routes(
+    routes: list[CourierRoute],
+    time_budget: float = ROUTE_TIME_BUDGET,
+    metric: str = ROUTE_METRIC,
+) -> list[ShortestPath]:
+    """
+    Plan the routes of several couriers in parallel in the process pool.
+
+    Addresses and depots without coordinates are geocoded in one batch, so stops
+    shared between couriers are looked up once. With a road metric the travel
+    matrices of all routes are computed together, every distinct stop is routed once.
+
+    Args:
+        routes (list[CourierRoute]): The stops and depots of every courier.
+        time_budget (float): Seconds until the best routes so far are returned.
+        metric (str): The route metric, see `create_path`.
+
+    Returns:
+        list[ShortestPath]: One route per courier, in the order of `routes`.
+    """
+    global _in_flight
+    if time_budget <= 0:
+        raise ValueError("The time budget must be positive.")
+    deadline = time.time() + time_budget
+
+    routes = [
+        (route.addresses, route.start or START_ADDRESS, route.end or END_ADDRESS) for route in routes
+    ]
+    await geocode_missing_coordinates([[start, *addresses, end] for addresses, start, end in routes])
+
+    matrices = [None] * len(routes)
+    if metric != "haversine":
+        coordinate_lists = [
+            [(a.coordinates.latitude, a.coordinates.longitude) for a in [start, *addresses, end]]
+            for addresses, start, end in routes
+        ]
+        matrices = await run_in_solver_pool(shared_travel_matrices, coordinate_lists, metric)
+
+    futures = [
+        run_in_solver_pool(
+            _create_path,
+            addresses,
+            deadline,
+            None,
+            {"start_address": start, "end_address": end, "matrices": route_matrices, "metric": metric},
+        )
+        for (addresses, start, end), route_matrices in zip(routes, matrices)
+    ]
+    _in_flight += len(futures)
+    try:
+        return list(await asyncio.gather(*futures))
+    finally:
+        _in_flight -= len(futures)
+
+
+async def split_route(
+    route: SplitRoute,
+    time_budget: float = ROUTE_TIME_BUDGET,
+    metric: str = ROUTE_METRIC,
+) -> list[ShortestPath]:
+    """
+    Split one list of stops over several couriers and plan a route for each of them.
+
+    The stops are clustered with balanced k-means (no courier gets more than
+    ceil(n / couriers) stops) and every cluster is solved with `solve_routes`.
+
+    Returns:
+        list[ShortestPath]: One route per courier, fewer when there are fewer stops than couriers.
+    """
+    await geocode_missing_coordinates([route.addresses])
+    coordinates = [(a.coordinates.latitude, a.coordinates.longitude) for a in route.addresses]
+    clusters = await run_in_solver_pool(cluster_stops, coordinates, route.couriers)
+    routes = [
+        CourierRoute(
+            addresses=[route.addresses[i] for i in cluster], start=route.start, end=route.end
+        )
+        for cluster in clusters
+    ]
+    return await solve_routes(routes, time_budget=time_budget, metric=metric)
+
+
+async def geocode_missing_coordinates(address_lists: list[list[Address]]):
+    """Geocode all addresses without coordinates at once, raise a ValueError for unresolved ones."""
+    missing = [address for addresses in address_lists for address in addresses if address.coordinates is None]
+    if missing:
+        await get_geocoding_service().geocode_addresses(missing)
+    unresolved = [address for address in missing if address.coordinates is None]
+    if unresolved:
+        names = ", ".join(f"{a.street_name} {a.house_number} {a.city}" for a in unresolved)
+        raise ValueError(f"No coordinates found for: {names}")
+
+
+def _run_instrumented(function, args):
+    before = registry.snapshot()
+    trace = start_trace()
+    with span(function.__name__.strip("_")):
+        result = function(*args)
+    return result, registry.delta(before), trace
+
+
+def _create_path(addresses, deadline, seed, kwargs) -> ShortestPath:
+    return create_path(addresses, deadline=deadline, seed=seed, **kwargs)
+
+
+def _plan_coordinates(coordinates, deadline, seed, kwargs) -> tuple[list[int], float, bool]:
+    return plan_coordinates(coordinates, deadline=deadline, seed=seed, **kwargs)
+
+
+def _warm_up():
+    # Unpickling this function in a worker already imports the planner, then wait a bit
+    # so that every worker of the pool gets one of these tasks
+    time.sleep(0.1)
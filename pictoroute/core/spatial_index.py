@@ -0,0 +1,126 @@
+"""Spatial index and on-demand distances for planning routes through thousands of stops."""
+
+import math
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+EARTH_RADIUS = 6371.0
+
+# Number of candidates fetched per nearest neighbor query, grows when all of them are removed
+NEAREST_CANDIDATES = 8
+
+
+def project(coordinates) -> np.ndarray:
+    """Equirectangular projection of (lat, lon) pairs to km, accurate enough within a city."""
+    coordinates = np.radians(np.asarray(coordinates, dtype=np.float64).reshape(-1, 2))
+    scale = np.cos(coordinates[:, 0].mean()) if len(coordinates) else 1.0
+    return EARTH_RADIUS * np.column_stack([coordinates[:, 0], coordinates[:, 1] * scale])
+
+
+class SpatialIndex:
+    """
+    KD-tree on projected coordinates that supports removing points.
+
+    Removed points are skipped in queries and the tree is rebuilt from the remaining
+    points once more than half of its points are removed, so a query stays
+    O(log n) amortized while points are removed one by one.
+    """
+
+    def __init__(self, coordinates):
+        self.points = project(coordinates)
+        self.alive = np.ones(len(self.points), dtype=bool)
+        self._build()
+
+    def _build(self):
+        self.ids = np.flatnonzero(self.alive)
+        self.tree = cKDTree(self.points[self.ids]) if len(self.ids) else None
+        self.removed_since_build = 0
+
+    def remove(self, index: int):
+        """Remove a point from the index."""
+        if self.alive[index]:
+            self.alive[index] = False
+            self.removed_since_build += 1
+            if self.removed_since_build * 2 > len(self.ids):
+                self._build()
+
+    def nearest(self, index: int):
+        """Return the nearest point (that is not removed) to the point at index, None when empty."""
+        k = NEAREST_CANDIDATES
+        while self.tree is not None:
+            k = min(k, len(self.ids))
+            _, found = self.tree.query(self.points[index], k=k)
+            for candidate in self.ids[np.atleast_1d(found)].tolist():
+                if self.alive[candidate] and candidate != index:
+                    return candidate
+            if k == len(self.ids):
+                break
+            k *= 4
+        return None
+
+    def nearest_neighbor_tour(self, start_index=0, end_index=None) -> list[int]:
+        """Nearest neighbor path from start to end through all points, O(n log n)."""
+        n = len(self.points)
+        if end_index is None:
+            end_index = n - 1
+        if start_index == end_index:
+            raise ValueError("Start and end points cannot be the same.")
+
+        self.remove(start_index)
+        self.remove(end_index)
+        path = [start_index]
+        for _ in range(n - 2):
+            next_point = self.nearest(path[-1])
+            path.append(next_point)
+            self.remove(next_point)
+        path.append(end_index)
+        return path
+
+    def neighbor_lists(self, k: int) -> list[list[int]]:
+        """Return the k nearest other points of every point (removed or not), sorted by distance."""
+        n = len(self.points)
+        k = min(k, n - 1)
+        if k <= 0:
+            return [[] for _ in range(n)]
+        _, nearest = cKDTree(self.points).query(self.points, k=k + 1)
+        # A point is usually its own nearest, but not always when points coincide
+        return [[j for j in row if j != i][:k] for i, row in enumerate(nearest.tolist())]
+
+
+class _DistanceRow(dict):
+    """Distances from one point, each computed on first use."""
+
+    def __init__(self, distances, index):
+        super().__init__()
+        self.distances = distances
+        self.index = index
+
+    def __missing__(self, other):
+        value = self.distances.haversine(self.index, other)
+        self[other] = value
+        return value
+
+
+class LazyDistances(list):
+    """
+    Haversine distances (km) that can be indexed as d[a][b] like a nested list matrix.
+
+    Only the pairs that are looked up are computed and kept, the local search on a
+    tour with neighbor lists touches O(n * k) pairs instead of the full n x n matrix.
+    """
+
+    def __init__(self, coordinates):
+        radians = np.radians(np.asarray(coordinates, dtype=np.float64).reshape(-1, 2))
+        self.latitudes = radians[:, 0].tolist()
+        self.longitudes = radians[:, 1].tolist()
+        self.cos_latitudes = np.cos(radians[:, 0]).tolist()
+        super().__init__(_DistanceRow(self, index) for index in range(len(radians)))
+
+    def haversine(self, a: int, b: int) -> float:
+        a_sin = math.sin((self.latitudes[b] - self.latitudes[a]) / 2) ** 2 + (
+            self.cos_latitudes[a]
+            * self.cos_latitudes[b]
+            * math.sin((self.longitudes[b] - self.longitudes[a]) / 2) ** 2
+        )
+        return 2 * EARTH_RADIUS * math.atan2(math.sqrt(a_sin), math.sqrt(1 - a_sin))
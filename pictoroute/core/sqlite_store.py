@@ -0,0 +1,31 @@
+"""Base class for SQLite backed caches shared between threads and worker processes."""
+
+import os
+import sqlite3
+import threading
+
+
+class SQLiteStore:
+    """
+    Hands out one SQLite connection per thread and process for the database at `path`.
+
+    The database runs in WAL mode so several uvicorn workers can read and write the
+    same file concurrently.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections may not be shared between threads or forked processes
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA busy_timeout=30000")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
@@ -0,0 +1,167 @@
+"""Bounded reading of uploaded images, chunk by chunk with size limits."""
+
+import binascii
+import os
+
+from dotenv import load_dotenv
+from fastapi import UploadFile
+from starlette.responses import JSONResponse
+
+load_dotenv()
+
+# Largest accepted image and largest total of all images of one request, in MB
+UPLOAD_MAX_FILE_BYTES = int(float(os.getenv("UPLOAD_MAX_FILE_MB", "20")) * 1024 * 1024)
+UPLOAD_MAX_REQUEST_BYTES = int(float(os.getenv("UPLOAD_MAX_REQUEST_MB", "50")) * 1024 * 1024)
+# Bytes read from an upload at a time, a multiple of 3 so chunks encode to base64 without padding
+UPLOAD_CHUNK_SIZE = 3 * 64 * 1024
+# Largest accepted multipart body, the request limit plus room for the part headers and boundaries
+UPLOAD_MAX_BODY_BYTES = UPLOAD_MAX_REQUEST_BYTES + 1024 * 1024
+
+
+class UploadTooLargeError(ValueError):
+    """An upload exceeds the per-file or per-request size limit."""
+
+
+class UploadBudget:
+    """Bytes left for the uploads of one request."""
+
+    def __init__(self, max_request_bytes: int = UPLOAD_MAX_REQUEST_BYTES):
+        self.max_request_bytes = max_request_bytes
+        self.remaining = max_request_bytes
+
+    def take(self, size: int):
+        self.remaining -= size
+        if self.remaining < 0:
+            raise UploadTooLargeError(
+                f"The uploaded images exceed {self.max_request_bytes / (1024 * 1024):.3g} MB in total."
+            )
+
+
+class Base64Encoder:
+    """
+    Incremental base64 encoder.
+
+    Chunks are encoded as they arrive into one output buffer, the 0-2 bytes that do
+    not fill a 3 byte group are kept for the next chunk, so the raw upload is never
+    held in memory as a whole.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._rest = b""
+
+    def update(self, chunk: bytes):
+        view = memoryview(chunk)
+        if self._rest:
+            head = self._rest + bytes(view[: 3 - len(self._rest)])
+            view = view[3 - len(self._rest) :]
+            if len(head) < 3:
+                self._rest = head
+                return
+            self._buffer += binascii.b2a_base64(head, newline=False)
+        usable = len(view) - len(view) % 3
+        if usable:
+            self._buffer += binascii.b2a_base64(view[:usable], newline=False)
+        self._rest = bytes(view[usable:])
+
+    def finish(self) -> str:
+        """Encode the remaining bytes (with padding) and return the base64 text."""
+        if self._rest:
+            self._buffer += binascii.b2a_base64(self._rest, newline=False)
+            self._rest = b""
+        return self._buffer.decode("ascii")
+
+
+async def iter_upload(upload: UploadFile, budget: UploadBudget, max_file_bytes: int = UPLOAD_MAX_FILE_BYTES):
+    """Yield the chunks of an upload, raise an UploadTooLargeError as soon as a limit is passed."""
+    error = UploadTooLargeError(f"{upload.filename} is larger than {max_file_bytes / (1024 * 1024):.3g} MB.")
+    # The size is known up front for multipart uploads, reject those without reading them
+    if upload.size is not None and upload.size > max_file_bytes:
+        raise error
+
+    size = 0
+    while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+        size += len(chunk)
+        if size > max_file_bytes:
+            raise error
+        budget.take(len(chunk))
+        yield chunk
+
+
+async def read_upload(upload: UploadFile, budget: UploadBudget, max_file_bytes: int = UPLOAD_MAX_FILE_BYTES) -> bytes:
+    """Read an upload within the size limits."""
+    return b"".join([chunk async for chunk in iter_upload(upload, budget, max_file_bytes)])
+
+
+async def encode_upload(upload: UploadFile, budget: UploadBudget, max_file_bytes: int = UPLOAD_MAX_FILE_BYTES) -> tuple[str, bytes]:
+    """
+    Base64-encode an upload while reading it, within the size limits.
+
+    Returns:
+        tuple[str, bytes]: The base64 text and the first bytes of the upload (to detect its media type).
+    """
+    encoder = Base64Encoder()
+    head = b""
+    async for chunk in iter_upload(upload, budget, max_file_bytes):
+        if not head:
+            head = bytes(chunk[:16])
+        encoder.update(chunk)
+    return encoder.finish(), head
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Reject multipart requests with a 413 before their body is parsed.
+
+    Starlette spools the uploads of a multipart body to temporary files while parsing
+    the form, before the limits in `iter_upload` are checked. Requests with a larger
+    Content-Length are answered without reading the body, bodies without one (chunked)
+    are counted as they arrive and answered as soon as they pass the limit.
+    """
+
+    def __init__(self, app, max_body_bytes: int = UPLOAD_MAX_BODY_BYTES):
+        self.app = app
+        self.max_body_bytes = max_body_bytes
+
+    async def __call__(self, scope, receive, send):
+        headers = dict(scope.get("headers", [])) if scope["type"] == "http" else {}
+        if not headers.get(b"content-type", b"").startswith(b"multipart/"):
+            await self.app(scope, receive, send)
+            return
+
+        response = JSONResponse(
+            {"detail": f"The uploaded images exceed {UPLOAD_MAX_REQUEST_BYTES / (1024 * 1024):.3g} MB in total."},
+            status_code=413,
+        )
+        content_length = headers.get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > self.max_body_bytes:
+            await response(scope, receive, send)
+            return
+
+        received = 0
+        rejected = False
+
+        async def limited_receive():
+            nonlocal received, rejected
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_bytes:
+                    # Ends the form parsing, its error response is replaced below
+                    rejected = True
+                    return {"type": "http.disconnect"}
+            return message
+
+        answered = False
+
+        async def limited_send(message):
+            nonlocal answered
+            if not rejected:
+                await send(message)
+            elif not answered:
+                answered = True
+                await response(scope, receive, send)
+
+        await self.app(scope, limited_receive, limited_send)
+        if rejected and not answered:
+            await response(scope, receive, send)
@@ -1,5 +1,12 @@
 # app/main.py
-from fastapi import FastAPI
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from pictoroute.core.genai import close_providers, warm_up_providers
+from pictoroute.core.geocoding_service import close_geocoding_service
+from pictoroute.core.metrics import REQUEST_SECONDS, TRACE_ALL_REQUESTS, server_timing_header, start_trace
+from pictoroute.core.route_solver import close_route_solver_pool, warm_up_route_solver_pool
+from pictoroute.core.uploads import UploadSizeLimitMiddleware
 from pictoroute.routers.api import router as api_router
 
 from fastapi import FastAPI
@@ -8,8 +15,38 @@ from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 from pathlib import Path
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    warm_up_route_solver_pool()
+    await warm_up_providers()
+    yield
+    # Close pooled clients on shutdown
+    await close_geocoding_service()
+    await close_providers()
+    close_route_solver_pool()
+
+
+app = FastAPI(lifespan=lifespan)
 app.include_router(api_router)
+# Reject oversized uploads before Starlette spools them to disk
+app.add_middleware(UploadSizeLimitMiddleware)
+
+
+@app.middleware("http")
+async def record_request_timings(request: Request, call_next):
+    # Stage timings are only collected for traced requests, they are returned in a Server-Timing header
+    trace = start_trace(TRACE_ALL_REQUESTS or "x-pictoroute-trace" in request.headers)
+    start = time.perf_counter()
+    response = await call_next(request)
+    duration = time.perf_counter() - start
+
+    # The route template keeps the number of label values bounded (no session IDs)
+    route = request.scope.get("route")
+    path = getattr(route, "path", "unmatched")
+    REQUEST_SECONDS.observe(duration, method=request.method, path=path, status=response.status_code)
+    if trace is not None:
+        response.headers["Server-Timing"] = server_timing_header(trace + [("total", duration)])
+    return response
 
 # Add CORS middleware
 app.add_middleware(
@@ -0,0 +1,15 @@
+from pydantic import BaseModel, Field
+from typing import Optional
+
+from pictoroute.models.address import Address
+
+class CourierRoute(BaseModel):
+    addresses: list[Address]  # Stops of this courier
+    start: Optional[Address] = None  # Depot where the route starts, the default depot when None
+    end: Optional[Address] = None  # Depot where the route ends, the default depot when None
+
+class SplitRoute(BaseModel):
+    addresses: list[Address]  # All stops, to be split over the couriers
+    couriers: int = Field(ge=1)  # Number of couriers
+    start: Optional[Address] = None  # Depot where every route starts, the default depot when None
+    end: Optional[Address] = None  # Depot where every route ends, the default depot when None
@@ -0,0 +1,4 @@
+from pictoroute.models.shortest_path import ShortestPath
+
+class RouteSessionPath(ShortestPath):
+    session_id: str  # ID of the route session, used to add or remove stops
@@ -7,3 +7,4 @@ class ShortestPath(BaseModel):
     length: float  # Length of the path in km
     gmaps_links: list[str]  # List of Google Maps links for each chunk
     addresses: list[Address]  # List of addresses in the path
+    converged: bool = True  # False when the solver was stopped by the time budget
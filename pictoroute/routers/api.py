@@ -1,35 +1,111 @@
-from fastapi import APIRouter, File, UploadFile
-from typing import List
-from pictoroute.core.get_coordinates import append_coordinates_to_address
-from pictoroute.core.image_processing import process_images
-from pictoroute.core.route_planning import create_path
+import asyncio
+
+from fastapi import APIRouter, File, HTTPException, Query, Request, UploadFile
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+from typing import List, Literal
+from pictoroute.core.admission import ExtractionBusyError, get_extraction_limiter
+from pictoroute.core.columnar_routes import (
+    UnsupportedMediaTypeError,
+    decode_columnar_route,
+    encode_columnar_path,
+    response_media_type,
+)
+from pictoroute.core.geocoding_service import get_geocoding_service
+from pictoroute.core.image_preprocessing import UnsupportedImageError
+from pictoroute.core.image_processing import EXTRACTION_MODE, encode_images, process_images, stream_geocoded_addresses
+from pictoroute.core.metrics import registry, span
+from pictoroute.core.route_sessions import create_route_session, get_route_session_store, insert_stop, remove_stop
+from pictoroute.core.route_solver import ROUTE_SOLVER_RESTARTS, ROUTE_TIME_BUDGET, solve_coordinates, solve_route, solve_routes, split_route
 from pictoroute.models.address import Address
+from pictoroute.models.courier_route import CourierRoute, SplitRoute
+from pictoroute.models.route_session import RouteSessionPath
+from pictoroute.core.uploads import UploadTooLargeError
 from pictoroute.models.shortest_path import ShortestPath
 
 router = APIRouter()
 
 
 @router.post("/process-images")
-async def process_images_route(images: List[UploadFile] = File(...)) -> List[Address]:
+async def process_images_route(
+    images: List[UploadFile] = File(...),
+    mode: Literal["verbose", "fast"] = Query(EXTRACTION_MODE),
+) -> List[Address]:
     """
     Process a list of images and return a dict of addresses.
     
     Args:
         images (List[UploadFile]): A list of image files to be processed.
+        mode (str): "verbose" or "fast" extraction, see EXTRACTION_MODES.
         
     Returns:
         dict: A dictionary of addresses extracted from the images.
     """
-    # Process the uploaded images
-    addresses = await process_images(images)
+    # Process the uploaded images, at most EXTRACTION_MAX_JOBS at a time
+    slot = await acquire_extraction_slot()
+    try:
+        with span("extraction"):
+            addresses = await process_images(images, mode=mode)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UnsupportedImageError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    finally:
+        slot.release()
 
-    # Get coordinates for the addresses
-    addresses_with_coordinates = [append_coordinates_to_address(address) for address in addresses]
+    # Get coordinates for the addresses, concurrently and without blocking the event loop
+    with span("geocoding"):
+        addresses_with_coordinates = await get_geocoding_service().geocode_addresses(addresses)
     
     # Addresses
     return addresses_with_coordinates
 
 
+@router.post("/process-images/stream")
+async def process_images_stream_route(
+    images: List[UploadFile] = File(...),
+    mode: Literal["verbose", "fast"] = Query(EXTRACTION_MODE),
+) -> StreamingResponse:
+    """
+    Process a list of images and stream the addresses as they are extracted.
+    
+    Args:
+        images (List[UploadFile]): A list of image files to be processed.
+        mode (str): "verbose" or "fast" extraction, see EXTRACTION_MODES.
+        
+    Returns:
+        StreamingResponse: NDJSON lines of {"index": int, "address": Address}.
+    """
+    slot = await acquire_extraction_slot()
+    try:
+        # Read the uploads before streaming, the files are closed once this handler returns
+        base64_images, media_types = await encode_images(images)
+    except UploadTooLargeError as e:
+        slot.release()
+        raise HTTPException(status_code=413, detail=str(e))
+    except UnsupportedImageError as e:
+        slot.release()
+        raise HTTPException(status_code=415, detail=str(e))
+    except BaseException:
+        slot.release()
+        raise
+
+    async def stream():
+        try:
+            async for line in stream_geocoded_addresses(base64_images, media_types, mode):
+                yield line
+        finally:
+            slot.release()
+
+    # The slot is held until the stream ends, the background task also releases it
+    # when the client disconnects before the stream started
+    return StreamingResponse(
+        stream(),
+        media_type="application/x-ndjson",
+        background=BackgroundTask(slot.release),
+    )
+
+
 @router.post("/refetch-coordinates")
 async def refetch_coordinates_route(addresses: List[Address]) -> List[Address]:
     """
@@ -42,7 +118,17 @@ async def refetch_coordinates_route(addresses: List[Address]) -> List[Address]:
         dict: A dictionary of addresses with updated coordinates.
     """
     # Get coordinates for the addresses where coordinates is None, otherwise keep the existing coordinates
-    addresses_with_coordinates = [append_coordinates_to_address(address) if address.coordinates is None or address.to_update else address for address in addresses]
+    addresses_to_fetch = [address for address in addresses if address.coordinates is None and not address.to_update]
+    # Addresses a user corrected skip the geocode cache, a cached (negative) result may be for the old text
+    addresses_to_refresh = [address for address in addresses if address.to_update]
+    for address in addresses_to_refresh:
+        address.coordinates = None
+    service = get_geocoding_service()
+    await asyncio.gather(
+        service.geocode_addresses(addresses_to_fetch),
+        service.geocode_addresses(addresses_to_refresh, refresh=True),
+    )
+    addresses_with_coordinates = addresses
 
     # Set to_update to False for all addresses
     for address in addresses_with_coordinates:
@@ -53,18 +139,219 @@ async def refetch_coordinates_route(addresses: List[Address]) -> List[Address]:
 
 
 @router.post("/get-shortest-path")
-async def get_shortest_path_route(addresses: list[Address]) -> ShortestPath:
+async def get_shortest_path_route(
+    addresses: list[Address],
+    time_budget: float = Query(ROUTE_TIME_BUDGET, gt=0),
+    restarts: int = Query(ROUTE_SOLVER_RESTARTS, ge=0),
+) -> ShortestPath:
     """
     Get the shortest path through a list of addresses.
     
     Args:
         addresses (list[Address]): A list of addresses to find the shortest path through.
+        time_budget (float): Seconds after which the best path found so far is returned.
+        restarts (int): Extra solver runs from perturbed paths, only on idle workers.
         
     Returns:
         list[Address]: A list of addresses in the shortest path order.
     """
-    # Get the shortest path through the addresses
-    path = create_path(addresses)
+    # Get the shortest path through the addresses, solved in the process pool
+    try:
+        path = await solve_route(addresses, time_budget=time_budget, restarts=restarts)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
     
     # Return the addresses in the shortest path order
-    return path
\ No newline at end of file
+    return path
+
+
+# The body is read as is, so the coordinates go into one array without building models per stop
+COLUMNAR_ROUTE_SCHEMA = {
+    "type": "object",
+    "required": ["latitudes", "longitudes"],
+    "properties": {
+        "latitudes": {"type": "array", "items": {"type": "number"}},
+        "longitudes": {"type": "array", "items": {"type": "number"}},
+        "ids": {"type": "array", "items": {}},
+        "start": {"type": "array", "items": {"type": "number"}, "minItems": 2, "maxItems": 2},
+        "end": {"type": "array", "items": {"type": "number"}, "minItems": 2, "maxItems": 2},
+    },
+}
+
+
+@router.post(
+    "/get-shortest-path/columnar",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {"schema": COLUMNAR_ROUTE_SCHEMA},
+                "application/msgpack": {"schema": COLUMNAR_ROUTE_SCHEMA},
+            },
+        }
+    },
+)
+async def get_shortest_path_columnar_route(
+    request: Request,
+    time_budget: float = Query(ROUTE_TIME_BUDGET, gt=0),
+    restarts: int = Query(ROUTE_SOLVER_RESTARTS, ge=0),
+) -> Response:
+    """
+    Get the shortest path through stops sent as latitude and longitude arrays.
+    
+    For callers that already have the coordinates, see pictoroute.core.columnar_routes
+    for the JSON and msgpack formats.
+    
+    Args:
+        request (Request): JSON or msgpack body with latitudes, longitudes and optional ids and depots.
+        time_budget (float): Seconds after which the best path found so far is returned.
+        restarts (int): Extra solver runs from perturbed paths, only on idle workers.
+        
+    Returns:
+        Response: {"order": ids or indices in visiting order, "length": km, "converged": bool}.
+    """
+    content_type = request.headers.get("content-type")
+    try:
+        route = decode_columnar_route(await request.body(), content_type)
+        path, length, converged = await solve_coordinates(route.coordinates, time_budget=time_budget, restarts=restarts)
+    except UnsupportedMediaTypeError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    media_type = response_media_type(request.headers.get("accept"), content_type)
+    return Response(encode_columnar_path(route.order(path), length, converged, media_type), media_type=media_type)
+
+
+@router.post("/get-shortest-paths")
+async def get_shortest_paths_route(
+    routes: list[CourierRoute],
+    time_budget: float = Query(ROUTE_TIME_BUDGET, gt=0),
+) -> list[ShortestPath]:
+    """
+    Get the shortest path for every courier, solved in parallel.
+    
+    Args:
+        routes (list[CourierRoute]): The addresses and start/end depot of every courier.
+        time_budget (float): Seconds after which the best paths found so far are returned.
+        
+    Returns:
+        list[ShortestPath]: A path per courier, in the same order.
+    """
+    try:
+        return await solve_routes(routes, time_budget=time_budget)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+@router.post("/get-shortest-paths/split")
+async def split_shortest_paths_route(
+    route: SplitRoute,
+    time_budget: float = Query(ROUTE_TIME_BUDGET, gt=0),
+) -> list[ShortestPath]:
+    """
+    Split a list of addresses over several couriers and get the shortest path for each.
+    
+    Args:
+        route (SplitRoute): The addresses, the number of couriers and the depots.
+        time_budget (float): Seconds after which the best paths found so far are returned.
+        
+    Returns:
+        list[ShortestPath]: A path per courier.
+    """
+    try:
+        return await split_route(route, time_budget=time_budget)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+@router.post("/route-sessions")
+async def create_route_session_route(
+    route: CourierRoute,
+    time_budget: float = Query(ROUTE_TIME_BUDGET, gt=0),
+) -> RouteSessionPath:
+    """
+    Plan a route and keep it as a session, so stops can be added or removed later.
+    
+    Args:
+        route (CourierRoute): The addresses and the start/end depot.
+        time_budget (float): Seconds after which the best path found so far is returned.
+        
+    Returns:
+        RouteSessionPath: The shortest path and the ID of the session.
+    """
+    try:
+        return await create_route_session(route, time_budget=time_budget)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+@router.get("/route-sessions/{session_id}")
+async def get_route_session_route(session_id: str) -> RouteSessionPath:
+    """Get the current path of a route session."""
+    return get_route_session(session_id).shortest_path()
+
+
+@router.post("/route-sessions/{session_id}/stops")
+async def add_route_session_stop_route(session_id: str, address: Address) -> RouteSessionPath:
+    """
+    Add a stop to a route session.
+    
+    Args:
+        session_id (str): The ID of the route session.
+        address (Address): The address to add, geocoded when it has no coordinates.
+        
+    Returns:
+        RouteSessionPath: The updated path.
+    """
+    session = get_route_session(session_id)
+    try:
+        return await insert_stop(session, address)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+@router.delete("/route-sessions/{session_id}/stops/{position}")
+async def remove_route_session_stop_route(session_id: str, position: int) -> RouteSessionPath:
+    """
+    Remove a stop from a route session.
+    
+    Args:
+        session_id (str): The ID of the route session.
+        position (int): Position of the stop in the addresses of the current path.
+        
+    Returns:
+        RouteSessionPath: The updated path.
+    """
+    session = get_route_session(session_id)
+    try:
+        return await remove_stop(session, position)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+@router.delete("/route-sessions/{session_id}", status_code=204)
+async def delete_route_session_route(session_id: str):
+    """Delete a route session."""
+    if not get_route_session_store().remove(session_id):
+        raise HTTPException(status_code=404, detail="Route session not found")
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics_route() -> PlainTextResponse:
+    """Metrics of this worker process in the Prometheus text format."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+async def acquire_extraction_slot():
+    try:
+        return await get_extraction_limiter().acquire()
+    except ExtractionBusyError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+
+def get_route_session(session_id: str):
+    session = get_route_session_store().get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Route session not found")
+    return session
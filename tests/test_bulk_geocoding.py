@@ -0,0 +1,89 @@
+import asyncio
+import csv
+import json
+
+import httpx
+import pytest
+
+import pictoroute.core.geocoding_service as geocoding_service
+from pictoroute.core.bulk_geocoding import geocode_file, save_checkpoint
+from pictoroute.core.geocoding_service import GeocodingService
+
+HEADER = "street_name,house_number,postal_code,city,latitude,longitude\n"
+ROWS = [
+    "Eemplein,65,3812EA,Amersfoort,,\n",
+    "Kamp,1,3811AR,Amersfoort,52.x,5.39\n",
+    "Langestraat,2,3811AB,Amersfoort,,\n",
+]
+
+
+@pytest.fixture(autouse=True)
+def no_offline_geocoder(monkeypatch):
+    monkeypatch.setattr(geocoding_service, "get_offline_geocoder", lambda: None)
+
+
+def stub_service() -> GeocodingService:
+    async def respond(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json=[{"lat": "52.15", "lon": "5.38"}])
+
+    return GeocodingService(use_cache=False, transport=httpx.MockTransport(respond), rate_limit=1000, burst=100)
+
+
+async def run(input_path, output_path):
+    service = stub_service()
+    try:
+        return await geocode_file(str(input_path), str(output_path), service=service, progress_interval=0)
+    finally:
+        await service.aclose()
+
+
+def test_a_malformed_csv_row_is_written_through(tmp_path):
+    input_path, output_path = tmp_path / "in.csv", tmp_path / "out.csv"
+    input_path.write_text(HEADER + "".join(ROWS))
+
+    stats = asyncio.run(run(input_path, output_path))
+
+    assert stats == {"found": 2, "not_found": 0, "skipped": 0, "failed": 1}
+    rows = list(csv.DictReader(output_path.open()))
+    assert [row["street_name"] for row in rows] == ["Eemplein", "Kamp", "Langestraat"]
+    assert rows[1]["latitude"] == "52.x"
+    assert rows[2]["latitude"] == "52.15"
+    assert not (tmp_path / "out.csv.checkpoint").exists()
+
+
+def test_a_resume_continues_past_a_malformed_row(tmp_path):
+    input_path, output_path = tmp_path / "in.csv", tmp_path / "out.csv"
+    input_path.write_text(HEADER + "".join(ROWS))
+    # A run that stopped right before the malformed row
+    output_path.write_text(HEADER + ROWS[0].replace(",,", ",52.15,5.38"))
+    save_checkpoint(
+        str(output_path) + ".checkpoint",
+        str(input_path),
+        1,
+        output_path.stat().st_size,
+        {"found": 1, "not_found": 0, "skipped": 0, "failed": 0},
+    )
+
+    stats = asyncio.run(run(input_path, output_path))
+
+    assert stats == {"found": 2, "not_found": 0, "skipped": 0, "failed": 1}
+    assert [row["street_name"] for row in csv.DictReader(output_path.open())] == ["Eemplein", "Kamp", "Langestraat"]
+
+
+def test_malformed_jsonl_lines_are_written_through(tmp_path):
+    input_path, output_path = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    address = {"street_name": "Eemplein", "house_number": "65", "postal_code": "3812EA", "city": "Amersfoort"}
+    lines = [
+        json.dumps(address),
+        "{not json",
+        json.dumps({**address, "coordinates": {"latitude": "north"}}),
+        json.dumps([1, 2]),
+    ]
+    input_path.write_text("\n".join(lines) + "\n")
+
+    stats = asyncio.run(run(input_path, output_path))
+
+    assert stats == {"found": 1, "not_found": 0, "skipped": 0, "failed": 3}
+    written = output_path.read_text().splitlines()
+    assert json.loads(written[0])["coordinates"] == {"latitude": 52.15, "longitude": 5.38}
+    assert written[1:] == lines[1:]
@@ -0,0 +1,59 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from pictoroute.benchmarks.synthetic import synthetic_addresses
+from pictoroute.core.route_planning import haversine
+from pictoroute.main import app
+from pictoroute.models.address import Coordinates
+
+
+def test_columnar_and_regular_endpoints_agree_on_an_open_route():
+    # Different start and end depots, so a return leg would change the length
+    start, end = (52.13, 5.33), (52.185, 5.43)
+    addresses = synthetic_addresses(8, seed=5)
+    depot = addresses[0].model_dump()
+
+    with TestClient(app) as client:
+        regular = client.post(
+            "/get-shortest-paths",
+            json=[{
+                "addresses": [address.model_dump() for address in addresses],
+                "start": {**depot, "coordinates": Coordinates(latitude=start[0], longitude=start[1]).model_dump()},
+                "end": {**depot, "coordinates": Coordinates(latitude=end[0], longitude=end[1]).model_dump()},
+            }],
+        )
+        columnar = client.post(
+            "/get-shortest-path/columnar",
+            json={
+                "latitudes": [address.coordinates.latitude for address in addresses],
+                "longitudes": [address.coordinates.longitude for address in addresses],
+                "ids": list(range(len(addresses))),
+                "start": list(start),
+                "end": list(end),
+            },
+        )
+
+    assert regular.status_code == 200 and columnar.status_code == 200
+    path, result = regular.json()[0], columnar.json()
+    assert abs(path["length"] - result["length"]) < 1e-6
+    # From the start to the end depot, without a leg back to the start
+    points = [(a["coordinates"]["latitude"], a["coordinates"]["longitude"]) for a in path["addresses"]]
+    assert abs(result["length"] - sum(haversine(a, b) for a, b in zip(points[:-1], points[1:]))) < 1e-6
+    # The regular path includes the depots, the columnar order only the stops
+    assert [a["coordinates"] for a in path["addresses"][1:-1]] == [
+        addresses[i].coordinates.model_dump() for i in result["order"]
+    ]
+
+
+@pytest.mark.parametrize(
+    "start",
+    [[None, 5.38], ["52.1", 5.38], [52.1], [52.1, 5.38, 0.0], [True, 5.38], [10**400, 5.38], {"latitude": 52.1}, "52.1,5.38"],
+)
+def test_invalid_depots_are_rejected(start):
+    with TestClient(app) as client:
+        response = client.post(
+            "/get-shortest-path/columnar",
+            json={"latitudes": [52.15, 52.16], "longitudes": [5.38, 5.39], "start": start},
+        )
+    assert response.status_code == 422
+    assert "depot" in response.json()["detail"]
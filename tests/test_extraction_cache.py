@@ -0,0 +1,87 @@
+import base64
+import io
+import types
+
+import pytest
+from PIL import Image, ImageDraw
+
+import pictoroute.core.extraction_cache as extraction_cache
+from pictoroute.core.extraction_cache import ExtractionCache
+from pictoroute.models.address import Address
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = types.SimpleNamespace(now=1_000_000.0)
+    monkeypatch.setattr(extraction_cache, "time", types.SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+def sheet(rows: list[str]) -> str:
+    """A base64 PNG of a job list, every sheet printed on the same table template."""
+    image = Image.new("L", (800, 1100), 255)
+    draw = ImageDraw.Draw(image)
+    for i in range(26):
+        draw.line((40, 80 + i * 38, 760, 80 + i * 38), fill=0, width=2)
+    for x in (40, 300, 520, 760):
+        draw.line((x, 80, x, 80 + 25 * 38), fill=0, width=2)
+    for i, row in enumerate(rows):
+        draw.text((50, 90 + i * 38), row, fill=0)
+    data = io.BytesIO()
+    image.save(data, "PNG")
+    return base64.b64encode(data.getvalue()).decode("ascii")
+
+
+def addresses(street_name: str) -> list[Address]:
+    return [Address(street_name=street_name, house_number="1", postal_code="3812EA", city="Amersfoort")]
+
+
+def store(cache: ExtractionCache, images: list[str], street_name: str) -> str:
+    key = cache.key(images, "v1", "model")
+    cache.set(key, "v1", "model", addresses(street_name))
+    return key
+
+
+def test_exact_repeat_is_a_hit(tmp_path, clock):
+    cache = ExtractionCache(str(tmp_path / "cache.sqlite3"))
+    images = [sheet(["Kerkstraat 1"])]
+    store(cache, images, "Kerkstraat")
+
+    assert cache.get(cache.key(list(images), "v1", "model"))[0].street_name == "Kerkstraat"
+    # Another prompt version or model is another key
+    assert cache.get(cache.key(images, "v2", "model")) is None
+    assert cache.stats() == {"hits": 1, "misses": 1, "size": 1}
+
+
+def test_entries_expire_after_the_ttl(tmp_path, clock):
+    cache = ExtractionCache(str(tmp_path / "cache.sqlite3"), ttl=60)
+    key = store(cache, [sheet(["Kerkstraat 1"])], "Kerkstraat")
+
+    clock.now += 59
+    assert cache.get(key) is not None
+    clock.now += 2
+    assert cache.get(key) is None
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, clock):
+    cache = ExtractionCache(str(tmp_path / "cache.sqlite3"), max_entries=2)
+    first = store(cache, ["a"], "A")
+    clock.now += 1
+    second = store(cache, ["b"], "B")
+    clock.now += 1
+    # Reading the first entry makes the second the least recently used one
+    assert cache.get(first) is not None
+    clock.now += 1
+    third = store(cache, ["c"], "C")
+
+    assert cache.get(second) is None
+    assert cache.get(first) is not None and cache.get(third) is not None
+    assert cache.stats()["size"] == 2
+
+
+def test_a_different_sheet_on_the_same_template_does_not_match(tmp_path, clock):
+    cache = ExtractionCache(str(tmp_path / "cache.sqlite3"))
+    store(cache, [sheet([f"Kerkstraat {i}  3812EA Amersfoort" for i in range(20)])], "Kerkstraat")
+
+    other = [sheet([f"Kerkstraat {i}  3812EA Amersfoort" for i in range(19)] + ["Dorpsweg 9  3811AB Amersfoort"])]
+    assert cache.get(cache.key(other, "v1", "model")) is None
@@ -0,0 +1,101 @@
+import os
+import subprocess
+import sys
+import types
+
+import pytest
+
+import pictoroute.core.geocode_cache as geocode_cache
+from pictoroute.core.geocode_cache import GEOCODE_CACHE_ACCESS_INTERVAL, NOT_FOUND, GeocodeCache
+from pictoroute.models.address import Address, Coordinates
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = types.SimpleNamespace(now=1_000_000.0)
+    monkeypatch.setattr(geocode_cache, "time", types.SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+def address(street_name: str, house_number: str = "1") -> Address:
+    return Address(street_name=street_name, house_number=house_number, postal_code="3812EA", city="Amersfoort")
+
+
+AMERSFOORT = Coordinates(latitude=52.1588, longitude=5.382)
+
+
+def test_a_stored_address_is_a_hit(tmp_path, clock):
+    cache = GeocodeCache(str(tmp_path / "cache.sqlite3"))
+    cache.set(address("Eemplein", "65"), AMERSFOORT)
+
+    # The key is normalized, so spacing and case do not matter
+    same = Address(street_name=" eemplein", house_number="65 ", postal_code="3812 ea", city="AMERSFOORT")
+    assert cache.get(same) == AMERSFOORT
+    assert cache.get(address("Eemplein", "66")) is None
+    assert cache.stats() == {"hits": 1, "negative_hits": 0, "misses": 1, "size": 1}
+
+
+def test_entries_expire_after_the_ttl(tmp_path, clock):
+    cache = GeocodeCache(str(tmp_path / "cache.sqlite3"), ttl=100, negative_ttl=10)
+    cache.set(address("Eemplein"), AMERSFOORT)
+
+    clock.now += 100
+    assert cache.get(address("Eemplein")) == AMERSFOORT
+    clock.now += 1
+    assert cache.get(address("Eemplein")) is None
+
+
+def test_negative_entries_expire_after_the_negative_ttl(tmp_path, clock):
+    cache = GeocodeCache(str(tmp_path / "cache.sqlite3"), ttl=100, negative_ttl=10)
+    cache.set(address("Nergensstraat"), None)
+
+    clock.now += 10
+    assert cache.get(address("Nergensstraat")) is NOT_FOUND
+    clock.now += 1
+    assert cache.get(address("Nergensstraat")) is None
+
+    # Expired entries are removed on the next write
+    cache.set(address("Eemplein"), AMERSFOORT)
+    assert cache.stats()["size"] == 1
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, clock):
+    cache = GeocodeCache(str(tmp_path / "cache.sqlite3"), ttl=10**9, max_entries=2)
+    cache.set(address("Eerste"), AMERSFOORT)
+    clock.now += 1
+    cache.set(address("Tweede"), AMERSFOORT)
+    # Reads only update the last access once per interval
+    clock.now += GEOCODE_CACHE_ACCESS_INTERVAL + 1
+    assert cache.get(address("Eerste")) == AMERSFOORT
+    cache.set(address("Derde"), AMERSFOORT)
+
+    assert cache.get(address("Tweede")) is None
+    assert cache.get(address("Eerste")) == AMERSFOORT and cache.get(address("Derde")) == AMERSFOORT
+    assert cache.stats()["size"] == 2
+
+
+def test_the_cache_is_warmed_from_a_csv_file(tmp_path):
+    csv_path = tmp_path / "customers_geocoded.csv"
+    csv_path.write_text(
+        "street_name,house_number,postal_code,city,latitude,longitude\n"
+        "Eemplein,65,3812EA,Amersfoort,52.1588,5.382\n"
+        "Kamp,1,3811AR,Amersfoort,,\n"
+        "Langestraat,2,3811AB,Amersfoort,52.x,5.39\n"
+        "Hof,3,3811CJ,Amersfoort,52.156,5.388\n"
+    )
+    database = tmp_path / "cache.sqlite3"
+
+    result = subprocess.run(
+        [sys.executable, "-m", "pictoroute.core.geocode_cache", str(csv_path)],
+        env={**os.environ, "GEOCODE_CACHE_PATH": str(database)},
+        capture_output=True,
+        text=True,
+        timeout=120,
+    )
+
+    assert result.returncode == 0, result.stderr
+    assert f"Added 2 addresses from {csv_path}" in result.stdout
+    cache = GeocodeCache(str(database))
+    hof = Address(street_name="Hof", house_number="3", postal_code="3811CJ", city="Amersfoort")
+    assert cache.get(hof) == Coordinates(latitude=52.156, longitude=5.388)
+    assert cache.stats()["size"] == 2
@@ -0,0 +1,85 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import pictoroute.core.geocoding_service as geocoding_service
+from pictoroute.core.geocoding_service import GeocodingService
+from pictoroute.models.address import Address
+
+
+def address(street_name: str) -> Address:
+    return Address(street_name=street_name, house_number="1", postal_code="3812EA", city="Amersfoort")
+
+
+@pytest.fixture(autouse=True)
+def no_offline_geocoder(monkeypatch):
+    monkeypatch.setattr(geocoding_service, "get_offline_geocoder", lambda: None)
+
+
+def stub_service(handler, **kwargs) -> GeocodingService:
+    """A service against a stub Nominatim that answers with `handler(query)`."""
+
+    async def respond(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json=await handler(request.url.params["q"]))
+
+    return GeocodingService(use_cache=False, transport=httpx.MockTransport(respond), **kwargs)
+
+
+def test_duplicate_addresses_are_looked_up_once():
+    queries = []
+
+    async def handler(query):
+        queries.append(query)
+        return [{"lat": "52.1", "lon": "5.3"}]
+
+    async def run():
+        service = stub_service(handler, rate_limit=1000, burst=100)
+        addresses = [address("Eemplein"), address("eemplein "), address("Kamp")]
+        await service.geocode_addresses(addresses)
+        await service.aclose()
+        return addresses
+
+    addresses = asyncio.run(run())
+    assert len(queries) == 2
+    assert all(a.coordinates is not None and a.coordinates.latitude == 52.1 for a in addresses)
+
+
+def test_requests_stay_within_the_rate_limit():
+    sent_at = []
+
+    async def handler(query):
+        sent_at.append(time.monotonic())
+        return [{"lat": "52.1", "lon": "5.3"}]
+
+    async def run():
+        service = stub_service(handler, rate_limit=20, burst=1, max_concurrency=4)
+        await service.geocode_addresses([address(f"Straat{i}") for i in range(6)])
+        await service.aclose()
+
+    asyncio.run(run())
+    assert len(sent_at) == 6
+    # 6 requests at 20 per second with a burst of 1 take at least 5 intervals of 0.05 s
+    assert sent_at[-1] - sent_at[0] >= 5 / 20 * 0.9
+
+
+def test_unresolved_addresses_are_returned_at_the_deadline():
+    async def handler(query):
+        if query.startswith("Traag"):
+            await asyncio.sleep(5)
+        return [{"lat": "52.1", "lon": "5.3"}]
+
+    async def run():
+        service = stub_service(handler, rate_limit=1000, burst=100)
+        addresses = [address("Snel"), address("Traag")]
+        start = time.monotonic()
+        await service.geocode_addresses(addresses, deadline=0.5)
+        elapsed = time.monotonic() - start
+        await service.aclose()
+        return addresses, elapsed
+
+    (fast, slow), elapsed = asyncio.run(run())
+    assert elapsed < 2
+    assert fast.coordinates is not None
+    assert slow.coordinates is None
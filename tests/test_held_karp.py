@@ -0,0 +1,86 @@
+import itertools
+
+import numpy as np
+import pytest
+
+import pictoroute.core.held_karp as held_karp
+import pictoroute.core.route_planning as route_planning
+from pictoroute.core.held_karp import held_karp_fixed_endpoints, held_karp_memory_bytes
+from pictoroute.core.route_planning import solve_path, use_exact_solver
+
+
+def length(path, distances) -> float:
+    return sum(distances[a][b] for a, b in zip(path[:-1], path[1:]))
+
+
+def brute_force(distances, start_index, end_index) -> float:
+    stops = [i for i in range(len(distances)) if i not in (start_index, end_index)]
+    return min(
+        length([start_index, *order, end_index], distances) for order in itertools.permutations(stops)
+    )
+
+
+def random_instance(n: int, seed: int, symmetric: bool) -> list[list[float]]:
+    rng = np.random.default_rng(seed)
+    if symmetric:
+        points = rng.random((n, 2))
+        distances = np.linalg.norm(points[:, None] - points[None, :], axis=-1)
+    else:
+        distances = rng.random((n, n))
+        np.fill_diagonal(distances, 0.0)
+    return distances.tolist()
+
+
+@pytest.mark.parametrize("stops", range(0, 10))
+@pytest.mark.parametrize("symmetric", [True, False])
+def test_held_karp_finds_the_shortest_path_to_the_last_point(stops, symmetric):
+    distances = random_instance(stops + 2, seed=stops, symmetric=symmetric)
+
+    path = held_karp_fixed_endpoints(distances)
+
+    assert path[0] == 0 and path[-1] == stops + 1
+    assert sorted(path) == list(range(stops + 2))
+    assert length(path, distances) == pytest.approx(brute_force(distances, 0, stops + 1))
+
+
+@pytest.mark.parametrize("stops", [1, 4, 7])
+def test_held_karp_finds_the_shortest_path_to_a_fixed_end(stops):
+    distances = random_instance(stops + 2, seed=10 + stops, symmetric=False)
+    start_index, end_index = stops, 0
+
+    path = held_karp_fixed_endpoints(distances, start_index, end_index)
+
+    assert path[0] == start_index and path[-1] == end_index
+    assert sorted(path) == list(range(stops + 2))
+    assert length(path, distances) == pytest.approx(brute_force(distances, start_index, end_index))
+
+
+def test_held_karp_refuses_the_same_start_and_end():
+    with pytest.raises(ValueError):
+        held_karp_fixed_endpoints(random_instance(4, seed=0, symmetric=True), 1, 1)
+
+
+def test_held_karp_refuses_tables_above_the_memory_limit(monkeypatch):
+    monkeypatch.setattr(held_karp, "HELD_KARP_MAX_BYTES", held_karp_memory_bytes(6) - 1)
+    distances = random_instance(6, seed=0, symmetric=True)
+    with pytest.raises(ValueError):
+        held_karp_fixed_endpoints(distances)
+    # Smaller tables are still solved
+    assert len(held_karp_fixed_endpoints(random_instance(5, seed=0, symmetric=True))) == 5
+
+
+def test_the_heuristic_is_used_above_the_memory_limit(monkeypatch):
+    distances = np.asarray(random_instance(10, seed=1, symmetric=True))
+    assert use_exact_solver(10, time_budget=10)
+
+    monkeypatch.setattr(route_planning, "HELD_KARP_MAX_BYTES", held_karp_memory_bytes(10) - 1)
+    assert not use_exact_solver(10, time_budget=10)
+    assert use_exact_solver(9, time_budget=10)
+
+    def exact_solver(*args):
+        raise AssertionError("The exact solver was used above the memory limit")
+
+    monkeypatch.setattr(route_planning, "held_karp_fixed_endpoints", exact_solver)
+    path, converged = solve_path(distances, solver="auto")
+    assert converged
+    assert path[0] == 0 and path[-1] == 9 and sorted(path) == list(range(10))
@@ -0,0 +1,24 @@
+from pictoroute.core.image_processing import deduplicate_addresses
+from pictoroute.models.address import Address
+
+
+def address(street_name: str, house_number: str, postal_code: str) -> Address:
+    return Address(street_name=street_name, house_number=house_number, postal_code=postal_code, city="Amersfoort")
+
+
+def test_repeats_with_a_postal_code_are_dropped():
+    addresses = [
+        address("Kerkstraat", "12", "3811 AB"),
+        address("Kerkstr.", "12 ", "3811ab"),
+        address("Kerkstraat", "12a", "3811AB"),
+    ]
+    assert deduplicate_addresses(addresses) == [addresses[0], addresses[2]]
+
+
+def test_addresses_without_a_postal_code_are_told_apart_by_street():
+    addresses = [
+        address("Kerkstraat", "12", ""),
+        address("Dorpsstraat", "12", ""),
+        address("kerkstraat ", "12", ""),
+    ]
+    assert deduplicate_addresses(addresses) == addresses[:2]
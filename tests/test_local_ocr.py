@@ -0,0 +1,56 @@
+import pytest
+
+from pictoroute.core.local_ocr import parse_dutch_address
+
+
+@pytest.mark.parametrize(
+    "text, street_name, house_number, postal_code, city",
+    [
+        ("Eemplein 65 3812EA Amersfoort", "Eemplein", "65", "3812EA", "Amersfoort"),
+        ("Eemplein 65, 3812 EA  Amersfoort", "Eemplein", "65", "3812EA", "Amersfoort"),
+        # The house number glued to the postal code
+        ("Eemplein 84 | 1234AB84 Amersfoort", "Eemplein", "84", "1234AB", "Amersfoort"),
+        # Ordinal street names
+        ("2e Hugo de Grootstraat 12 2518EK Den Haag", "2e Hugo de Grootstraat", "12", "2518EK", "Den Haag"),
+        ("1ste Loosdrechtseweg 3 1215JA Hilversum", "1ste Loosdrechtseweg", "3", "1215JA", "Hilversum"),
+        # House number suffixes
+        ("Kerkstraat 12a 3811AB Amersfoort", "Kerkstraat", "12a", "3811AB", "Amersfoort"),
+        ("Kerkstraat 12 A 3811AB Amersfoort", "Kerkstraat", "12A", "3811AB", "Amersfoort"),
+        ("Kerkstraat 12-3 3811AB Amersfoort", "Kerkstraat", "12-3", "3811AB", "Amersfoort"),
+        ("Kerkstraat 12-3 3811AB12 Amersfoort", "Kerkstraat", "12-3", "3811AB", "Amersfoort"),
+        # Text in another cell before the street
+        ("Jansen | Kerkstraat 12 | 3811AB | Amersfoort", "Kerkstraat", "12", "3811AB", "Amersfoort"),
+    ],
+)
+def test_addresses_are_parsed_with_full_confidence(text, street_name, house_number, postal_code, city):
+    address, confidence = parse_dutch_address(text)
+    assert (address.street_name, address.house_number, address.postal_code, address.city) == (
+        street_name, house_number, postal_code, city
+    )
+    assert confidence == 1.0
+
+
+@pytest.mark.parametrize(
+    "text, house_number",
+    [
+        # The house number after the postal code differs from the one after the street
+        ("Eemplein 65 | 1234AB84 Amersfoort", "65"),
+        # No city
+        ("Kerkstraat 12/2 3811AB", "12/2"),
+    ],
+)
+def test_doubtful_parses_get_a_lower_confidence(text, house_number):
+    address, confidence = parse_dutch_address(text)
+    assert address.house_number == house_number
+    assert confidence <= 0.5
+
+
+def test_text_glued_before_the_street_lowers_the_confidence():
+    address, confidence = parse_dutch_address("0612345678 Kerkstraat 12 3811AB Amersfoort")
+    assert (address.street_name, address.house_number) == ("Kerkstraat", "12")
+    assert confidence <= 0.5
+
+
+@pytest.mark.parametrize("text", ["", "geen adres hier", "Kerkstraat 12 Amersfoort", "3811AB Amersfoort"])
+def test_text_without_an_address_is_not_parsed(text):
+    assert parse_dutch_address(text) is None
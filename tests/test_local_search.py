@@ -0,0 +1,70 @@
+import time
+
+import numpy as np
+import pytest
+
+from pictoroute.core.local_search import double_bridge, local_search_with_deadline
+from pictoroute.core.route_planning import total_distance
+
+
+def random_matrix(n: int, seed: int, dtype) -> np.ndarray:
+    points = np.random.default_rng(seed).random((n, 2))
+    return np.linalg.norm(points[:, None] - points[None, :], axis=-1).astype(dtype)
+
+
+def random_path(n: int, seed: int) -> list[int]:
+    rng = np.random.default_rng(seed + 1000)
+    start, end = rng.choice(n, size=2, replace=n < 2).tolist()
+    middle = [node for node in rng.permutation(n).tolist() if node not in (start, end)]
+    return [start, *middle, end] if n > 1 else [start]
+
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+@pytest.mark.parametrize("n", [1, 2, 3, 4, 5, 8, 30, 120])
+def test_local_search_keeps_the_endpoints_and_never_gets_longer(n, dtype):
+    for seed in range(5):
+        distances = random_matrix(n, seed, dtype)
+        path = random_path(n, seed)
+
+        result, converged = local_search_with_deadline(distances, path, k=8)
+
+        assert converged
+        assert sorted(result) == sorted(path)
+        assert result[0] == path[0] and result[-1] == path[-1]
+        assert total_distance(result, distances) <= total_distance(path, distances) + 1e-6
+
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_nested_lists_give_the_same_path_as_arrays(dtype):
+    distances = random_matrix(40, 1, dtype)
+    path = random_path(40, 1)
+    assert local_search_with_deadline(distances, path)[0] == local_search_with_deadline(distances.tolist(), path)[0]
+
+
+def test_points_on_a_line_are_sorted():
+    points = np.arange(12, dtype=np.float64)
+    distances = np.abs(points[:, None] - points[None, :])
+    path = [0, *np.random.default_rng(3).permutation(np.arange(1, 11)).tolist(), 11]
+
+    result, converged = local_search_with_deadline(distances, path)
+
+    assert converged and result == list(range(12))
+
+
+def test_an_expired_deadline_still_returns_a_valid_path():
+    distances = random_matrix(200, 2, np.float64)
+    path = random_path(200, 2)
+
+    result, converged = local_search_with_deadline(distances, path, deadline=time.time() - 1)
+
+    assert not converged
+    assert sorted(result) == sorted(path) and result[0] == path[0] and result[-1] == path[-1]
+    assert total_distance(result, distances) <= total_distance(path, distances) + 1e-9
+
+
+def test_double_bridge_keeps_the_endpoints():
+    rng = np.random.default_rng(0)
+    path = list(range(10))
+    for _ in range(20):
+        perturbed = double_bridge(path, rng)
+        assert sorted(perturbed) == path and perturbed[0] == 0 and perturbed[-1] == 9
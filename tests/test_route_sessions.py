@@ -0,0 +1,121 @@
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from pictoroute.benchmarks.synthetic import synthetic_addresses
+from pictoroute.core.local_search import neighbor_lists
+from pictoroute.core.route_planning import END_ADDRESS, START_ADDRESS, distance_matrix, haversine
+from pictoroute.core.route_sessions import RouteSession, RouteSessionStore, _plan_session
+from pictoroute.main import app
+
+
+def new_session(stops: int = 12, seed: int = 0) -> RouteSession:
+    addresses = [START_ADDRESS, *synthetic_addresses(stops, seed=seed), END_ADDRESS]
+    order, converged, costs, distances, neighbors = _plan_session(addresses, "haversine", None)
+    return RouteSession(addresses, order, costs, costs if distances is None else distances, neighbors, "haversine", converged)
+
+
+def assert_valid(session: RouteSession, start, end):
+    n = len(session.addresses)
+    # A path over every address once, from the start depot to the end depot
+    assert sorted(session.order) == list(range(n))
+    assert session.addresses[session.order[0]] is start
+    assert session.addresses[session.order[-1]] is end
+
+    # The grown and shrunk matrices match matrices computed from scratch
+    assert session.costs.dtype == np.float32 and session.costs.shape == (n, n)
+    np.testing.assert_allclose(session.costs, distance_matrix(session.coordinates, np.float32), atol=1e-4)
+    # As do the neighbor lists (as sets, the order of equal costs may differ)
+    assert [set(neighbors) for neighbors in session.neighbors] == [
+        set(neighbors) for neighbors in neighbor_lists(session.costs)
+    ]
+
+    path = session.shortest_path()
+    points = [(a.coordinates.latitude, a.coordinates.longitude) for a in path.addresses]
+    assert path.length == pytest.approx(sum(haversine(a, b) for a, b in zip(points[:-1], points[1:])), abs=1e-3)
+
+
+def test_the_path_stays_valid_after_every_change():
+    session = new_session()
+    start, end = session.addresses[0], session.addresses[-1]
+    assert_valid(session, start, end)
+
+    for address in synthetic_addresses(6, seed=1):
+        session.insert(address)
+        assert_valid(session, start, end)
+
+    # The third removal is the last stop before the end depot
+    for position in (1, 5, 16, 3):
+        removed = session.addresses[session.order[position]]
+        session.remove(position)
+        assert removed not in session.addresses
+        assert_valid(session, start, end)
+
+
+def test_the_last_stop_can_be_removed_and_added_again():
+    session = new_session(stops=1)
+    start, end = session.addresses[0], session.addresses[-1]
+    stop = session.addresses[session.order[1]]
+
+    session.remove(1)
+    assert session.order == [0, 1]
+    session.insert(stop)
+    assert_valid(session, start, end)
+
+
+@pytest.mark.parametrize("position", [0, 13, 14, -1])
+def test_the_depots_can_not_be_removed(position):
+    session = new_session()
+    order = list(session.order)
+    with pytest.raises(ValueError):
+        session.remove(position)
+    assert session.order == order
+
+
+def test_sessions_expire_after_the_ttl():
+    store = RouteSessionStore(ttl=60)
+    session = new_session(stops=3)
+    store.add(session)
+
+    session.updated_at -= 59
+    assert store.get(session.id) is session
+    session.updated_at -= 2
+    assert store.get(session.id) is None
+
+
+def test_the_least_recently_used_session_is_evicted():
+    store = RouteSessionStore(max_sessions=2)
+    first, second, third = (new_session(stops=3, seed=seed) for seed in range(3))
+    store.add(first)
+    store.add(second)
+    # Reading the first session makes the second the least recently used one
+    assert store.get(first.id) is first
+    store.add(third)
+
+    assert store.get(second.id) is None
+    assert store.get(first.id) is first and store.get(third.id) is third
+
+
+def test_the_api_refuses_to_remove_the_depots():
+    addresses = synthetic_addresses(6, seed=2)
+    with TestClient(app) as client:
+        created = client.post(
+            "/route-sessions",
+            json={"addresses": [address.model_dump() for address in addresses]},
+            params={"time_budget": 2},
+        )
+        assert created.status_code == 200
+        session_id = created.json()["session_id"]
+
+        assert client.delete(f"/route-sessions/{session_id}/stops/0").status_code == 422
+        assert client.delete(f"/route-sessions/{session_id}/stops/7").status_code == 422
+
+        added = client.post(f"/route-sessions/{session_id}/stops", json=synthetic_addresses(1, seed=3)[0].model_dump())
+        assert added.status_code == 200 and len(added.json()["addresses"]) == 9
+
+        removed = client.delete(f"/route-sessions/{session_id}/stops/1")
+        assert removed.status_code == 200 and len(removed.json()["addresses"]) == 8
+        assert removed.json()["addresses"][0] == START_ADDRESS.model_dump()
+
+        assert client.delete(f"/route-sessions/{session_id}").status_code == 204
+        assert client.get(f"/route-sessions/{session_id}").status_code == 404
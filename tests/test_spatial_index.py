@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+import pictoroute.core.route_planning as route_planning
+from pictoroute.benchmarks.synthetic import synthetic_addresses
+from pictoroute.core.route_planning import distance_matrix, path_length, plan_coordinates, solve_path, solve_path_spatial
+from pictoroute.core.spatial_index import LazyDistances
+
+
+def coordinates(n: int, seed: int) -> list[tuple[float, float]]:
+    return [(a.coordinates.latitude, a.coordinates.longitude) for a in synthetic_addresses(n, seed=seed)]
+
+
+def assert_valid(path, n, start_index, end_index):
+    assert sorted(path) == list(range(n))
+    assert path[0] == start_index and path[-1] == end_index
+
+
+@pytest.mark.parametrize("start_index, end_index", [(0, None), (17, 3)])
+def test_spatial_path_is_close_to_the_dense_solver(start_index, end_index):
+    points = coordinates(600, seed=4)
+    expected_end = len(points) - 1 if end_index is None else end_index
+
+    path, converged = solve_path_spatial(points, start_index, end_index)
+    dense_path, _ = solve_path(distance_matrix(points), start_index, end_index, solver="heuristic")
+
+    assert converged
+    assert_valid(path, len(points), start_index, expected_end)
+    # Both are local optima of the same moves, from the same nearest neighbor start
+    assert path_length(path, points) <= path_length(dense_path, points) * 1.03
+
+
+def test_lazy_distances_match_the_distance_matrix():
+    points = coordinates(50, seed=5)
+    lazy, dense = LazyDistances(points), distance_matrix(points)
+    for a, b in [(0, 1), (7, 42), (42, 7), (13, 13)]:
+        assert lazy[a][b] == pytest.approx(dense[a][b])
+
+
+def test_many_points_are_planned_with_the_spatial_index(monkeypatch):
+    monkeypatch.setattr(route_planning, "SPATIAL_INDEX_MIN_POINTS", 100)
+    points = [(52.13, 5.33), *coordinates(150, seed=6), (52.185, 5.43)]
+
+    def dense_matrix(*args, **kwargs):
+        raise AssertionError("A distance matrix was built above SPATIAL_INDEX_MIN_POINTS")
+
+    monkeypatch.setattr(route_planning, "travel_matrices", dense_matrix)
+    path, length, converged = plan_coordinates(points, metric="haversine")
+
+    assert_valid(path, len(points), 0, len(points) - 1)
+    assert length == pytest.approx(path_length(path, points))
+    assert np.isfinite(length)
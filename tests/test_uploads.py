@@ -0,0 +1,147 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import pictoroute.core.admission as admission
+import pictoroute.routers.api as api
+from pictoroute.core.admission import ExtractionBusyError, ExtractionLimiter
+from pictoroute.core.uploads import UPLOAD_MAX_BODY_BYTES, UPLOAD_MAX_FILE_BYTES, UPLOAD_MAX_REQUEST_BYTES
+from pictoroute.main import app
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    limiter = ExtractionLimiter(max_jobs=1, max_queued=1, queue_timeout=5)
+    monkeypatch.setattr(admission, "_default_limiter", limiter)
+    return limiter
+
+
+@pytest.fixture
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+def upload(size: int, name: str = "sheet.png"):
+    # PNG bytes that can not be decoded are sent as they are, so only the size limits apply
+    return ("images", (name, PNG_SIGNATURE + bytes(size - len(PNG_SIGNATURE)), "image/png"))
+
+
+@pytest.mark.parametrize("path", ["/process-images", "/process-images/stream"])
+def test_an_image_above_the_file_limit_is_rejected(client, limiter, path):
+    response = client.post(path, files=[upload(UPLOAD_MAX_FILE_BYTES + 1)])
+
+    assert response.status_code == 413
+    assert "sheet.png" in response.json()["detail"]
+    assert limiter.running == 0
+
+
+def test_images_above_the_request_limit_are_rejected(client, limiter):
+    # Every image is below the file limit and the body below the early limit of the middleware
+    size = UPLOAD_MAX_REQUEST_BYTES // 3 + 1024
+    assert size <= UPLOAD_MAX_FILE_BYTES and 3 * size < UPLOAD_MAX_BODY_BYTES - 64 * 1024
+
+    response = client.post("/process-images", files=[upload(size, f"sheet{i}.png") for i in range(3)])
+
+    assert response.status_code == 413
+    assert "in total" in response.json()["detail"]
+    assert limiter.running == 0
+
+
+def test_a_large_content_length_is_rejected_before_the_form_is_read(client, monkeypatch):
+    async def acquire_extraction_slot():
+        raise AssertionError("The endpoint was called")
+
+    monkeypatch.setattr(api, "acquire_extraction_slot", acquire_extraction_slot)
+
+    # The Content-Length announces more than the limit, the body is never read
+    def body():
+        for _ in range(4):
+            yield b"x" * 1024
+
+    response = client.post(
+        "/process-images",
+        content=body(),
+        headers={
+            "content-type": "multipart/form-data; boundary=boundary",
+            "content-length": str(UPLOAD_MAX_BODY_BYTES + 1),
+        },
+    )
+
+    assert response.status_code == 413
+
+
+def test_a_chunked_body_is_cut_off_at_the_limit(client, monkeypatch):
+    async def acquire_extraction_slot():
+        raise AssertionError("The endpoint was called")
+
+    monkeypatch.setattr(api, "acquire_extraction_slot", acquire_extraction_slot)
+    chunk = b"x" * (1024 * 1024)
+
+    def body():
+        yield b"--boundary\r\nContent-Disposition: form-data; name=\"images\"; filename=\"a.png\"\r\n\r\n"
+        for _ in range(UPLOAD_MAX_BODY_BYTES // len(chunk) + 2):
+            yield chunk
+
+    response = client.post(
+        "/process-images", content=body(), headers={"content-type": "multipart/form-data; boundary=boundary"}
+    )
+
+    assert response.status_code == 413
+
+
+def busy_limiter(monkeypatch, **kwargs) -> ExtractionLimiter:
+    """A limiter whose only slot is taken."""
+    limiter = ExtractionLimiter(max_jobs=1, **kwargs)
+    asyncio.run(limiter.acquire())
+    monkeypatch.setattr(admission, "_default_limiter", limiter)
+    return limiter
+
+
+def test_a_full_queue_is_answered_with_429_and_retry_after(client, monkeypatch):
+    busy_limiter(monkeypatch, max_queued=0)
+
+    response = client.post("/process-images", files=[upload(1024)])
+
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+
+
+def test_a_job_that_waits_too_long_is_answered_with_429(client, monkeypatch):
+    limiter = busy_limiter(monkeypatch, max_queued=1, queue_timeout=0.2)
+
+    response = client.post("/process-images/stream", files=[upload(1024)])
+
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    assert limiter.waiting == 0
+
+
+def test_the_limiter_queues_times_out_and_rejects():
+    async def run():
+        limiter = ExtractionLimiter(max_jobs=1, max_queued=1, queue_timeout=0.2)
+        first = await limiter.acquire()
+
+        # The second job waits in the queue, a third one is rejected right away
+        second = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0.05)
+        with pytest.raises(ExtractionBusyError):
+            await limiter.acquire()
+
+        # The queued job gets the slot once the first one is done
+        first.release()
+        first.release()
+        slot = await second
+        assert limiter.running == 1
+
+        # Without a release the next job times out in the queue
+        with pytest.raises(ExtractionBusyError) as error:
+            await limiter.acquire()
+        assert error.value.retry_after >= 1
+        slot.release()
+        assert limiter.running == 0 and limiter.waiting == 0
+
+    asyncio.run(run())